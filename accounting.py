@@ -0,0 +1,228 @@
+#! /usr/bin/python
+"""
+This module contains the accounting of the resources used by each TALYS
+run. TALYS is reaped with os.wait4, which gives the resource usage of that
+one child, and the usage of every job is appended to the run log of the
+campaign, runs.jsonl, which this script summarises.
+Syntax:
+python accounting.py TALYS-calculations-directory/runs.jsonl [--by N]
+
+The summary tells how much of the wall time TALYS spent on the CPU and how
+much memory it needed, so --mem-per-cpu can be set from the largest
+resident set size instead of guessed.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+# ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+# ru_inblock and ru_oublock count blocks of 512 bytes
+BLOCK_SIZE = 512
+
+
+def usage_of(rusage, wall, status=0):
+    """ The resource usage of a process as a dict
+
+    Parameters: rusage: the resource usage from os.wait4
+                wall: the wall time in seconds
+                status: the exit status from os.wait4
+    Returns:    dict of the wall, user and system time in seconds, the
+                maximum resident set size in bytes, the minor and major
+                page faults, the bytes read and written by block I/O and
+                the exit code, negative if killed by a signal
+    """
+    if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    return {"wall": wall,
+            "user": rusage.ru_utime,
+            "system": rusage.ru_stime,
+            "max_rss": rusage.ru_maxrss*RSS_UNIT,
+            "minor_faults": rusage.ru_minflt,
+            "major_faults": rusage.ru_majflt,
+            "read_bytes": rusage.ru_inblock*BLOCK_SIZE,
+            "written_bytes": rusage.ru_oublock*BLOCK_SIZE,
+            "exit_code": exit_code}
+
+
+def run_process(command, cwd, stdin, stdout):
+    """ Run a process to completion and measure its resources
+
+    Parameters: command: the command to run
+                cwd: the directory to run it in
+                stdin: the open file to send as stdin
+                stdout: the open file to send stdout to
+    Returns:    What the process wrote to stderr and its usage, see usage_of
+    Algorithm:  Read stderr until the process closes it, then reap the
+                process with os.wait4 instead of Popen.wait, as wait4
+                returns the resource usage of exactly that child
+    """
+    start = time.time()
+    process = subprocess.Popen(command,
+                               cwd=cwd,
+                               # Do not send signals to the subprocess
+                               preexec_fn=os.setpgrp,
+                               # Send the input file as stdin
+                               stdin=stdin,
+                               # Send stdout to the output file
+                               stdout=stdout,
+                               # Errors are sent to stderr
+                               stderr=subprocess.PIPE,
+                               # Close all file descriptors except 0, 1, 2, 3
+                               close_fds=True)
+    stderr = process.stderr.read()
+    process.stderr.close()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    usage = usage_of(rusage, time.time() - start, status)
+    # The process is reaped, so Popen must not wait for it
+    process.returncode = usage["exit_code"]
+    return stderr, usage
+
+
+def run_error(stderr, usage):
+    """ Why a TALYS run failed
+
+    Parameters: stderr: what the process wrote to stderr
+                usage: the usage of the run, see usage_of
+    Returns:    The error message, or None if the run succeeded
+    Algorithm:  A run failed if it wrote to stderr, or if it exited with
+                a non-zero code or was killed by a signal
+    """
+    if stderr:
+        return "TALYS could not be run: {}".format(stderr.rstrip())
+    exit_code = usage.get("exit_code", 0)
+    if exit_code < 0:
+        return "TALYS was killed by signal {}".format(-exit_code)
+    if exit_code:
+        return "TALYS exited with code {}".format(exit_code)
+    return None
+
+
+class RunLog(object):
+    """ Append-only log of the resource usage of every TALYS run
+
+    Every run is one line of JSON, written with O_APPEND as one write,
+    so runs finished by several processes do not interleave.
+    """
+    filename = "runs.jsonl"
+
+    def __init__(self, directory):
+        """ Parameters: directory: the root directory of the campaign """
+        self.path = os.path.join(directory, self.filename)
+
+    def record(self, key, label, usage, **extra):
+        """ Add a run
+
+        Parameters: key: the key of the job, see ledger.job_key
+                    label: the label of the job, see jobs.Job.label
+                    usage: the usage of the run, see usage_of
+                    extra: anything else to store with the run
+        Returns:    None
+        """
+        record = dict(usage, key=key, label=label, **extra)
+        line = "{}\n".format(json.dumps(record, sort_keys=True))
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf8"))
+        finally:
+            os.close(fd)
+
+    def __iter__(self):
+        """ Iterate over the runs as dicts """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as infile:
+            for line in infile:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A partial line is left by a crash during a write
+                    continue
+
+
+def percentile(values, fraction):
+    """ The value below which the given fraction of the values lies """
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(math.ceil(fraction*len(values))) - 1)]
+
+
+def summarise(runs):
+    """ Sum up the resources of a group of runs
+
+    Parameters: runs: list of runs as read from a RunLog
+    Returns:    dict of the number of runs, the total wall and CPU hours,
+                the CPU share of the wall time, and the median, 95th
+                percentile and maximum resident set size in bytes
+    """
+    wall = sum(run["wall"] for run in runs)
+    timed = [run for run in runs if "user" in run]
+    cpu = sum(run["user"] + run["system"] for run in timed)
+    timed_wall = sum(run["wall"] for run in timed)
+    rss = [run["max_rss"] for run in timed]
+    return {"runs": len(runs),
+            "wall_hours": wall/3600.0,
+            "cpu_hours": cpu/3600.0,
+            "cpu_share": cpu/timed_wall if timed_wall > 0 else float("nan"),
+            "median_rss": percentile(rss, 0.5),
+            "rss_95": percentile(rss, 0.95),
+            "max_rss": max(rss) if rss else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarise the resource usage in a run log")
+    parser.add_argument("runlog",
+                        help="the runs.jsonl of a campaign, or its directory")
+    parser.add_argument("--by",
+                        help=("group the runs by the N-th part of the job label."
+                              "\n0 is the isotope, 1 the first varying keyword"),
+                        type=int, default=None, metavar="N")
+    args = parser.parse_args(argv)
+
+    directory = args.runlog
+    if not os.path.isdir(directory):
+        directory = os.path.dirname(directory) or "."
+    runs = list(RunLog(directory))
+    if not runs:
+        sys.exit("Found no runs in {}".format(args.runlog))
+
+    megabyte = 1024.0**2
+    total = summarise(runs)
+    print("Runs:            {}".format(total["runs"]))
+    print("Wall hours:      {:.2f}".format(total["wall_hours"]))
+    print("CPU hours:       {:.2f}".format(total["cpu_hours"]))
+    print("CPU share:       {:.2f}".format(total["cpu_share"]))
+    print("Max RSS:         {:.0f} MB (median {:.0f} MB, 95% {:.0f} MB)".format(
+        total["max_rss"]/megabyte, total["median_rss"]/megabyte,
+        total["rss_95"]/megabyte))
+    # Leave a margin above the largest run
+    print("#SBATCH --mem-per-cpu={}M".format(
+        int(math.ceil(1.2*total["max_rss"]/megabyte))))
+
+    if args.by is not None:
+        groups = {}
+        for run in runs:
+            parts = run["label"].split("-")
+            value = parts[args.by] if args.by < len(parts) else ""
+            groups.setdefault(value, []).append(run)
+        print("\n{:<16} {:>6} {:>10} {:>9} {:>12}".format(
+            "value", "runs", "wall mean", "CPU share", "max RSS MB"))
+        for value in sorted(groups):
+            group = summarise(groups[value])
+            print("{:<16} {:>6} {:>10.1f} {:>9.2f} {:>12.0f}".format(
+                value, group["runs"], 3600*group["wall_hours"]/group["runs"],
+                group["cpu_share"], group["max_rss"]/megabyte))
+
+
+if __name__ == "__main__":
+    main()
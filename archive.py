@@ -0,0 +1,184 @@
+"""
+This module contains the packed result archive. Instead of one file per
+result file per job, the result files of every job of an isotope are
+appended to a single data file, and an index gives the position of each
+job's files by the key of the job. Use --archive to collect the results
+this way.
+
+The archive can be read from Python
+    archive = ResultArchive("results_data/058Ce/194Ce")
+    for key in archive:
+        print(archive.metadata(key)["name"], archive.read(key, "astrorate.g"))
+or listed and extracted from the terminal with
+    python archive.py results_data/058Ce/194Ce [--extract KEY DIRECTORY]
+"""
+
+from __future__ import print_function
+import argparse
+import fcntl
+import json
+import os
+
+
+class ResultArchive(object):
+    """ Append-only, indexed store of the result files of an isotope
+
+    The data file holds the contents of the files back to back. Every job
+    adds one line of JSON to the index, written after its data, with the
+    offset and length of each of its files and a few words about the job.
+    A job whose index line is missing or incomplete, as after a crash,
+    is not in the archive. Appends are serialised with a lock on the data
+    file, so several processes can add to the same archive.
+    """
+    data_filename = "results.pack"
+    index_filename = "results.idx"
+
+    def __init__(self, directory):
+        """ Parameters: directory: the directory of the archive, usually
+                                   the result directory of an isotope
+        """
+        self.directory = directory
+        self.data_path = os.path.join(directory, self.data_filename)
+        self.index_path = os.path.join(directory, self.index_filename)
+        # Loaded on the first lookup
+        self.records = None
+
+    def append(self, key, directory, files, metadata=None):
+        """ Add the files of a job
+
+        Parameters: key: the key of the job, see ledger.job_key
+                    directory: the directory the files are in
+                    files: the names of the files to add
+                    metadata: dict describing the job, stored in the index
+        Returns:    None
+        Algorithm:  Read the files, then hold the lock while appending them
+                    to the data file and their positions to the index
+        """
+        contents = []
+        for name in files:
+            with open(os.path.join(directory, name), "rb") as infile:
+                contents.append((name, infile.read()))
+
+        with open(self.data_path, "ab") as data:
+            fcntl.flock(data, fcntl.LOCK_EX)
+            try:
+                data.seek(0, os.SEEK_END)
+                offset = data.tell()
+                positions = {}
+                for name, content in contents:
+                    data.write(content)
+                    positions[name] = [offset, len(content)]
+                    offset += len(content)
+                data.flush()
+                os.fsync(data.fileno())
+
+                record = json.dumps({"key": key, "files": positions,
+                                     "metadata": metadata or {}},
+                                    sort_keys=True)
+                fd = os.open(self.index_path,
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, "{}\n".format(record).encode("utf8"))
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            finally:
+                fcntl.flock(data, fcntl.LOCK_UN)
+        self.records = None
+
+    def load(self):
+        """ Read the index
+
+        Parameters: None
+        Returns:    dict of key: record
+        Algorithm:  Parse every complete line of the index. A job added
+                    twice is found by its last record
+        """
+        if self.records is None:
+            self.records = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, "r") as index:
+                    for line in index:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # A partial line is left by a crash during a write
+                            continue
+                        self.records[record["key"]] = record
+        return self.records
+
+    def __contains__(self, key):
+        """ Check if the archive has a job """
+        return key in self.load()
+
+    def __iter__(self):
+        """ Iterate over the keys of the jobs """
+        return iter(self.load())
+
+    def __len__(self):
+        """ The number of jobs in the archive """
+        return len(self.load())
+
+    def metadata(self, key):
+        """ The description of a job given when it was added """
+        return self.load()[key]["metadata"]
+
+    def names(self, key):
+        """ The names of the files of a job """
+        return sorted(self.load()[key]["files"])
+
+    def read(self, key, name):
+        """ Read one file of a job
+
+        Parameters: key: the key of the job
+                    name: the name of the file
+        Returns:    The content of the file as bytes
+        Algorithm:  Look up the position of the file and read only that
+        """
+        offset, length = self.load()[key]["files"][name]
+        with open(self.data_path, "rb") as data:
+            data.seek(offset)
+            return data.read(length)
+
+    def files(self, key):
+        """ Read every file of a job
+
+        Parameters: key: the key of the job
+        Returns:    dict of file name: content as bytes
+        """
+        return dict((name, self.read(key, name)) for name in self.names(key))
+
+    def extract(self, key, directory):
+        """ Write the files of a job to a directory
+
+        Parameters: key: the key of the job
+                    directory: where to write the files
+        Returns:    None
+        """
+        for name, content in self.files(key).items():
+            with open(os.path.join(directory, name), "wb") as outfile:
+                outfile.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List or extract the jobs in a result archive")
+    parser.add_argument("directory",
+                        help="the directory of the archive")
+    parser.add_argument("--extract",
+                        help="write the files of the job KEY to DIRECTORY",
+                        nargs=2, metavar=("KEY", "DIRECTORY"))
+    args = parser.parse_args()
+
+    archive = ResultArchive(args.directory)
+    if args.extract:
+        key, directory = args.extract
+        archive.extract(key, directory)
+        return
+    for key in sorted(archive, key=lambda key: archive.metadata(key).get("name")):
+        print(key, archive.metadata(key).get("label"),
+              ' '.join(archive.names(key)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+This module contains the index of the jobs of an array job, and the batch
+script of the array jobs submitted by --slurm. The index is written by
+--dummy and --slurm. It is a single file, instead of one file per job, and
+finding a job reads only the few bytes of its record, however many jobs
+there are. Every array task runs a run of consecutive jobs, so the
+scheduler starts fewer tasks: K jobs with --chunk K, or with --slurm as
+many jobs as fit in --task-time seconds, as predicted from --timings.
+
+The index has a fixed-size header with the number of jobs, the number of
+tasks and the offset of the offset table. It is followed by one line per
+job, of tab-separated fields,
+    work directory, result directory, key, element, mass, name,
+    result directory of the isotope
+then the table of the offset of each line and the table of the first job
+of each task, as 8-byte little-endian integers. The tables are written
+last, so an index whose run was interrupted is recognised as incomplete.
+
+The jobs of array task N, counting from 1, are printed one per line by
+python talys.py worker --task-id N [--index indices.idx]
+or run, as the array jobs of --slurm do, by adding --run. The number of
+array tasks is printed by
+python talys.py worker --tasks [--index indices.idx]
+See arrayscript.sh and workerscript.sh for --dummy.
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import shlex
+import struct
+import sys
+from jobs import Job
+from runtime import format_duration
+
+# The magic string, the number of jobs, the number of tasks and the offset
+# of the offset table
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"TALYSIDX"
+OFFSET = struct.Struct("<Q")
+
+# The batch script of the array jobs of --slurm. Each task runs its jobs
+# with talys.py worker --run, in the directory talys.py was started in. The
+# logs of the tasks are read by --timings
+BATCH_SCRIPT = """#!/bin/bash
+#SBATCH --job-name={name}
+#SBATCH --array=1-{tasks}
+#SBATCH --ntasks=1
+#SBATCH --time={time}
+#SBATCH --output={logs}/%A_%a.log
+{options}
+cd {directory}
+{python} {talys} worker --task-id $SLURM_ARRAY_TASK_ID --run --index {index}
+"""
+
+
+class IndexWriter(object):
+    """ Writes the index of the jobs as they are created
+
+    A task is either a fixed number of jobs, or packed with consecutive
+    jobs until their predicted runtime would exceed the time of a task.
+    A job predicted to take longer than that gets a task of its own.
+    """
+
+    def __init__(self, path, chunk=1, task_time=None):
+        """ Parameters: path: the index file, replaced if it exists
+                        chunk: the number of jobs of each task
+                        task_time: the seconds of work of each task. If
+                                   given, the tasks are packed by runtime
+                                   instead of by chunk
+        """
+        self.path = path
+        self.chunk = chunk
+        self.task_time = task_time
+        self.offsets = []
+        # The index of the first job of each task
+        self.starts = []
+        # The predicted seconds of the current task and the longest task
+        self.seconds = 0.0
+        self.longest = 0.0
+        self.outfile = open(path, "wb")
+        # Rewritten by close. A table offset of 0 marks it as incomplete
+        self.outfile.write(HEADER.pack(MAGIC, 0, 0, 0))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, job, key, seconds=0.0):
+        """ Add a job
+
+        Parameters: job: the Job
+                    key: the key to add to the ledger when completed
+                    seconds: the predicted runtime of the job
+        Returns:    None
+        """
+        if not self.starts:
+            full = True
+        elif self.task_time is not None:
+            full = self.seconds + seconds > self.task_time
+        else:
+            full = len(self.offsets) - self.starts[-1] >= self.chunk
+        if full:
+            self.starts.append(len(self.offsets))
+            self.seconds = 0.0
+        self.seconds += seconds
+        self.longest = max(self.longest, self.seconds)
+        self.offsets.append(self.outfile.tell())
+        fields = (job.work_directory,
+                  # The directory to store the results to
+                  os.path.join(job.result_directory, job.name),
+                  key, job.element, job.mass, job.name, job.result_directory)
+        line = "\t".join(str(field) for field in fields) + "\n"
+        self.outfile.write(line.encode("utf8"))
+
+    def close(self):
+        """ Write the tables and complete the header """
+        table = self.outfile.tell()
+        table_format = "<{}Q"
+        self.outfile.write(struct.pack(table_format.format(len(self.offsets)),
+                                       *self.offsets))
+        self.outfile.write(struct.pack(table_format.format(len(self.starts)),
+                                       *self.starts))
+        self.outfile.seek(0)
+        self.outfile.write(HEADER.pack(MAGIC, len(self.offsets),
+                                       len(self.starts), table))
+        self.outfile.close()
+
+    def tasks(self):
+        """ The number of array tasks """
+        return len(self.starts)
+
+
+class IndexReader(object):
+    """ Looks up the jobs in an index without reading all of it """
+
+    def __init__(self, path):
+        """ Parameters: path: the index file """
+        self.path = path
+        self.infile = open(path, "rb")
+        magic, self.count, self.task_count, self.table = HEADER.unpack(
+            self.infile.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not an index of jobs".format(path))
+        if not self.table:
+            raise ValueError("{} is incomplete. Was the run interrupted?"
+                             .format(path))
+
+    def __len__(self):
+        return self.count
+
+    def tasks(self):
+        """ The number of array tasks """
+        return self.task_count
+
+    def offset(self, table, n):
+        """ Entry n of a table of offsets """
+        self.infile.seek(table + n*OFFSET.size)
+        return OFFSET.unpack(self.infile.read(OFFSET.size))[0]
+
+    def job(self, n):
+        """ The job with the index n, counting from 0
+
+        Returns: tuple of the fields of the job, see the module docstring
+        """
+        if not 0 <= n < self.count:
+            raise IndexError("There is no job {}".format(n))
+        self.infile.seek(self.offset(self.table, n))
+        line = self.infile.readline().decode("utf8")
+        return tuple(line.rstrip("\n").split("\t"))
+
+    def task(self, task_id):
+        """ The jobs of an array task
+
+        Parameters: task_id: the id of the task, counting from 1 as
+                             arrayrun and sbatch --array do
+        Returns:    list of the jobs, see job
+        """
+        if not 1 <= task_id <= self.task_count:
+            raise IndexError("There is no task {}".format(task_id))
+        starts = self.table + self.count*OFFSET.size
+        start = self.offset(starts, task_id - 1)
+        end = self.count
+        if task_id < self.task_count:
+            end = self.offset(starts, task_id)
+        return [self.job(n) for n in range(start, end)]
+
+    def close(self):
+        self.infile.close()
+
+
+def record_job(fields):
+    """ The Job and key of the fields of a job in the index
+
+    The values the job is named after are not in the index, as running
+    the job does not need them
+    """
+    (work_directory, _, key, element, mass, name,
+     result_directory) = fields
+    return Job(element, mass, (), (), name, work_directory,
+               result_directory), key
+
+
+def write_batch_script(path, index, tasks, seconds, options="",
+                       name="talys"):
+    """ Write the batch script of an array job running the jobs of an index
+
+    Parameters: path: the batch script to write
+                index: the path of the index
+                tasks: the number of tasks
+                seconds: the time limit of each task
+                options: more options for sbatch, as on the command line
+                name: the name of the array job
+    Returns:    None
+    """
+    directory = os.getcwd()
+    talys = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "talys.py")
+    with open(path, "w") as outfile:
+        outfile.write(BATCH_SCRIPT.format(
+            name=name, tasks=tasks, time=format_duration(seconds),
+            logs=os.path.join(os.path.abspath(os.path.dirname(path)), "logs"),
+            options="".join("#SBATCH {}\n".format(option)
+                            for option in shlex.split(options)),
+            directory=directory, python=sys.executable, talys=talys,
+            index=os.path.abspath(index)))
+
+
+def main(argv=None, run=None):
+    """ The worker subcommand of talys.py
+
+    Parameters: argv: the arguments after "worker"
+                run: function running the jobs of a task given the path of
+                     the index and the jobs, returning the number of jobs
+                     that failed. See talys.run_array_task
+    Returns:    None
+    """
+    parser = argparse.ArgumentParser(
+        prog="talys.py worker",
+        description="Print or run the jobs of an array task")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--task-id",
+                       help="the id of the array task, counting from 1",
+                       type=int, dest="task_id", metavar="N")
+    group.add_argument("--tasks",
+                       help="print the number of array tasks instead",
+                       action="store_true")
+    parser.add_argument("--run",
+                        help=("run the jobs of the task instead of printing"
+                              "\nthem. Needs an index written by --slurm"),
+                        action="store_true")
+    parser.add_argument("--index",
+                        help="the index written by --dummy or --slurm",
+                        default="indices.idx")
+    args = parser.parse_args(argv)
+    if args.run and run is None:
+        parser.error("--run is only supported by talys.py worker")
+
+    try:
+        index = IndexReader(args.index)
+        if args.tasks:
+            print(index.tasks())
+            jobs = []
+        else:
+            jobs = index.task(args.task_id)
+        index.close()
+    except (IOError, OSError, ValueError, IndexError) as exc:
+        sys.exit(str(exc))
+    if not args.run:
+        for job in jobs:
+            print("\t".join(job))
+    elif jobs:
+        failed = run(args.index, [record_job(job) for job in jobs])
+        if failed:
+            sys.exit("{} of {} jobs failed".format(failed, len(jobs)))
+
+
+if __name__ == "__main__":
+    main()
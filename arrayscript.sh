@@ -7,6 +7,7 @@ source /cluster/bin/jobsetup
 module purge   # clear any inherited modules
 set -o errexit # exit on errors
 
-MAX="$(ls -l indices/ | wc -l)"
+# The number of tasks in the index written by talys.py --dummy [--chunk K]
+MAX="$(python talys.py worker --tasks)"
 
 arrayrun 1-$MAX workerscript.sh
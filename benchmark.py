@@ -0,0 +1,653 @@
+#! /usr/bin/python
+"""
+This script measures the overhead of the launcher itself. TALYS is never
+run. The plan and order benchmarks write nothing to disk, while the launcher
+benchmark runs talys.py on a stub TALYS in a temporary directory.
+Syntax:
+python benchmark.py plan [--ifile structure.json] [--limit N]
+python benchmark.py render [--ifile structure.json] [--limit N]
+python benchmark.py directories [--ifile structure.json] [--limit N]
+                                [--directory DIRECTORY]
+python benchmark.py order --timings FILE [--fit FILE] [--ifile structure.json]
+                          [-p N]
+python benchmark.py launcher [--ifile test.json] [--sleep SECONDS]
+                             [--modes {serial,dummy,pool,mpi,slurm} ...]
+                             [-p N [N ...]] [--keep]
+"""
+from __future__ import print_function
+import argparse
+import copy
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    # Python 3
+    from io import StringIO
+except ImportError:
+    # Python 2
+    from StringIO import StringIO
+from itertools import islice, product
+from tools import StyleFormatter, DirectoryTree, mkdir
+from readers import Json_reader
+from jobs import JobPlan, InputRenderer
+from arrayjobs import IndexReader
+from runtime import RuntimeModel, read_timings
+from scheduler import longest_first, makespan
+from talys import Z_nr
+
+
+def legacy_jobs(reader):
+    """ The job generation of the former recursive run_deeper/run_rest
+
+    Kept as a reference for the benchmark. It does the same deepcopies as
+    the old code did, but creates no directories or files.
+    Parameters: reader: the input options
+    Returns:    A generator of the keywords of each job
+    """
+    keywords = copy.deepcopy(reader.keywords)
+    keywords["Z_nr"] = Z_nr
+    structure = [{"element": "{Z_nr[element]}{element}"},
+                 {"mass": "{mass}{element}"},
+                 {"rest": ""}]
+    return legacy_deeper(reader, keywords, structure)
+
+
+def legacy_deeper(reader, keywords, structure):
+    """ See legacy_jobs """
+    structure = copy.deepcopy(structure)
+    keywords = copy.deepcopy(keywords)
+    name, style = list(structure.pop(0).items())[0]
+    if name == "rest":
+        for job in legacy_rest(reader, keywords):
+            yield job
+        return
+    tmp_keywords = copy.deepcopy(keywords)
+    if isinstance(keywords[name], dict):
+        tmp_keywords[name] = keywords[name][keywords["prev_keyword"]]
+    new_keywords = copy.deepcopy(tmp_keywords)
+    fmt = StyleFormatter()
+    for keyword in tmp_keywords[name]:
+        new_keywords[name] = keyword
+        fmt.format(style, **new_keywords)
+        new_keywords["prev_keyword"] = keyword
+        for job in legacy_deeper(reader, new_keywords, structure):
+            yield job
+
+
+def legacy_rest(reader, keywords):
+    """ See legacy_jobs """
+    keywords = copy.deepcopy(keywords)
+    del keywords["Z_nr"]
+    del keywords["prev_keyword"]
+    keys = []
+    values = []
+    talys_keywords = {}
+    for key in sorted(keywords.keys()):
+        if len(reader[key]) > 1 and key != "element" and key != "mass":
+            keys.append(key)
+            values.append(keywords[key])
+        else:
+            talys_keywords[key] = keywords[key]
+    for condition in reader.dependents:
+        values.append(condition.keys())
+    for value in product(*values):
+        current = copy.deepcopy(talys_keywords)
+        for key, keywordval in zip(keys, value[:len(keys)]):
+            current[key] = keywordval
+        for key in value[len(keys):]:
+            current[key] = reader.get_condition_val(key)
+        for key, val in current.items():
+            if isinstance(val, (list, tuple)):
+                current[key] = val[0]
+        # make_input_file did a deepcopy of its own
+        yield copy.deepcopy(current)
+
+
+def plan_jobs(reader):
+    """ The job generation of the job plan
+
+    Parameters: reader: the input options
+    Returns:    A generator of the keywords of each job
+    """
+    plan = JobPlan(reader, "original_data", "results_data", Z_nr)
+    isotope = None
+    for job in plan:
+        if (job.element, job.mass) != isotope:
+            isotope = (job.element, job.mass)
+            isotope_keywords = plan.isotope_keywords(job)
+        yield plan.keywords(job, isotope_keywords)
+
+
+def time_jobs(jobs, limit):
+    """ Time the generation of jobs
+
+    Parameters: jobs: a generator of the keywords of each job
+                limit: the maximum number of jobs to generate
+    Returns:    tuple of the number of jobs and the elapsed time
+    Algorithm:  Consume the generator and read every keyword, as writing
+                the input file would
+    """
+    count = 0
+    start = time.time()
+    for keywords in islice(jobs, limit):
+        for key, value in keywords.items():
+            pass
+        count += 1
+    return count, time.time() - start
+
+
+def benchmark_plan(args):
+    """ Compare the job generation rate before and after the job plan """
+    reader = Json_reader(args.input_filename)
+    print("{:<10} {:>8} {:>10} {:>12}".format("", "jobs", "seconds",
+                                              "jobs/second"))
+    for label, jobs in (("legacy", legacy_jobs(reader)),
+                        ("plan", plan_jobs(reader))):
+        count, elapsed = time_jobs(jobs, args.limit)
+        print("{:<10} {:>8} {:>10.3f} {:>12.0f}".format(
+            label, count, elapsed, count/elapsed if elapsed else 0))
+
+
+def legacy_render(keywords, astro):
+    """ The former make_input_file, writing to a string
+
+    Kept as a reference for the benchmark. It deepcopies the keywords and
+    writes the header and every keyword separately, as the old code did.
+    Parameters: keywords: the keywords of the job
+                astro: True if the energy file is not used
+    Returns:    The content of the input file as a string
+    """
+    keywords = copy.deepcopy(dict(keywords.items()))
+    projectile = keywords['projectile']
+    mass = keywords['mass']
+    element = keywords["element"]
+    energy = keywords['energy']
+    del keywords['projectile']
+    del keywords['mass']
+    del keywords['element']
+    del keywords['energy']
+    outfile_input = StringIO()
+    reaction_line = '{}{}({},g){}{}'.format(mass, element, projectile,
+                                            int(mass)+1, element)
+    outfile_input.write('########################## \n')
+    outfile_input.write('##   TALYS input file   ## \n')
+    outfile_input.write('##{:^{}}## \n'.format(reaction_line, 22))
+    outfile_input.write('########################## \n \n')
+    outfile_input.write('# All keywords are explained in README. \n \n')
+    outfile_input.write('element {} \n'.format(element))
+    outfile_input.write('projectile {} \n'.format(projectile))
+    outfile_input.write('mass {} \n'.format(mass))
+    if not astro:
+        outfile_input.write('energy {} \n \n'.format(energy))
+    else:
+        outfile_input.write('energy 1\n')
+    for key, value in keywords.items():
+        outfile_input.write('{} {} \n'.format(key, str(value)))
+    return outfile_input.getvalue()
+
+
+def benchmark_render(args):
+    """ Compare the rate of rendering input files before and after the
+    templates of InputRenderer, checking that the files are identical """
+    reader = Json_reader(args.input_filename)
+    astro = not ("n" in reader["astro"] or "no" in reader["astro"])
+    jobs = list(islice(plan_jobs(reader), args.limit))
+    renderer = InputRenderer(astro)
+    for keywords in jobs:
+        if renderer.render(keywords) != legacy_render(keywords, astro):
+            sys.exit("The rendered input files differ:\n{}".format(
+                renderer.render(keywords)))
+    # A fresh renderer, so compiling the templates is timed too
+    renderer = InputRenderer(astro)
+    print("{:<10} {:>8} {:>10} {:>14}".format("", "inputs", "seconds",
+                                              "inputs/second"))
+    for label, render in (("legacy", lambda k: legacy_render(k, astro)),
+                          ("template", renderer.render)):
+        start = time.time()
+        for keywords in jobs:
+            render(keywords)
+        elapsed = time.time() - start
+        print("{:<10} {:>8} {:>10.3f} {:>14.0f}".format(
+            label, len(jobs), elapsed, len(jobs)/elapsed if elapsed else 0))
+
+
+def legacy_directories(plan, limit):
+    """ The directories created by the former run_deeper/run_rest
+
+    Kept as a reference for the benchmark. tools.mkdir was called on the
+    element and mass directories for every job, and on the work directory.
+    Parameters: plan: the JobPlan
+                limit: the maximum number of jobs
+    Returns:    None
+    """
+    for job in islice(plan, limit):
+        mass_directory = job.result_directory
+        element_directory = os.path.dirname(mass_directory)
+        for directory in (element_directory, mass_directory):
+            mkdir(directory)
+            mkdir(directory.replace(plan.result_root, plan.work_root, 1))
+        mkdir(job.work_directory)
+
+
+def tree_directories(plan, limit):
+    """ The directories created by talys.py, see Manager.run_job
+
+    Parameters: plan: the JobPlan
+                limit: the maximum number of jobs
+    Returns:    None
+    """
+    tree = DirectoryTree()
+    isotope = None
+    for job in islice(plan, limit):
+        if (job.element, job.mass) != isotope:
+            isotope = (job.element, job.mass)
+            tree.make(job.result_directory)
+        tree.make(job.work_directory)
+
+
+def benchmark_directories(args):
+    """ Compare creating the directories of the same jobs with a mkdir of
+    every directory of every job and with a DirectoryTree """
+    reader = Json_reader(args.input_filename)
+    parent = tempfile.mkdtemp(prefix="benchmark-", dir=args.directory)
+    print("{:<10} {:>12} {:>10}".format("", "directories", "seconds"))
+    try:
+        for label in ("legacy", "tree"):
+            root = os.path.join(parent, label)
+            plan = JobPlan(reader, os.path.join(root, "original_data"),
+                           os.path.join(root, "results_data"), Z_nr)
+            start = time.time()
+            if label == "legacy":
+                legacy_directories(plan, args.limit)
+            else:
+                tree_directories(plan, args.limit)
+            elapsed = time.time() - start
+            count = sum(len(names) for _, names, _ in os.walk(root))
+            print("{:<10} {:>12} {:>10.3f}".format(label, count, elapsed))
+    finally:
+        shutil.rmtree(parent, ignore_errors=True)
+
+
+def benchmark_order(args):
+    """ Replay a timing trace in the order of the plan and longest first
+
+    The jobs of the input file with a runtime in the trace are replayed on
+    N workers. Longest first is ordered by the runtime model fitted to
+    --fit, or to the trace itself, and by the actual runtimes as the best
+    possible order.
+    """
+    reader = Json_reader(args.input_filename)
+    trace = dict(read_timings(args.timings))
+    jobs = [job for job in JobPlan(reader, "original_data", "results_data",
+                                   Z_nr)
+            if job.label in trace]
+    if not jobs:
+        print("None of the jobs of {} are in {}".format(args.input_filename,
+                                                        args.timings))
+        return
+    model = RuntimeModel(read_timings(args.fit or args.timings))
+    total = sum(trace[job.label] for job in jobs)
+
+    print("{} jobs on {} workers".format(len(jobs), args.processes))
+    print("{:<16} {:>12} {:>10}".format("", "makespan", "reduction"))
+    orders = (("plan", jobs),
+              ("longest-first", longest_first(
+                  jobs, lambda job: model.predict(job.label))),
+              ("oracle", longest_first(jobs, lambda job: trace[job.label])))
+    baseline = None
+    for label, order in orders:
+        span = makespan([trace[job.label] for job in order], args.processes)
+        baseline = baseline or span
+        print("{:<16} {:>12.0f} {:>9.1f}%".format(
+            label, span, 100.0*(baseline - span)/baseline))
+    print("{:<16} {:>12.0f}".format("lower bound", max(
+        total/args.processes, max(trace[job.label] for job in jobs))))
+
+
+# Stands in for TALYS. It reads the input file, sleeps and writes an output
+# file ending as TALYS does, and the two result files of test.json
+STUB_TALYS = """#!/bin/sh
+cat > /dev/null
+sleep {sleep}
+yes " synthetic output of the stub TALYS" | head -n {lines}
+echo " Execution time:  0 hours  0 minutes  {sleep:.2f} seconds"
+cat > astrorate.g <<EOF
+# stub
+# T9 rate
+#
+#
+{rates}EOF
+echo "# stub" > astrorate.tot
+"""
+
+# Stands in for mpi4py, imported by talys.py through PYTHONPATH. Importing
+# it forks the other ranks, which then run talys.py as MPI ranks do. The
+# messages go through one queue per rank and are matched by source and tag
+STUB_MPI = """import atexit
+import multiprocessing
+import os
+import signal
+
+
+class Comm(object):
+    def __init__(self, size):
+        self.size = size
+        self.rank = 0
+        self.inboxes = [multiprocessing.Queue() for n in range(size)]
+        self.pending = []
+        self.children = []
+        for rank in range(1, size):
+            pid = os.fork()
+            if pid == 0:
+                self.rank = rank
+                self.children = []
+                break
+            self.children.append(pid)
+        atexit.register(self.wait)
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def send(self, obj, dest, tag=0):
+        self.inboxes[dest].put((self.rank, tag, obj))
+
+    def recv(self, source=None, tag=None):
+        def matches(message):
+            return ((source is None or message[0] == source) and
+                    (tag is None or message[1] == tag))
+        for n, message in enumerate(self.pending):
+            if matches(message):
+                del self.pending[n]
+                return message[2]
+        while True:
+            message = self.inboxes[self.rank].get()
+            if matches(message):
+                return message[2]
+            self.pending.append(message)
+
+    def Abort(self, code=1):
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+        os._exit(code)
+
+    def wait(self):
+        for pid in self.children:
+            os.waitpid(pid, 0)
+
+
+COMM_WORLD = Comm(int(os.environ.get("STUB_MPI_SIZE", "2")))
+"""
+
+
+# Stands in for sbatch. It runs the tasks of the array job given by the
+# #SBATCH lines of the batch script one after the other, and prints the
+# job id as sbatch --parsable does
+STUB_SBATCH = """#!{python}
+import os
+import re
+import subprocess
+import sys
+
+script = sys.argv[-1]
+with open(script) as infile:
+    text = infile.read()
+first, last = re.search(r"#SBATCH --array=(\\d+)-(\\d+)", text).groups()
+output = re.search(r"#SBATCH --output=(\\S+)", text).group(1)
+for task in range(int(first), int(last) + 1):
+    env = dict(os.environ, SLURM_ARRAY_JOB_ID="1",
+               SLURM_ARRAY_TASK_ID=str(task))
+    with open(output.replace("%A", "1").replace("%a", str(task)),
+              "w") as log:
+        subprocess.call(["bash", script], env=env, stdout=log, stderr=log)
+print("1")
+"""
+
+
+def prepare_stubs(directory, sleep, lines):
+    """ Write the stub TALYS, mpi4py and sbatch to a directory
+
+    Parameters: directory: where to write them
+                sleep: the seconds the stub TALYS sleeps
+                lines: the number of lines of its output file
+    Returns:    The path of the stub TALYS, the directory to put in
+                PYTHONPATH for the stub mpi4py and the path of the stub
+                sbatch
+    """
+    rates = "".join(" {:.4f} {:.4E}\n".format(0.0001*(n + 1), 1e-3*(n + 1))
+                    for n in range(30))
+    talys = os.path.join(directory, "talys")
+    with open(talys, "w") as outfile:
+        outfile.write(STUB_TALYS.format(sleep=sleep, lines=lines,
+                                        rates=rates))
+    os.chmod(talys, 0o755)
+    package = os.path.join(directory, "stubs", "mpi4py")
+    os.makedirs(package)
+    open(os.path.join(package, "__init__.py"), "w").close()
+    with open(os.path.join(package, "MPI.py"), "w") as outfile:
+        outfile.write(STUB_MPI)
+    sbatch = os.path.join(directory, "sbatch")
+    with open(sbatch, "w") as outfile:
+        outfile.write(STUB_SBATCH.format(python=sys.executable))
+    os.chmod(sbatch, 0o755)
+    return talys, os.path.dirname(package), sbatch
+
+
+def stage_latencies(root, sleep):
+    """ The mean latency of each stage of the jobs of a finished run
+
+    Parameters: root: the TALYS-calculations directory of the run
+                sleep: the seconds the stub TALYS sleeps
+    Returns:    dict of the number of runs, the seconds TALYS ran and the
+                mean seconds of the stages: spawn, the time to start and
+                reap the stub beyond its sleep, copy, the time to collect
+                the results, and gap, the time a worker spent between
+                the end of one job and the start of the next
+    Algorithm:  Read the run log and the event log of the run. The gaps
+                are only known where the jobs start on rank 0
+    """
+    runs = []
+    if os.path.exists(os.path.join(root, "runs.jsonl")):
+        with open(os.path.join(root, "runs.jsonl")) as infile:
+            runs = [json.loads(line) for line in infile]
+    events = []
+    if os.path.exists(os.path.join(root, "events.jsonl")):
+        with open(os.path.join(root, "events.jsonl")) as infile:
+            events = [json.loads(line) for line in infile]
+    copies = [event["seconds"] for event in events
+              if event["event"] == "copy_done"]
+    gaps = []
+    ended = {}
+    for event in sorted(events, key=lambda event: event["time"]):
+        if "pid" not in event:
+            continue
+        if event["event"] == "job_start" and event["pid"] in ended:
+            gaps.append(event["time"] - ended.pop(event["pid"]))
+        elif event["event"] in ("job_end", "job_failed"):
+            ended[event["pid"]] = event["time"]
+
+    def mean(values):
+        return sum(values)/len(values) if values else None
+    return {"runs": len(runs),
+            "talys": sum(run["wall"] for run in runs),
+            "spawn": mean([run["wall"] - sleep for run in runs]),
+            "copy": mean(copies),
+            "gap": mean(gaps)}
+
+
+def run_launcher(args, mode, workers, talys, stubs, sbatch):
+    """ Run talys.py on the stub TALYS once
+
+    Parameters: args: the parsed arguments of the benchmark
+                mode: serial, dummy, pool, mpi or slurm
+                workers: the number of worker processes or MPI ranks
+                         running TALYS, or the jobs of each array task
+                talys: the path of the stub TALYS
+                stubs: the directory of the stub mpi4py
+                sbatch: the path of the stub sbatch
+    Returns:    tuple of the seconds talys.py ran, the number of jobs and
+                the stage latencies, see stage_latencies
+    Algorithm:  Run talys.py in a new directory with --events, and read
+                what it wrote. The run with the stub mpi4py has one rank
+                more than the number of workers, as rank 0 only hands out
+                the jobs. The stub sbatch runs the array tasks one by one
+                before talys.py --slurm returns
+    """
+    directory = tempfile.mkdtemp(prefix="{}-{}-".format(mode, workers),
+                                 dir=args.directory)
+    shutil.copy(args.input_filename, directory)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "talys.py")
+    command = [sys.executable, script,
+               "--ifile", os.path.basename(args.input_filename),
+               "--talys", talys, "--events", "-v", "WARNING"]
+    env = dict(os.environ)
+    if mode == "dummy":
+        command.append("--dummy")
+    elif mode == "pool":
+        command.extend(["-p", str(workers)])
+    elif mode == "mpi":
+        env["PYTHONPATH"] = os.pathsep.join(
+            [stubs] + [path for path in [env.get("PYTHONPATH")] if path])
+        env["STUB_MPI_SIZE"] = str(workers + 1)
+    elif mode == "slurm":
+        command.extend(["--slurm", "--sbatch", sbatch,
+                        "--chunk", str(workers)])
+
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(command, cwd=directory, env=env,
+                              stdout=devnull)
+    elapsed = time.time() - start
+
+    root = [name for name in os.listdir(directory)
+            if name.startswith("TALYS-calculations-")][0]
+    latencies = stage_latencies(os.path.join(directory, root), args.sleep)
+    jobs = latencies["runs"]
+    if mode == "dummy":
+        jobs = len(IndexReader(os.path.join(directory, "indices.idx")))
+    return elapsed, jobs, latencies
+
+
+def benchmark_launcher(args):
+    """ Measure the overhead talys.py adds to every job
+
+    talys.py runs the jobs of the input file on a stub TALYS in each mode:
+    serially, without running TALYS (--dummy), on a pool of N workers for
+    each N in -p, on N MPI ranks through a stub mpi4py, and as an array
+    job of tasks of N jobs each through a stub sbatch. Each run
+    reports the jobs per second, the fraction of the time the workers
+    ran TALYS and the mean latency of the stages of a job in ms.
+    """
+    args.directory = tempfile.mkdtemp(prefix="talys-benchmark-")
+    try:
+        talys, stubs, sbatch = prepare_stubs(args.directory, args.sleep,
+                                             args.lines)
+        print("{:<8} {:>7} {:>6} {:>8} {:>8} {:>10} {:>8} {:>8} {:>8}".format(
+            "mode", "workers", "jobs", "seconds", "jobs/s", "efficiency",
+            "spawn", "copy", "gap"))
+        for mode in args.modes:
+            counts = [1] if mode in ("serial", "dummy") else args.processes
+            for workers in counts:
+                elapsed, jobs, latencies = run_launcher(args, mode, workers,
+                                                        talys, stubs, sbatch)
+                # The stub sbatch runs one task at a time
+                parallel = 1 if mode == "slurm" else workers
+                efficiency = latencies["talys"]/(parallel*elapsed)
+
+                def ms(value):
+                    return "-" if value is None else "{:.1f}".format(
+                        1000*value)
+                print("{:<8} {:>7} {:>6} {:>8.2f} {:>8.1f} {:>10.2f} {:>8} "
+                      "{:>8} {:>8}".format(
+                          mode, workers, jobs, elapsed, jobs/elapsed,
+                          efficiency, ms(latencies["spawn"]),
+                          ms(latencies["copy"]), ms(latencies["gap"])))
+    finally:
+        if args.keep:
+            print("The runs are kept in {}".format(args.directory))
+        else:
+            shutil.rmtree(args.directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    plan_parser = subparsers.add_parser(
+        "plan", help="the rate at which the jobs are generated")
+    plan_parser.add_argument("--ifile", help="the input file",
+                             default="structure.json",
+                             dest="input_filename")
+    plan_parser.add_argument("--limit", help="the maximum number of jobs",
+                             type=int, default=None)
+    plan_parser.set_defaults(func=benchmark_plan)
+    render_parser = subparsers.add_parser(
+        "render", help="the rate at which the input files are rendered")
+    render_parser.add_argument("--ifile", help="the input file",
+                               default="structure.json",
+                               dest="input_filename")
+    render_parser.add_argument("--limit", help="the maximum number of jobs",
+                               type=int, default=None)
+    render_parser.set_defaults(func=benchmark_render)
+    directories_parser = subparsers.add_parser(
+        "directories", help="the time to create the directories of the jobs")
+    directories_parser.add_argument("--ifile", help="the input file",
+                                    default="structure.json",
+                                    dest="input_filename")
+    directories_parser.add_argument("--limit",
+                                    help="the maximum number of jobs",
+                                    type=int, default=None)
+    directories_parser.add_argument("--directory",
+                                    help=("where to create them, such as a"
+                                          " network filesystem. Defaults to"
+                                          " the temporary directory"),
+                                    default=None)
+    directories_parser.set_defaults(func=benchmark_directories)
+    order_parser = subparsers.add_parser(
+        "order", help="the makespan of a timing trace in different orders")
+    order_parser.add_argument("--ifile", help="the input file of the trace",
+                              default="structure.json",
+                              dest="input_filename")
+    order_parser.add_argument("--timings", required=True,
+                              help=("the timing trace: the log of talys.py or a"
+                                    " CSV from the harvester or measure.py"))
+    order_parser.add_argument("--fit",
+                              help=("the timings to fit the runtime model to."
+                                    " Defaults to the trace"))
+    order_parser.add_argument("-p", "--processes",
+                              help="the number of workers",
+                              type=int, default=16)
+    order_parser.set_defaults(func=benchmark_order)
+    launcher_parser = subparsers.add_parser(
+        "launcher", help="the overhead talys.py adds per job, on a stub TALYS")
+    launcher_parser.add_argument("--ifile", help="the input file",
+                                 default="test.json",
+                                 dest="input_filename")
+    launcher_parser.add_argument("--sleep",
+                                 help="the seconds the stub TALYS sleeps",
+                                 type=float, default=0.0)
+    launcher_parser.add_argument("--lines",
+                                 help="the lines of output of the stub TALYS",
+                                 type=int, default=1000)
+    launcher_parser.add_argument("--modes",
+                                 help="the ways to run talys.py",
+                                 nargs="+",
+                                 choices=["serial", "dummy", "pool", "mpi",
+                                          "slurm"],
+                                 default=["serial", "dummy", "pool", "mpi"])
+    launcher_parser.add_argument("-p", "--processes",
+                                 help=("the numbers of workers of the pool and"
+                                       " MPI runs, for the scaling curve"),
+                                 type=int, nargs="+", default=[1, 2, 4])
+    launcher_parser.add_argument("--keep",
+                                 help="keep the directories of the runs",
+                                 action="store_true")
+    launcher_parser.set_defaults(func=benchmark_launcher)
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,160 @@
+"""
+This module contains the result cache shared between campaigns. The
+results of a TALYS run are stored under a hash of everything deciding
+them: the rendered input file, the TALYS version and the energy file.
+A job with a hit in the cache is not run again.
+"""
+
+from __future__ import print_function
+import hashlib
+import os
+import shutil
+
+
+class ResultCache(object):
+    """ Size-bounded, content-addressed store of TALYS results
+
+    Each entry is a directory named by its key holding the files of one run.
+    The modification time of an entry is updated on every hit, and the
+    least recently used entries are evicted when the cache grows beyond
+    its maximum size.
+    """
+
+    def __init__(self, directory, max_size):
+        """ Parameters: directory: where the cache is stored
+                        max_size: the maximum size of the cache in bytes
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        # Set by self.configure
+        self.salt = ""
+        # Only counted by the process looking up the entries
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def configure(self, version, energy_file=None):
+        """ Set what decides the results in addition to the input file
+
+        Parameters: version: the version of TALYS
+                    energy_file: path to the energy file given to TALYS,
+                                 if any
+        Returns:    None
+        """
+        digest = hashlib.sha1("talys {}\n".format(version).encode("utf8"))
+        if energy_file is not None:
+            with open(energy_file, "rb") as energies:
+                digest.update(energies.read())
+        self.salt = digest.hexdigest()
+
+    def key(self, job_key):
+        """ The key of a job in the cache
+
+        Parameters: job_key: the hash of the input file, see ledger.job_key
+        Returns:    The key as a hex string
+        """
+        return hashlib.sha1((self.salt + job_key).encode("utf8")).hexdigest()
+
+    def path(self, key):
+        """ The directory of an entry """
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, directory):
+        """ Copy the files of an entry into a directory
+
+        Parameters: key: the key of the entry
+                    directory: where to put the files
+        Returns:    True on a hit, False on a miss
+        Algorithm:  Copy every file of the entry and mark the entry as
+                    recently used
+        """
+        entry = self.path(key)
+        try:
+            for name in os.listdir(entry):
+                shutil.copy(os.path.join(entry, name), directory)
+            os.utime(entry, None)
+        except (IOError, OSError):
+            # Not in the cache, or evicted while copying
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, directory, files):
+        """ Add the files of a run to the cache
+
+        Parameters: key: the key of the entry
+                    directory: the directory the files are in
+                    files: the names of the files to store
+        Returns:    None
+        Algorithm:  Copy the files into a temporary directory and rename it
+                    to the entry, so that a partial entry is never seen.
+                    If another process stored the entry first, keep theirs
+        """
+        entry = self.path(key)
+        if os.path.exists(entry):
+            return
+        parent = os.path.dirname(entry)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # Created by another process
+                pass
+        tmp = os.path.join(parent, ".tmp-{}-{}".format(os.getpid(), key))
+        os.mkdir(tmp)
+        try:
+            for name in files:
+                shutil.copy(os.path.join(directory, name), tmp)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def evict(self):
+        """ Remove the least recently used entries above the maximum size
+
+        Parameters: None
+        Returns:    The number of evicted entries
+        Algorithm:  Find the size and modification time of every entry and
+                    remove the oldest until the cache fits. Another run
+                    sharing the cache may evict the same entries at the
+                    same time, so an entry that disappears is passed over
+        """
+        entries = []
+        total = 0
+        for prefix in os.listdir(self.directory):
+            prefix = os.path.join(self.directory, prefix)
+            try:
+                keys = os.listdir(prefix)
+            except OSError:
+                # Not a directory, or removed by another run
+                continue
+            for key in keys:
+                # Skip entries still being stored
+                if key.startswith("."):
+                    continue
+                entry = os.path.join(prefix, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, name))
+                               for name in os.listdir(entry))
+                    mtime = os.path.getmtime(entry)
+                except OSError:
+                    continue
+                entries.append((mtime, size, entry))
+                total += size
+        evicted = 0
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def report(self):
+        """ Summarise the lookups as a string """
+        lookups = self.hits + self.misses
+        return "{} hits, {} misses ({:.0f}% hit rate)".format(
+            self.hits, self.misses,
+            100.0*self.hits/lookups if lookups else 0)
@@ -0,0 +1,328 @@
+#! /usr/bin/python
+"""
+This script parses the astrorate files of a campaign into a columnar
+dataset. Each column is a NumPy array saved as its own .npy file, and the
+columns are memory-mapped when the dataset is loaded, so selecting the
+rates of an isotope or a model does not read the whole dataset.
+Syntax:
+python dataset.py TALYS-calculations-directory [--output DIRECTORY]
+
+The dataset has one row for every temperature of every astrorate file:
+    element:     the element of the target, e.g. Dy
+    mass:        the mass of the target
+    model:       index into Dataset.models, the name of the job. It holds
+                 the values of the varying keywords, e.g. strength,
+                 ldmodel and massmodel, see JobPlan.make_name
+    reaction:    index into Dataset.reactions, the suffix of the
+                 astrorate file, e.g. g or tot
+    temperature: the temperature in T9
+    rate:        the reaction rate
+The rows are sorted by element, mass, model, reaction and temperature. The
+harvester of harvest.py appends the rows of new jobs with --follow, after
+the rows already written, so the dataset is then sorted in runs.
+    dataset = Dataset("TALYS-calculations-161018-120000/dataset")
+    temperature, rate = dataset.rates("Dy", 162, model="2-3")
+"""
+from __future__ import print_function
+import argparse
+import io
+import os
+import re
+import shutil
+import numpy as np
+from archive import ResultArchive
+
+
+# The name of the result files, optionally prefixed by the name of the job
+RATE_FILE = re.compile(r"^(?:(.*)-)?astrorate\.(\w+)$")
+# The name of an isotope directory, see JobPlan.mass_style
+ISOTOPE = re.compile(r"^(\d+)([A-Za-z]+)$")
+
+
+def parse_astrorate(text):
+    """ Parse the temperatures and rates of an astrorate file
+
+    Parameters: text: the content of the file
+    Returns:    Two arrays of floats, the temperatures and the rates
+    Algorithm:  The first four lines are the header. Every following line
+                starting with two numbers is a temperature and its rate
+    """
+    temperatures = []
+    rates = []
+    for line in text.splitlines()[4:]:
+        columns = line.split()
+        if len(columns) < 2:
+            continue
+        try:
+            temperature, rate = float(columns[0]), float(columns[1])
+        except ValueError:
+            continue
+        temperatures.append(temperature)
+        rates.append(rate)
+    return np.array(temperatures), np.array(rates)
+
+
+def find_rate_files(directory):
+    """ Find the astrorate files of a campaign
+
+    Parameters: directory: the results_data directory of a campaign
+    Returns:    A generator of (element, mass, model, reaction, source)
+                where source is the path of the file, or an archive and
+                the key and name of the file in it
+    Algorithm:  Walk the isotope directories, matching the file names.
+                Isotopes collected with --archive are read from the
+                index of the archive
+    """
+    for root, dirs, files in os.walk(directory):
+        match = ISOTOPE.match(os.path.basename(root))
+        if match is None:
+            continue
+        mass, element = int(match.group(1)), match.group(2)
+        for name in files:
+            match = RATE_FILE.match(name)
+            if match is not None:
+                yield (element, mass, match.group(1) or "", match.group(2),
+                       os.path.join(root, name))
+        if ResultArchive.index_filename in files:
+            archive = ResultArchive(root)
+            for key in archive:
+                model = archive.metadata(key).get("name", "")
+                for name in archive.names(key):
+                    match = RATE_FILE.match(name)
+                    if match is not None:
+                        yield (element, mass, model, match.group(2),
+                               (archive, key, name))
+
+
+def read_source(source):
+    """ Read an astrorate file found by find_rate_files as text """
+    if isinstance(source, tuple):
+        archive, key, name = source
+        return archive.read(key, name).decode("utf8")
+    with open(source, "r") as infile:
+        return infile.read()
+
+
+def dataset_columns(records, model_index, reaction_index):
+    """ The columns of the rows of parsed astrorate files
+
+    Parameters: records: list of (element, mass, model, reaction,
+                         temperatures, rates)
+                model_index, reaction_index: dicts of the code of each
+                                             model and reaction
+    Returns:    dict of the name of each column and its array
+    """
+    lengths = [len(record[4]) for record in records]
+    return {
+        "element": np.repeat(np.array([record[0] for record in records],
+                                      dtype="U3"), lengths),
+        "mass": np.repeat(np.array([record[1] for record in records],
+                                   dtype=np.int32), lengths),
+        "model": np.repeat(np.array([model_index[record[2]]
+                                     for record in records],
+                                    dtype=np.int32), lengths),
+        "reaction": np.repeat(np.array([reaction_index[record[3]]
+                                        for record in records],
+                                       dtype=np.int8), lengths),
+        "temperature": np.concatenate([record[4] for record in records]
+                                      or [np.empty(0)]),
+        "rate": np.concatenate([record[5] for record in records]
+                               or [np.empty(0)])}
+
+
+def write_dataset(records, output):
+    """ Write parsed astrorate files as a columnar dataset
+
+    Parameters: records: iterable of (element, mass, model, reaction,
+                         temperatures, rates)
+                output: the directory to write the dataset to
+    Returns:    The number of rows
+    Algorithm:  Sort the records, concatenate them into one array per
+                column and save each column. The dataset is written
+                to a temporary directory which replaces the old one
+    """
+    records = sorted(records, key=lambda record: record[:4])
+    models = sorted(set(record[2] for record in records))
+    reactions = sorted(set(record[3] for record in records))
+    model_index = dict((model, n) for n, model in enumerate(models))
+    reaction_index = dict((reaction, n) for n, reaction in enumerate(reactions))
+    columns = dataset_columns(records, model_index, reaction_index)
+
+    tmp = output.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name, column in columns.items():
+        np.save(os.path.join(tmp, name + ".npy"), column)
+    np.save(os.path.join(tmp, "models.npy"), np.array(models, dtype="U"))
+    np.save(os.path.join(tmp, "reactions.npy"), np.array(reactions, dtype="U"))
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.rename(tmp, output)
+    return len(columns["rate"])
+
+
+def append_column(path, values):
+    """ Append values to a column of a dataset in place
+
+    Parameters: path: the .npy file of the column
+                values: the array to append
+    Returns:    None
+    Algorithm:  Write the values after the rows given by the header, then
+                rewrite the header with the new length. np.save leaves
+                room in the header for the length to grow, and if there
+                is none, the column is saved again. Until the header is
+                rewritten, the column is read with its old length
+    """
+    with open(path, "r+b") as column:
+        version = np.lib.format.read_magic(column)
+        if version == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+            write_header = np.lib.format.write_array_header_1_0
+        else:
+            read_header = np.lib.format.read_array_header_2_0
+            write_header = np.lib.format.write_array_header_2_0
+        shape, fortran_order, dtype = read_header(column)
+        start = column.tell()
+        values = np.asarray(values, dtype=dtype)
+        header = io.BytesIO()
+        write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                              "fortran_order": False,
+                              "shape": (shape[0] + len(values),)})
+        if len(header.getvalue()) == start:
+            column.seek(start + shape[0]*dtype.itemsize)
+            column.truncate()
+            column.write(values.tobytes())
+            column.flush()
+            column.seek(0)
+            column.write(header.getvalue())
+            return
+    rows = np.load(path)[:shape[0]]
+    tmp = "{}.tmp.npy".format(path[:-len(".npy")])
+    np.save(tmp, np.concatenate([rows, values]))
+    os.rename(tmp, path)
+
+
+def append_dataset(records, output):
+    """ Append parsed astrorate files to a dataset written by write_dataset
+
+    Parameters: records: iterable of (element, mass, model, reaction,
+                         temperatures, rates)
+                output: the directory of the dataset
+    Returns:    The number of rows appended
+    Algorithm:  Add the new models and reactions to the end of their
+                tables, so the codes of the rows already written stay
+                the same, then append the sorted records to every column.
+                The dataset is written if it does not exist
+    """
+    if not os.path.exists(os.path.join(output, "rate.npy")):
+        return write_dataset(records, output)
+    records = sorted(records, key=lambda record: record[:4])
+    tables = {}
+    for name, position in (("models", 2), ("reactions", 3)):
+        table = np.load(os.path.join(output, name + ".npy")).tolist()
+        for value in sorted(set(record[position] for record in records)
+                            - set(table)):
+            table.append(value)
+        tables[name] = table
+        tmp = os.path.join(output, name + ".tmp.npy")
+        np.save(tmp, np.array(table, dtype="U"))
+        os.rename(tmp, os.path.join(output, name + ".npy"))
+    columns = dataset_columns(
+        records,
+        dict((model, n) for n, model in enumerate(tables["models"])),
+        dict((reaction, n) for n, reaction in enumerate(tables["reactions"])))
+    for name, column in columns.items():
+        append_column(os.path.join(output, name + ".npy"), column)
+    return len(columns["rate"])
+
+
+def build_dataset(directory, output=None):
+    """ Parse every astrorate file of a campaign into a dataset
+
+    Parameters: directory: the root directory of the campaign
+                output: where to write the dataset. Defaults to the
+                        directory "dataset" in the root directory
+    Returns:    The path of the dataset
+    """
+    if output is None:
+        output = os.path.join(directory, "dataset")
+    records = []
+    for element, mass, model, reaction, source in find_rate_files(
+            os.path.join(directory, "results_data")):
+        temperatures, rates = parse_astrorate(read_source(source))
+        records.append((element, mass, model, reaction, temperatures, rates))
+    write_dataset(records, output)
+    return output
+
+
+class Dataset(object):
+    """ A columnar dataset written by write_dataset
+
+    The columns are memory-mapped, see the module docstring
+    """
+    columns = ("element", "mass", "model", "reaction", "temperature", "rate")
+
+    def __init__(self, directory):
+        """ Parameters: directory: the directory of the dataset """
+        self.directory = directory
+        for name in self.columns:
+            setattr(self, name, np.load(os.path.join(directory, name + ".npy"),
+                                        mmap_mode="r"))
+        self.models = np.load(os.path.join(directory, "models.npy"))
+        self.reactions = np.load(os.path.join(directory, "reactions.npy"))
+
+    def __len__(self):
+        """ The number of rows """
+        return len(self.rate)
+
+    def select(self, element=None, mass=None, model=None, reaction=None):
+        """ Find the rows matching the given values
+
+        Parameters: element, mass, model, reaction: the values to match.
+                    None matches every value. model and reaction are
+                    given by name
+        Returns:    A boolean array, True for the matching rows
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if element is not None:
+            mask &= self.element == element
+        if mass is not None:
+            mask &= self.mass == int(mass)
+        if model is not None:
+            mask &= self.model == self.code(self.models, model)
+        if reaction is not None:
+            mask &= self.reaction == self.code(self.reactions, reaction)
+        return mask
+
+    def code(self, table, name):
+        """ The index of a name in the table of models or reactions """
+        found = np.flatnonzero(table == name)
+        return found[0] if len(found) else -1
+
+    def rates(self, element, mass, model="", reaction="g"):
+        """ The temperatures and rates of one astrorate file
+
+        Parameters: element: the element of the target
+                    mass: the mass of the target
+                    model: the name of the job
+                    reaction: the suffix of the astrorate file
+        Returns:    Two arrays, the temperatures and the rates
+        """
+        mask = self.select(element, mass, model, reaction)
+        return self.temperature[mask], self.rate[mask]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory",
+                        help="the TALYS-calculations directory to parse")
+    parser.add_argument("--output",
+                        help=("where to write the dataset. Defaults to"
+                              "\ndataset in the TALYS-calculations directory"))
+    args = parser.parse_args()
+    output = build_dataset(args.directory, args.output)
+    dataset = Dataset(output)
+    print("Wrote {} rows of {} models to {}".format(len(dataset),
+                                                    len(dataset.models),
+                                                    output))
@@ -0,0 +1,142 @@
+"""
+This module contains an execution engine running TALYS from a single
+asyncio event loop. It is an alternative to scheduler.WorkerPool which
+needs no Python process per TALYS run: the event loop supervises every
+running TALYS directly. Requires Python 3.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+
+class AsyncEngine(object):
+    """ Runs TALYS as asyncio subprocesses with limited concurrency
+
+    Has the same interface as scheduler.WorkerPool. The event loop runs in a
+    background thread, so the Manager submits jobs as before. Each run is
+    started with its work directory given as cwd, as changing the
+    directory of the process is not safe with threads.
+    """
+
+    def __init__(self, launch, finish, processes, queue_size=None,
+                 logger=None):
+        """ Create the engine. The event loop is started on the first submit
+
+        Parameters: launch: function called in a thread with the submitted
+                            arguments, returning the command, the work
+                            directory and the paths of the input and
+                            output files
+                    finish: function called in a thread with the submitted
+                            arguments followed by stderr and the resource
+                            usage. Only the wall time and exit code are
+                            measured, as the event loop reaps the
+                            processes itself
+                    processes: the maximum number of concurrent TALYS runs
+                    queue_size: the maximum number of jobs waiting to start.
+                                Defaults to the number of processes
+                    logger: where to log errors
+        Returns:    None
+        """
+        self.launch = launch
+        self.finish = finish
+        self.processes = processes
+        self.logger = logger or logging.getLogger()
+        # Blocks submit() when too many jobs are pending
+        self.capacity = processes + (queue_size or processes)
+        self.pending = threading.BoundedSemaphore(self.capacity)
+        # Created in the event loop
+        self.running = None
+        self.loop = None
+        self.thread = None
+
+    def __enter__(self):
+        """ In order to be used with the with-statement """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Wait for the jobs to finish when exiting """
+        self.close()
+
+    def start(self):
+        """ Start the event loop in a background thread """
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.serve, name="AsyncEngine")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        """ Run the event loop until it is stopped by close() """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, *args):
+        """ Schedule a job
+
+        Parameters: args: the arguments to pass to launch and finish
+        Returns:    None
+        Algorithm:  Start the event loop if this is the first job. Block
+                    until there is room for another pending job
+        """
+        if self.loop is None:
+            self.start()
+        self.pending.acquire()
+        asyncio.run_coroutine_threadsafe(self.run(*args), self.loop)
+
+    async def run(self, *args):
+        """ Run one job in the event loop
+
+        Parameters: args: the arguments to pass to launch and finish
+        Returns:    None
+        Algorithm:  Wait for a free slot, start TALYS and wait for it
+                    without blocking the loop. The job is prepared by
+                    launch and its result files are collected by finish,
+                    both in a thread
+        """
+        if self.running is None:
+            self.running = asyncio.Semaphore(self.processes)
+        try:
+            async with self.running:
+                # With --scratch, launch creates a directory and copies
+                # the input files, which must not stall the other jobs
+                command, cwd, input_path, output_path = (
+                    await self.loop.run_in_executor(None, self.launch, *args))
+                start = time.time()
+                with open(input_path, "r") as stdin, \
+                        open(output_path, "w") as stdout:
+                    process = await asyncio.create_subprocess_exec(
+                        command, cwd=cwd, stdin=stdin, stdout=stdout,
+                        stderr=asyncio.subprocess.PIPE,
+                        # Do not send signals to the subprocess
+                        start_new_session=True)
+                _, stderr = await process.communicate()
+                elapsed = time.time() - start
+            # The exit code as accounting.usage_of gives it, negative if
+            # killed by a signal
+            usage = {"wall": elapsed, "exit_code": process.returncode}
+            await self.loop.run_in_executor(None, self.finish,
+                                            *(args + (stderr, usage)))
+        except Exception:
+            self.logger.exception("An error occured in the async engine")
+        finally:
+            self.pending.release()
+
+    def close(self):
+        """ Wait for every submitted job and stop the event loop
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Every job holds the pending semaphore until it is done,
+                    so all jobs are done once the whole semaphore is held
+        """
+        if self.loop is None:
+            return
+        for n in range(self.capacity):
+            self.pending.acquire()
+        for n in range(self.capacity):
+            self.pending.release()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
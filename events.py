@@ -0,0 +1,72 @@
+"""
+This module contains the event log, a machine-readable record of what
+happens to the jobs of a campaign, written next to talys.log as one line of
+JSON per event when --events is given. The events are
+    job_start:       TALYS is started for a job, or with MPI the job is sent
+                     to a rank
+    job_end:         TALYS finished a job, which was collected successfully
+    job_failed:      TALYS failed, or the results could not be collected
+    copy_done:       the result files of a run were collected
+    scheduler_stall: a worker waited longer than the stall time for a job,
+                     or an MPI rank for a batch
+Every event has the time, the name of the event and the pid of the process
+or the MPI rank it happened on. The events of a job have its key and label,
+and the events with a duration have it in seconds.
+
+The processes put the events on a queue, and a thread in the main process
+writes them, so logging an event never makes a worker wait for the file.
+Requires Python 3.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats an event as one line of JSON """
+
+    def format(self, record):
+        event = {"time": record.created, "event": record.msg}
+        event.update(record.fields)
+        return json.dumps(event, sort_keys=True)
+
+
+class EventLog(object):
+    """ Writes events through a non-blocking queue
+
+    The logger of the events does not propagate, so the events never
+    reach talys.log or the terminal.
+    """
+
+    def __init__(self, path):
+        """ Parameters: path: the file to append the events to """
+        self.path = path
+        # Shared with the forked workers, which only put events on it
+        self.queue = multiprocessing.Queue()
+        handler = logging.FileHandler(path)
+        handler.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, handler)
+        self.listener.start()
+        self.logger = logging.getLogger("talys.events")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(QueueHandler(self.queue))
+
+    def emit(self, event, **fields):
+        """ Log an event
+
+        Parameters: event: the name of the event
+                    fields: what to store with the event. The pid of the
+                            process is added unless the rank is given
+        Returns:    None
+        """
+        if "rank" not in fields:
+            fields["pid"] = os.getpid()
+        self.logger.info(event, extra={"fields": fields})
+
+    def close(self):
+        """ Write the events left on the queue and stop the thread """
+        self.listener.stop()
@@ -0,0 +1,415 @@
+"""
+This module contains the harvester, which parses the astrorate files and
+output files of a campaign in a pool of processes. The size and
+modification time of every parsed file is remembered together with what
+was parsed, so running it again only parses new or changed files. With
+--follow, it keeps harvesting a running campaign by tailing its run log,
+runs.jsonl. Only the files of the jobs added to the run log are parsed,
+and appended to the dataset, the timings and the state.
+The rates are written as the dataset of dataset.py, and the execution
+times of the jobs to timings.csv in the same directory.
+Syntax:
+python talys.py harvest [TALYS-calculations-directory] [-p N] [--follow SECONDS]
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import time
+from accounting import RunLog
+from archive import ResultArchive
+from dataset import (find_rate_files, parse_astrorate, write_dataset,
+                     append_dataset, ISOTOPE, RATE_FILE)
+from measure import talys_stamp, seconds
+
+
+def parse_file(task):
+    """ Parse one file. Run by the processes of the pool
+
+    Parameters: task: (kind, source, description) where kind is "rate" or
+                      "output", source is a path or (path, offset, length)
+                      in an archive and description is what is known of
+                      the job from the path
+    Returns:    The description followed by what was parsed: the
+                temperatures and rates of an astrorate file, or the
+                execution time in seconds of an output file
+    """
+    kind, source, description = task
+    if kind == "output":
+        # Only the end of the output file is read
+        stamp = talys_stamp(source)
+        return description + (None if stamp is None else seconds(stamp[1]),)
+
+    if isinstance(source, tuple):
+        path, offset, length = source
+        with open(path, "rb") as infile:
+            infile.seek(offset)
+            text = infile.read(length).decode("utf8")
+    else:
+        with open(source, "r") as infile:
+            text = infile.read()
+    return description + parse_astrorate(text)
+
+
+def complete(kind, result):
+    """ Whether a parsed file is final. The output file of a job still
+    running, or of a failed job, has no execution time yet """
+    return kind != "output" or result[-1] is not None
+
+
+def ignore_interrupt():
+    """ Leave Ctrl-C to the parent, which stops the pool """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Harvester(object):
+    """ Incrementally parses the results of a campaign """
+    state_filename = "harvest.pickle"
+
+    def __init__(self, root, output=None, processes=None):
+        """ Parameters: root: the root directory of the campaign
+                        output: where to write the dataset. Defaults to
+                                the directory "dataset" in root
+                        processes: the size of the pool. Defaults to the
+                                   number of cores
+        """
+        self.root = root
+        self.output = output or os.path.join(root, "dataset")
+        self.processes = processes or multiprocessing.cpu_count()
+        self.state_path = os.path.join(root, self.state_filename)
+        # Maps each file to its size and mtime and what was parsed from it
+        self.parsed = {}
+        if os.path.exists(self.state_path):
+            self.load()
+
+    def load(self):
+        """ Read the state written by save and append """
+        with open(self.state_path, "rb") as state:
+            self.parsed = pickle.load(state)
+            while True:
+                try:
+                    self.parsed.update(pickle.load(state))
+                except (EOFError, pickle.UnpicklingError):
+                    # The end, or an append interrupted by a crash
+                    break
+
+    def scan(self):
+        """ Find the files to parse
+
+        Parameters: None
+        Returns:    dict of an identifier of the file: (stamp, task) where
+                    stamp is the size and mtime of the file, and task is
+                    what to give parse_file
+        Algorithm:  Find the astrorate files in results_data, as in
+                    dataset.py, and the output files in original_data.
+                    A file in an archive never changes, so it is stamped
+                    by its position in the archive
+        """
+        found = {}
+        results = os.path.join(self.root, "results_data")
+        for element, mass, model, reaction, source in find_rate_files(results):
+            description = (element, mass, model, reaction)
+            if isinstance(source, tuple):
+                archive, key, name = source
+                position = tuple(archive.load()[key]["files"][name])
+                found[(archive.data_path, key, name)] = (
+                    position,
+                    ("rate", (archive.data_path,) + position, description))
+            else:
+                stat = os.stat(source)
+                found[source] = ((stat.st_size, stat.st_mtime),
+                                 ("rate", source, description))
+
+        original = os.path.join(self.root, "original_data")
+        for root, dirs, files in os.walk(original):
+            if "output.txt" not in files:
+                continue
+            # The output file is either in the isotope directory or in the
+            # directory of the job, named after the job
+            model = ""
+            match = ISOTOPE.match(os.path.basename(root))
+            if match is None:
+                model = os.path.basename(root)
+                match = ISOTOPE.match(os.path.basename(os.path.dirname(root)))
+                if match is None:
+                    continue
+            path = os.path.join(root, "output.txt")
+            stat = os.stat(path)
+            found[path] = ((stat.st_size, stat.st_mtime),
+                           ("output", path,
+                            (match.group(2), int(match.group(1)), model)))
+        return found
+
+    def harvest(self, pool):
+        """ Parse the new and changed files
+
+        Parameters: pool: the multiprocessing.Pool to parse in
+        Returns:    The number of files parsed
+        Algorithm:  Compare the stamps of the files found with the stamps
+                    of the files already parsed. Files which are gone are
+                    forgotten. An output file without the execution time is
+                    of a job still running or failed, and is parsed again
+                    the next time
+        """
+        found = self.scan()
+        changed = [name for name, (stamp, task) in found.items()
+                   if name not in self.parsed
+                   or self.parsed[name][0] != stamp]
+        for name in list(self.parsed):
+            if name not in found:
+                del self.parsed[name]
+        tasks = [found[name][1] for name in changed]
+        chunksize = max(1, len(tasks)//(4*self.processes))
+        for name, result in zip(changed, pool.map(parse_file, tasks,
+                                                  chunksize)):
+            if complete(found[name][1][0], result):
+                self.parsed[name] = (found[name][0], found[name][1][0],
+                                     result)
+            else:
+                self.parsed.pop(name, None)
+        return len(changed)
+
+    def save(self):
+        """ Write the dataset, the timings and the state
+
+        Parameters: None
+        Returns:    None
+        """
+        rates = [result for stamp, kind, result in self.parsed.values()
+                 if kind == "rate"]
+        write_dataset(rates, self.output)
+        timings = sorted(result for stamp, kind, result in self.parsed.values()
+                         if kind == "output")
+        with open(os.path.join(self.output, "timings.csv"), "w") as outfile:
+            outfile.write("element,mass,model,seconds\n")
+            for element, mass, model, elapsed in timings:
+                outfile.write("{},{},{},{}\n".format(
+                    element, mass, model, "" if elapsed is None else elapsed))
+
+        tmp = "{}.tmp-{}".format(self.state_path, os.getpid())
+        with open(tmp, "wb") as state:
+            pickle.dump(self.parsed, state, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.state_path)
+
+    def job_files(self, run, listings):
+        """ Find the files of a job in the run log
+
+        Parameters: run: the run, see accounting.RunLog
+                    listings: dict of the file names and archives of
+                              the result directories, shared by the runs
+                              of a fold so each is read once
+        Returns:    dict of the files as scan, or None if the run does not
+                    tell where its files are
+        """
+        if "work_directory" not in run or "result_directory" not in run:
+            return None
+        isotope, _, model = run["label"].partition("-")
+        match = ISOTOPE.match(isotope)
+        if match is None:
+            return {}
+        element, mass = match.group(2), int(match.group(1))
+        found = {}
+        path = os.path.join(self.root, run["work_directory"], "output.txt")
+        if os.path.exists(path):
+            stat = os.stat(path)
+            found[path] = ((stat.st_size, stat.st_mtime),
+                           ("output", path, (element, mass, model)))
+
+        results = os.path.join(self.root, run["result_directory"])
+        if results not in listings:
+            try:
+                listings[results] = os.listdir(results)
+            except OSError:
+                listings[results] = []
+        if ResultArchive.index_filename in listings[results]:
+            # The index is read once for the runs of the isotope
+            archive = listings.setdefault((results, "archive"),
+                                          ResultArchive(results))
+            if run["key"] not in archive:
+                return found
+            files = archive.load()[run["key"]]["files"]
+            for name in files:
+                match = RATE_FILE.match(name)
+                if match is not None:
+                    position = tuple(files[name])
+                    found[(archive.data_path, run["key"], name)] = (
+                        position,
+                        ("rate", (archive.data_path,) + position,
+                         (element, mass, model, match.group(2))))
+            return found
+        for name in listings[results]:
+            match = RATE_FILE.match(name)
+            if match is None or (match.group(1) or "") != model:
+                continue
+            path = os.path.join(results, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found[path] = ((stat.st_size, stat.st_mtime),
+                           ("rate", path,
+                            (element, mass, model, match.group(2))))
+        return found
+
+    def tail(self, offset):
+        """ Read the runs added to the run log
+
+        Parameters: offset: where the runs not read yet start
+        Returns:    The list of runs and the offset after them. A line
+                    still being written is left for the next call
+        """
+        path = os.path.join(self.root, RunLog.filename)
+        runs = []
+        if not os.path.exists(path):
+            return runs, offset
+        with open(path, "rb") as infile:
+            infile.seek(offset)
+            for line in infile:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    runs.append(json.loads(line.decode("utf8")))
+                except ValueError:
+                    continue
+        return runs, offset
+
+    def fold(self, pool, runs):
+        """ Parse the files of new runs and append them
+
+        Parameters: pool: the multiprocessing.Pool to parse in
+                    runs: the runs read from the run log, see tail
+        Returns:    The number of files parsed
+        Algorithm:  Find the files of each successful run, and parse the
+                    ones not parsed before. If a run does not tell where
+                    its files are, as in the run log of an older talys.py,
+                    or a file has changed since it was parsed, its rows
+                    can not simply be appended, and the whole campaign is
+                    harvested and written again instead
+        """
+        found = {}
+        listings = {}
+        for run in runs:
+            if run.get("failed"):
+                continue
+            files = self.job_files(run, listings)
+            if files is None:
+                found = None
+                break
+            found.update(files)
+        if found is not None and any(
+                name in self.parsed and self.parsed[name][0] != stamp
+                for name, (stamp, task) in found.items()):
+            found = None
+        if found is None:
+            count = self.harvest(pool)
+            if count:
+                self.save()
+            return count
+
+        new = [name for name in found if name not in self.parsed]
+        if not new:
+            return 0
+        tasks = [found[name][1] for name in new]
+        chunksize = max(1, len(tasks)//(4*self.processes))
+        entries = {}
+        for name, result in zip(new, pool.map(parse_file, tasks, chunksize)):
+            if complete(found[name][1][0], result):
+                entries[name] = (found[name][0], found[name][1][0], result)
+        self.parsed.update(entries)
+        self.append(entries)
+        return len(new)
+
+    def append(self, entries):
+        """ Append newly parsed files to the dataset, timings and state
+
+        Parameters: entries: dict of the files parsed, as self.parsed
+        Returns:    None
+        """
+        append_dataset([result for stamp, kind, result in entries.values()
+                        if kind == "rate"], self.output)
+        timings = sorted(result for stamp, kind, result in entries.values()
+                         if kind == "output")
+        with open(os.path.join(self.output, "timings.csv"), "a") as outfile:
+            for element, mass, model, elapsed in timings:
+                outfile.write("{},{},{},{}\n".format(
+                    element, mass, model, "" if elapsed is None else elapsed))
+        # Read back by load, after the state written by save
+        with open(self.state_path, "ab") as state:
+            pickle.dump(entries, state, pickle.HIGHEST_PROTOCOL)
+
+    def run(self, follow=None):
+        """ Harvest the campaign
+
+        Parameters: follow: if given, keep harvesting every follow seconds
+                            the jobs added to the run log, until
+                            interrupted
+        Returns:    None
+        """
+        pool = multiprocessing.Pool(self.processes, ignore_interrupt)
+        try:
+            # The runs logged during the harvest are read again by fold,
+            # which skips the files already parsed
+            run_log = os.path.join(self.root, RunLog.filename)
+            offset = (os.path.getsize(run_log) if os.path.exists(run_log)
+                      else 0)
+            start = time.time()
+            count = self.harvest(pool)
+            self.save()
+            print("Parsed {} new or changed files in {:.1f} s".format(
+                count, time.time() - start))
+            while follow:
+                time.sleep(follow)
+                runs, offset = self.tail(offset)
+                if not runs:
+                    continue
+                count = self.fold(pool, runs)
+                if count:
+                    print("Folded in {} new or changed files".format(count))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def latest_campaign():
+    """ The latest TALYS-calculations directory in the current directory """
+    folders = sorted(name for name in os.listdir(".") if
+                     os.path.isdir(name) and
+                     name.startswith("TALYS-calculations-"))
+    return folders[-1] if folders else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="talys.py harvest",
+        description="Parse the results of a campaign into a dataset")
+    parser.add_argument("directory",
+                        help=("the TALYS-calculations directory to harvest."
+                              "\nDefaults to the latest"),
+                        nargs="?")
+    parser.add_argument("-p", "--processes",
+                        help="the number of processes. Defaults to all cores",
+                        type=int, default=None, metavar="N")
+    parser.add_argument("--follow",
+                        help=("keep harvesting a running campaign, checking its"
+                              "\nrun log every SECONDS"),
+                        type=float, default=None, metavar="SECONDS")
+    parser.add_argument("--output",
+                        help=("where to write the dataset. Defaults to dataset"
+                              "\nin the TALYS-calculations directory"))
+    args = parser.parse_args(argv)
+
+    directory = args.directory or latest_campaign()
+    if directory is None:
+        parser.error("Found no TALYS-calculations directory")
+    Harvester(directory, args.output, args.processes).run(args.follow)
+
+
+if __name__ == "__main__":
+    main()
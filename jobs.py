@@ -0,0 +1,346 @@
+"""
+This module contains the job plan, which enumerates the parameter space
+given in the input file. The plan is a generator of small job descriptors
+and does not touch the file system, so every way of running TALYS
+(serial, multiprocessing, MPI or --dummy) consumes the same stream of jobs.
+It also contains the renderer of the TALYS input files of the jobs.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from itertools import product
+import os
+from tools import StyleFormatter
+
+try:
+    # Python 3
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+
+# A single TALYS run.
+#   element, mass:    the isotope
+#   values:           the values of the varying keywords, in the order of
+#                     JobPlan.varying_keys
+#   conditions:       the chosen key from each group of dependents
+#   name:             the name of the job, built from values and conditions
+#   work_directory:   where the input file is written and TALYS is run
+#   result_directory: where the result files of the isotope are collected
+class Job(namedtuple("Job", ["element", "mass", "values", "conditions",
+                             "name", "work_directory", "result_directory"])):
+    __slots__ = ()
+
+    @property
+    def label(self):
+        """ Short description of the job used in the log, e.g 162Dy-2-3 """
+        if self.name:
+            return "{}{}-{}".format(self.mass, self.element, self.name)
+        return "{}{}".format(self.mass, self.element)
+
+
+class JobPlan(object):
+    """ Streams the jobs given by the input options
+
+    The jobs are ordered by element, then mass, and then by the product of
+    the varying keywords in alphabetical order followed by the dependents.
+    """
+    # The names of the isotope directories. See tools.StyleFormatter
+    element_style = "{Z_nr[element]}{element}"
+    mass_style = "{mass}{element}"
+
+    def __init__(self, reader, work_root, result_root, Z_nr):
+        """ Sort the keywords into constant and varying keywords
+
+        Parameters: reader: the input options
+                    work_root: the directory to create the work directories in
+                    result_root: the directory to create the result
+                                 directories in
+                    Z_nr: dict mapping element symbols to the zero-padded
+                          proton number
+        Returns:    None
+        Algorithm:  A keyword with more than one value varies. Element and
+                    mass are handled by the directory structure. The values
+                    of the constant keywords are unwrapped once, here.
+        """
+        self.reader = reader
+        self.work_root = work_root
+        self.result_root = result_root
+        self.Z_nr = Z_nr
+
+        # The keys varying from job to job, in alphabetical order,
+        # and their possible values
+        self.varying_keys = []
+        values = []
+        # The keywords that are the same for every job of an isotope
+        self.constants = {}
+        for key in sorted(reader.keywords.keys()):
+            if (len(reader[key]) > 1
+                and key != "element"
+                and key != "mass"):
+                self.varying_keys.append(key)
+                values.append(reader[key])
+            else:
+                self.constants[key] = unwrap(reader[key])
+        # Exactly one key of each group of dependents is chosen
+        for condition in reader.dependents:
+            values.append(list(condition.keys()))
+        self.values = values
+
+    def __len__(self):
+        """ The total number of jobs
+
+        Parameters: None
+        Returns:    The number of jobs
+        Algorithm:  Multiply the number of isotopes with the size of the
+                    product of the varying values
+        """
+        per_isotope = 1
+        for value in self.values:
+            per_isotope *= len(value)
+        isotopes = sum(len(self.reader["mass"][element])
+                       for element in self.reader["element"])
+        return isotopes*per_isotope
+
+    def __iter__(self):
+        """ Yield every job
+
+        Parameters: None
+        Returns:    A generator of Job
+        Algorithm:  Iterate over element, mass and the product of the
+                    varying values and dependents, naming each job
+                    after the values
+        """
+        fmt = StyleFormatter()
+        nkeys = len(self.varying_keys)
+        for element in self.reader["element"]:
+            element_directory = fmt.format(self.element_style,
+                                           element=element, Z_nr=self.Z_nr)
+            for mass in self.reader["mass"][element]:
+                mass_directory = fmt.format(self.mass_style,
+                                            element=element, mass=mass)
+                work_directory = os.path.join(self.work_root,
+                                              element_directory,
+                                              mass_directory)
+                result_directory = os.path.join(self.result_root,
+                                                element_directory,
+                                                mass_directory)
+                for value in product(*self.values):
+                    keywordvals = value[:nkeys]
+                    conditionkeys = value[nkeys:]
+                    name = self.make_name(keywordvals, conditionkeys)
+                    yield Job(element, mass, keywordvals, conditionkeys, name,
+                              os.path.join(work_directory, name) if name
+                              else work_directory,
+                              result_directory)
+
+    def make_name(self, keywordvals, conditionkeys):
+        """ Name a job after its values
+
+        The format is keyword1value-keyword2value-...-conditional1name-
+        conditional1value-conditional2name-conditional2value-...
+        Parameters: keywordvals: the values of the varying keywords
+                    conditionkeys: the chosen dependents
+        Returns:    The name as a string
+        """
+        name = '-'.join(str(value) for value in keywordvals)
+        for key in conditionkeys:
+            name = "{}-{}-{}".format(name, key,
+                                     self.reader.get_condition_val(key))
+        return name
+
+    def isotope_keywords(self, job, custom=None):
+        """ The TALYS keywords shared by every job of an isotope
+
+        Parameters: job: any Job of the isotope
+                    custom: keywords from the custom blocks of the isotope
+        Returns:    dict of keyword: value
+        Algorithm:  Copy the constant keywords, set the isotope and add the
+                    custom keywords. This is done once per isotope
+        """
+        keywords = dict(self.constants)
+        keywords["element"] = job.element
+        keywords["mass"] = job.mass
+        if custom:
+            keywords.update(custom)
+        return keywords
+
+    def keywords(self, job, isotope_keywords):
+        """ The TALYS keywords of a job
+
+        Parameters: job: the Job
+                    isotope_keywords: the result of self.isotope_keywords
+                                      for the isotope of the job
+        Returns:    Keywords
+        Algorithm:  Put the varying keywords and the dependents on top of
+                    the keywords of the isotope without copying them
+        """
+        own = dict(zip(self.varying_keys, (unwrap(value)
+                                           for value in job.values)))
+        for key in job.conditions:
+            own[key] = unwrap(self.reader.get_condition_val(key))
+        return Keywords(isotope_keywords, own)
+
+
+class Keywords(Mapping):
+    """ The read-only keywords of a single job
+
+    The keywords shared by every job of an isotope are kept in one dict,
+    while each job only holds the few keywords that are its own. Creating
+    a job is therefore independent of the total number of keywords.
+    Iterating gives the shared keys first, followed by the job's own keys,
+    the same order as if the job's keys had been added to a copy of
+    the shared dict.
+    """
+    __slots__ = ("shared", "own")
+
+    def __init__(self, shared, own):
+        """ Parameters: shared: dict of the keywords shared with other jobs.
+                                Must not be modified
+                        own: dict of the keywords of this job
+        """
+        self.shared = shared
+        self.own = own
+
+    def __getitem__(self, key):
+        if key in self.own:
+            return self.own[key]
+        return self.shared[key]
+
+    def __iter__(self):
+        for key in self.shared:
+            yield key
+        for key in self.own:
+            if key not in self.shared:
+                yield key
+
+    def __len__(self):
+        return len(self.shared) + sum(1 for key in self.own
+                                      if key not in self.shared)
+
+    def items(self):
+        """ Iterate over the keywords without looking up each key """
+        own = self.own
+        for key, value in self.shared.items():
+            yield key, own[key] if key in own else value
+        for key, value in own.items():
+            if key not in self.shared:
+                yield key, value
+
+
+class InputRenderer(object):
+    """ Renders the TALYS input file of a job
+
+    The input file is a header naming the reaction, followed by one line
+    per keyword. The lines of the keywords shared by the jobs of an isotope
+    are rendered once into a template, so rendering a job only formats the
+    lines of its own keywords and joins the pieces.
+    """
+    # The keywords written in the header, and not again as keywords
+    header_keywords = ("projectile", "mass", "element", "energy")
+
+    def __init__(self, astro):
+        """ Parameters: astro: True if the energy file is not used """
+        self.astro = astro
+        # (id of the shared keywords, own keys): (shared keywords, template)
+        self.templates = {}
+
+    def header(self, keywords):
+        """ The header of the input file as a string """
+        projectile = keywords["projectile"]
+        mass = keywords["mass"]
+        element = keywords["element"]
+        # This shows the reaction taking place, e.g 159Eu(n,g)160Eu
+        reaction_line = "{}{}({},g){}{}".format(mass, element, projectile,
+                                                int(mass)+1, element)
+        lines = ["########################## \n",
+                 "##   TALYS input file   ## \n",
+                 "##{:^{}}## \n".format(reaction_line, 22),
+                 "########################## \n \n",
+                 "# All keywords are explained in README. \n \n",
+                 "element {} \n".format(element),
+                 "projectile {} \n".format(projectile),
+                 "mass {} \n".format(mass)]
+        if not self.astro:
+            lines.append("energy {} \n \n".format(keywords["energy"]))
+        else:
+            lines.append("energy 1\n")
+        return "".join(lines)
+
+    @staticmethod
+    def line(key, value):
+        """ The line of a keyword """
+        return "{} {} \n".format(key, str(value))
+
+    def compile(self, keywords):
+        """ Render the parts of an input file shared by other jobs
+
+        Parameters: keywords: the Keywords of a job
+        Returns:    tuple of the pieces of the input file, with None where
+                    the job's own text goes, and the (index, key) of every
+                    own keyword. The key is None for the header, if it
+                    depends on the job's own keywords
+        Algorithm:  Go through the keywords in the order they are written,
+                    joining the consecutive lines of shared keywords
+        """
+        own = keywords.own
+        pieces = []
+        slots = []
+        if any(key in own for key in self.header_keywords):
+            pieces.append(None)
+            slots.append((0, None))
+            text = []
+        else:
+            text = [self.header(keywords)]
+        for key, value in keywords.items():
+            if key in self.header_keywords:
+                continue
+            if key in own:
+                if text:
+                    pieces.append("".join(text))
+                    text = []
+                slots.append((len(pieces), key))
+                pieces.append(None)
+            else:
+                text.append(self.line(key, value))
+        if text:
+            pieces.append("".join(text))
+        return pieces, slots
+
+    def render(self, keywords):
+        """ Render the input file of a job
+
+        Parameters: keywords: the keywords of the job, usually Keywords
+        Returns:    The content of the input file as a string
+        Algorithm:  Look up the template of the shared keywords and the
+                    keys of the job, compiling it the first time, and fill
+                    in the job's own lines. A plain mapping is rendered
+                    line by line
+        """
+        if not isinstance(keywords, Keywords):
+            return self.header(keywords) + "".join(
+                self.line(key, value) for key, value in keywords.items()
+                if key not in self.header_keywords)
+        own = keywords.own
+        cache_key = (id(keywords.shared), tuple(own))
+        cached = self.templates.get(cache_key)
+        # The id of a dict can be reused once it is freed
+        if cached is None or cached[0] is not keywords.shared:
+            cached = (keywords.shared, self.compile(keywords))
+            self.templates[cache_key] = cached
+        pieces, slots = cached[1]
+        pieces = list(pieces)
+        for index, key in slots:
+            if key is None:
+                pieces[index] = self.header(keywords)
+            else:
+                pieces[index] = self.line(key, own[key])
+        return "".join(pieces)
+
+
+def unwrap(value):
+    """ Make a value into a non-list by picking its first item """
+    if isinstance(value, (list, tuple)):
+        return value[0]
+    return value
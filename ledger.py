@@ -0,0 +1,70 @@
+"""
+This module contains the ledger of completed jobs. Each job is identified
+by a hash of its rendered input file, and the hash is appended to the
+ledger when TALYS has run successfully. --resume uses the ledger to skip
+exactly the jobs that are done.
+"""
+
+from __future__ import print_function
+import hashlib
+import os
+
+
+def job_key(text):
+    """ Identify a job by its input file
+
+    Parameters: text: the rendered TALYS input file
+    Returns:    The hex digest of the input file as a string
+    """
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+class Ledger(object):
+    """ Append-only record of the completed jobs of a campaign
+
+    Every record is a single line written with O_APPEND and synced to disk
+    before returning, so records from several processes do not interleave
+    and survive a crash of the node.
+    """
+    filename = "ledger"
+
+    def __init__(self, directory):
+        """ Load the ledger of a campaign, if it has one
+
+        Parameters: directory: the root directory of the campaign
+        Returns:    None
+        Algorithm:  Read the keys of the completed jobs into a set
+        """
+        self.path = os.path.join(directory, self.filename)
+        self.completed = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as ledger_file:
+                for line in ledger_file:
+                    # A partial last line is left by a crash during a write
+                    key = line.strip()
+                    if len(key) == 40:
+                        self.completed.add(key)
+
+    def __contains__(self, key):
+        """ Check if a job is completed """
+        return key in self.completed
+
+    def __len__(self):
+        """ The number of completed jobs when the ledger was loaded """
+        return len(self.completed)
+
+    def record(self, key):
+        """ Mark a job as completed
+
+        Parameters: key: the key of the job, see job_key
+        Returns:    None
+        Algorithm:  Append the key as one write and fsync the file. The set
+                    in memory is not updated, as this is often called
+                    by a different process than the one checking it
+        """
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, "{}\n".format(key).encode("utf8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -3,59 +3,141 @@
 This script recursively searches through the directory structure, finds all
 output files and writes the time stamps into the output file.
 Syntax:
-python measure.py directory outfile slurmfile/logfile
+python measure.py directory outfile slurmfile/logfile [--format {text,csv,npy}]
+                  [-p N]
 """
 from __future__ import print_function
 import argparse
+import multiprocessing
 import os
 import re
 import sys
 import operator
-import copy
-
-
-def get_talys_stamps(directory):
-    do_run = True
-    timestamps = {}
-    pattern = re.compile(
-        "Execution time:\s*(\d*)\s*hours\s*(\d*)\s*minutes\s*(\d*\.\d*)\s*seconds")
-    for root, dirs, files in os.walk(directory, topdown=False):
-        Root = root
-        for name in files:
-            if name == "output.txt":
-                with open(os.path.join(root, name), "r") as output:
-                    match = ''
-                    for line in reversed(output.readlines()):
-                        match = re.search(pattern, line)
-                        if match:
-                            # print match.group(0)
-                            break
-                    if match is not None:
-                        timestamps[os.path.join(root, name)] = [
-                            match.group(1), match.group(2), match.group(3)]
-    return timestamps
+
+# The last line TALYS writes to the output file
+TALYS_PATTERN = re.compile(
+    br"Execution time:\s*(\d*)\s*hours\s*(\d*)\s*minutes\s*(\d*\.\d*)\s*seconds")
+# The line logged by talys.py for every finished job,
+# e.g. "(3/16) Execution time: 01:27 by 162Dy-2-3". The minutes do not wrap
+# after an hour, see format_elapsed
+SLURM_PATTERN = re.compile(r"Execution time:\s*(\d+):(\d\d) by (\S+)")
+
+
+def format_elapsed(elapsed):
+    """ Format a number of seconds as MM:SS, as logged by talys.py """
+    return "{:02d}:{:02d}".format(*divmod(int(round(elapsed)), 60))
+
+
+def find_last(path, pattern, block_size=8192):
+    """ Find the last match of a pattern in a file without reading all of it
+
+    Parameters: path: the path of the file
+                pattern: a compiled regex of bytes matching within one line
+                block_size: the number of bytes to read at a time
+    Returns:    The last match, or None if there is none
+    Algorithm:  Read blocks from the end of the file towards the start.
+                The partial line at the start of a block is kept and
+                searched together with the block before it
+    """
+    with open(path, "rb") as infile:
+        infile.seek(0, os.SEEK_END)
+        end = infile.tell()
+        partial = b""
+        while end > 0:
+            start = max(0, end - block_size)
+            infile.seek(start)
+            chunk = infile.read(end - start) + partial
+            end = start
+            match = None
+            for match in pattern.finditer(chunk):
+                pass
+            if match is not None:
+                return match
+            newline = chunk.find(b"\n")
+            partial = chunk if newline == -1 else chunk[:newline]
+    return None
+
+
+def talys_stamp(path):
+    """ The execution time written by TALYS in an output file
+
+    Parameters: path: the path of the output file
+    Returns:    The path and [hours, minutes, seconds] as strings,
+                or None if the output file has no execution time
+    """
+    match = find_last(path, TALYS_PATTERN)
+    if match is None:
+        return None
+    return path, [group.decode("ascii") for group in match.groups()]
+
+
+def get_talys_stamps(directory, processes=None):
+    """ Find the execution time of every output file in a directory
+
+    Parameters: directory: the directory to search
+                processes: the number of processes reading the files.
+                           Defaults to the number of cores
+    Returns:    dict of path: [hours, minutes, seconds]
+    """
+    paths = [os.path.join(root, "output.txt")
+             for root, dirs, files in os.walk(directory)
+             if "output.txt" in files]
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, len(paths)//(4*(processes or
+                                           multiprocessing.cpu_count())))
+        stamps = pool.map(talys_stamp, paths, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(stamp for stamp in stamps if stamp is not None)
+
+
+def job_label(path):
+    """ The label talys.py logs for the job of an output file, e.g 162Dy-2-3
+
+    The output file is in the directory of the job, which is in
+    the directory of the isotope
+    """
+    parts = path.split(os.sep)
+    return '-'.join([parts[-3], parts[-2]])
 
 
 def get_slurm_stamps(slurmfile, sorted_stamps):
-    pattern = re.compile("Execution time:\s*(\d\d):(\d\d)")
-    sorted_stamps = copy.deepcopy(sorted_stamps)
+    """ Find the execution time logged by talys.py for every job
+
+    Parameters: slurmfile: the log or slurm output of talys.py
+                sorted_stamps: list of (path, time) of the output files
+    Returns:    list of [path, time, [0, minutes, seconds]] for every job
+                found in the log
+    Algorithm:  Read the log once, indexing the execution times by the
+                label of the job, and look up every job in the index
+    """
+    logged = {}
+    with open(slurmfile, "r") as infile:
+        for line in infile:
+            match = SLURM_PATTERN.search(line)
+            if match is not None:
+                logged[match.group(3)] = [0, str(int(match.group(1))),
+                                          match.group(2)]
     stamps = []
-    with open(slurmfile, "r") as input:
-        for line in input:
-            #print(line)
-            for name, time in sorted_stamps:
-                #print(key.split('/')[-2])
-                s = name.split('/')
-                search_s = '-'.join([s[-3],s[-2]])
-                if search_s in line:
-                    match = re.search(pattern, line)
-                    stamps.append([name, time, [0, str(int(match.group(1))), match.group(2)]])
-                    sorted_stamps.remove((name, time))
-                    break
-    print("Missed ", len(sorted_stamps))
+    missed = 0
+    for name, time in sorted_stamps:
+        label = job_label(name)
+        if label in logged:
+            stamps.append([name, time, logged[label]])
+        else:
+            missed += 1
+    print("Missed ", missed)
     return stamps
 
 
+def seconds(stamp):
+    """ Convert [hours, minutes, seconds] to seconds """
+    hour, minute, second = stamp
+    return int(hour or 0)*3600 + int(minute or 0)*60 + float(second)
+
+
 def total_time(times):
     totalsecs = 0
     for hour, minute, second in times:
@@ -68,6 +150,65 @@ def total_time(times):
     return days, hour, minute, sec
 
 
+def write_text(outfile, sorted_names, slurmstamps):
+    """ Write the time stamps and their totals as text """
+    with open(outfile, "w") as output:
+        if slurmstamps is not None:
+            for name, time, ttime in slurmstamps:
+                output.write("{}:{}:{}/{}:{}:{} {:>30}\n".format(
+                    time[0], time[1], time[2], ttime[0], ttime[1], ttime[2],
+                    name))
+        else:
+            for name, time in sorted_names:
+                output.write("{}:{}:{} {:>30}\n".format(
+                    time[0], time[1], time[2],  name))
+
+        days, hours, minutes, secs = total_time(
+            [time for name, time in sorted_names])
+        output.write("{:-^20}\n".format("TOTAL"))
+        output.write("Days: {:<3} Hours: {:<3} Minutes: {:<3} Seconds: {:<3}\n".format(
+            days, hours, minutes, secs))
+        if slurmstamps is not None:
+            days, hours, minutes, secs = total_time(
+                [ttime for name, time, ttime in slurmstamps])
+            output.write("{:-^20}\n".format("SLURM"))
+            output.write("Days: {:<3} Hours: {:<3} Minutes: {:<3} Seconds: {:<3}\n".format(
+                days, hours, minutes, secs))
+
+
+def timing_rows(sorted_names, slurmstamps):
+    """ One row of (path, label, seconds, logged seconds) for every job.
+    The logged seconds are None if the job is not in the log """
+    logged = {}
+    if slurmstamps is not None:
+        logged = dict((name, seconds(ttime))
+                      for name, time, ttime in slurmstamps)
+    return [(name, job_label(name), seconds(time), logged.get(name))
+            for name, time in sorted_names]
+
+
+def write_csv(outfile, rows):
+    """ Write the timing of every job as CSV """
+    with open(outfile, "w") as output:
+        output.write("path,label,seconds,logged_seconds\n")
+        for name, label, secs, logged in rows:
+            output.write("{},{},{},{}\n".format(
+                name, label, secs, "" if logged is None else logged))
+
+
+def write_npy(outfile, rows):
+    """ Write the timing of every job as a structured NumPy array """
+    import numpy as np
+    width = max([len(name) for name, label, secs, logged in rows] + [1])
+    array = np.array([(name, label, secs,
+                       float("nan") if logged is None else logged)
+                      for name, label, secs, logged in rows],
+                     dtype=[("path", "U{}".format(width)),
+                            ("label", "U{}".format(width)),
+                            ("seconds", "f8"), ("logged_seconds", "f8")])
+    np.save(outfile, array)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("directory", help="the directory to be searched")
@@ -78,36 +219,28 @@ if __name__ == "__main__":
     parser.add_argument("slurmfile",
                         help="A slurmfile containing timestamps",
                         nargs='?')
+    parser.add_argument("--format",
+                        help=("the format of outfile: text with totals, CSV or a"
+                              "\nNumPy array with one row per job"),
+                        choices=["text", "csv", "npy"], default="text")
+    parser.add_argument("-p", "--processes",
+                        help="the number of processes reading the output files",
+                        type=int, default=None, metavar="N")
     args = parser.parse_args()
-    Root = ''
-    
-    timestamps = get_talys_stamps(args.directory)
+
+    timestamps = get_talys_stamps(args.directory, args.processes)
     if len(timestamps) == 0:
         print("Found no timestamps")
         sys.exit()
 
-    #outfile = open(os.path.join(Root, args.outfile), "w")
-    outfile = open(args.outfile, "w")
     sorted_names = sorted(timestamps.items(), key=operator.itemgetter(0))
+    slurmstamps = None
     if args.slurmfile is not None:
         slurmstamps = get_slurm_stamps(args.slurmfile, sorted_names)
-        for name, time, ttime in slurmstamps:
-            outfile.write("{}:{}:{}/{}:{}:{} {:>30}\n".format(
-                time[0], time[1], time[2], ttime[0], ttime[1], ttime[2], name
-            ))
-    else:
-        for name, time in sorted_names:
-            outfile.write("{}:{}:{} {:>30}\n".format(
-                time[0], time[1], time[2],  name))
-
-    days, hours, minutes, seconds = total_time(zip(*sorted_names)[1])
-    outfile.write("{:-^20}\n".format("TOTAL"))
-    outfile.write("Days: {:<3} Hours: {:<3} Minutes: {:<3} Seconds: {:<3}\n".format(
-        days, hours, minutes, seconds))
-    if args.slurmfile is not None:
-        days, hours, minutes, seconds = total_time(zip(*slurmstamps)[2])
-        outfile.write("{:-^20}\n".format("SLURM"))
-        outfile.write("Days: {:<3} Hours: {:<3} Minutes: {:<3} Seconds: {:<3}\n".format(
-            days, hours, minutes, seconds))       
 
-    outfile.close()
+    if args.format == "text":
+        write_text(args.outfile, sorted_names, slurmstamps)
+    elif args.format == "csv":
+        write_csv(args.outfile, timing_rows(sorted_names, slurmstamps))
+    else:
+        write_npy(args.outfile, timing_rows(sorted_names, slurmstamps))
@@ -0,0 +1,205 @@
+"""
+This module contains the profiler used by --profile. The stages of a job
+are timed by wrapping the methods of the Manager, so nothing is timed
+without --profile. The times are kept in shared memory, so the stages run
+by the workers are counted too. The main process is also profiled with
+cProfile and tracemalloc, and its stack is sampled for a flame graph;
+with --profile workers, so is every worker of the pool. Everything is
+written to the directory "profile" in the campaign root:
+    stages.txt         the calls and time of each stage
+    <name>.prof        the cProfile statistics, see the pstats module
+    <name>.txt         the functions taking the most time
+    <name>-memory.txt  the lines allocating the most memory
+    <name>.folded      the sampled stacks, one line each, with the number
+                       of samples, as read by flamegraph.pl
+where name is "main" or "worker-" followed by the pid.
+"""
+
+from __future__ import print_function
+import cProfile
+import functools
+import multiprocessing
+import os
+import pstats
+import sys
+import threading
+import time
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+class StageTimers(object):
+    """ The number of calls and the seconds spent in each stage
+
+    The stages are fixed when created, as the counts are shared with the
+    worker processes forked later. The times are inclusive, so a stage
+    calling another stage includes its time.
+    """
+
+    def __init__(self, stages):
+        """ Parameters: stages: the names of the stages """
+        self.stages = list(stages)
+        self.calls = multiprocessing.Array('i', len(self.stages))
+        self.seconds = multiprocessing.Array('d', len(self.stages))
+
+    def add(self, stage, seconds):
+        """ Count one call of a stage """
+        index = self.stages.index(stage)
+        with self.calls.get_lock():
+            self.calls[index] += 1
+            self.seconds[index] += seconds
+
+    def wrap(self, stage, function):
+        """ Time every call of a function as a stage """
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.time() - start)
+        return timed
+
+    def report(self, elapsed):
+        """ The stages as a table
+
+        Parameters: elapsed: the wall time of the campaign in seconds
+        Returns:    The table as a string, the stages taking the most
+                    time first
+        """
+        lines = ["{:<20} {:>8} {:>10} {:>10} {:>8}".format(
+            "stage", "calls", "seconds", "mean ms", "share")]
+        rows = sorted(zip(self.stages, self.calls[:], self.seconds[:]),
+                      key=lambda row: -row[2])
+        for stage, calls, seconds in rows:
+            lines.append("{:<20} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}%".format(
+                stage, calls, seconds, 1000*seconds/calls if calls else 0,
+                100*seconds/elapsed if elapsed else 0))
+        return "\n".join(lines) + "\n"
+
+
+class StackSampler(object):
+    """ Samples the stack of a thread for a flame graph
+
+    A background thread looks at the stack of the profiled thread every
+    interval and counts each distinct stack.
+    """
+
+    def __init__(self, interval=0.005):
+        """ Parameters: interval: the seconds between samples """
+        self.interval = interval
+        self.counts = {}
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """ Start sampling the calling thread """
+        self.thread_id = threading.current_thread().ident
+        self.thread = threading.Thread(target=self.sample,
+                                       name="StackSampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        """ The loop of the sampling thread """
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack = ";".join(reversed(stack))
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def stop(self):
+        """ Stop sampling """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def write(self, path):
+        """ Write the stacks in the folded format of flamegraph.pl """
+        with open(path, "w") as outfile:
+            for stack, count in sorted(self.counts.items()):
+                outfile.write("{} {}\n".format(stack, count))
+
+
+class Profiler(object):
+    """ Profiles the main process and, if asked to, the workers """
+
+    def __init__(self, directory, stages, workers=False):
+        """ Parameters: directory: where to write the profiles
+                        stages: the names of the stages to time
+                        workers: True to also profile the workers
+        """
+        self.directory = directory
+        self.timers = StageTimers(stages)
+        self.workers = workers
+        self.profile = None
+        self.sampler = None
+
+    def start(self):
+        """ Start profiling this process """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self, name):
+        """ Stop profiling this process and write its profiles
+
+        Parameters: name: the name of the files to write
+        Returns:    None
+        """
+        self.profile.disable()
+        self.sampler.stop()
+        path = os.path.join(self.directory, name)
+        self.profile.dump_stats(path + ".prof")
+        with open(path + ".txt", "w") as outfile:
+            stats = pstats.Stats(self.profile, stream=outfile)
+            stats.sort_stats("cumulative").print_stats(40)
+            stats.sort_stats("tottime").print_stats(40)
+        self.sampler.write(path + ".folded")
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with open(path + "-memory.txt", "w") as outfile:
+                for stat in snapshot.statistics("lineno")[:40]:
+                    outfile.write("{}\n".format(stat))
+
+    def start_worker(self):
+        """ Start profiling a worker of the pool, if asked to
+
+        The worker is forked while the main process is profiled, so that
+        profiling is stopped in the worker first
+        """
+        if self.profile is not None:
+            self.profile.disable()
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.workers:
+            self.start()
+
+    def stop_worker(self):
+        """ Write the profiles of a worker of the pool, if asked to """
+        if self.workers:
+            self.stop("worker-{}".format(os.getpid()))
+
+    def write_stages(self, elapsed):
+        """ Write the time of each stage
+
+        Parameters: elapsed: the wall time of the campaign in seconds
+        Returns:    None
+        """
+        with open(os.path.join(self.directory, "stages.txt"), "w") as outfile:
+            outfile.write(self.timers.report(elapsed))
@@ -0,0 +1,374 @@
+"""
+This module contains the runtime model, which predicts how long TALYS runs
+for a job from the timings of earlier campaigns, and the progress of a
+running campaign. The timings are read from the log of talys.py, the
+timings.csv of the harvester, the run log runs.jsonl or the CSV written by
+measure.py --format csv, or found in the directory of an earlier campaign.
+"""
+
+from __future__ import print_function
+import json
+import math
+import multiprocessing
+import os
+import re
+import time
+from measure import SLURM_PATTERN
+
+# The isotope at the start of a job label, e.g 162Dy in 162Dy-2-3
+ISOTOPE = re.compile(r"^(\d+)([A-Za-z]+)$")
+
+
+def read_timings(path):
+    """ Read the execution time of earlier jobs
+
+    Parameters: path: a log of talys.py, a CSV from the harvester or
+                      measure.py, or a run log, see accounting.RunLog
+    Returns:    A list of (label, seconds) where label is the label of
+                the job, see jobs.Job.label
+    Algorithm:  A run log is recognised by its .jsonl extension, and its
+                failed runs are skipped. Otherwise the format is decided
+                by the first line. The CSV of the harvester has element,
+                mass and model, the CSV of measure.py has the label. Any
+                other file is searched for the lines logged by talys.py
+    """
+    timings = []
+    if path.endswith(".jsonl"):
+        with open(path, "r") as infile:
+            for line in infile:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    # A partial line is left by a crash during a write
+                    continue
+                if not run.get("failed") and "wall" in run:
+                    timings.append((run["label"], float(run["wall"])))
+        return timings
+    with open(path, "r") as infile:
+        header = infile.readline().strip().split(",")
+        if header[:4] == ["element", "mass", "model", "seconds"]:
+            for line in infile:
+                element, mass, model, seconds = line.rstrip("\n").split(",")
+                if seconds:
+                    label = "{}{}".format(mass, element)
+                    if model:
+                        label = "{}-{}".format(label, model)
+                    timings.append((label, float(seconds)))
+        elif header[:3] == ["path", "label", "seconds"]:
+            for line in infile:
+                path, label, seconds = line.split(",")[:3]
+                timings.append((label, float(seconds)))
+        else:
+            infile.seek(0)
+            for line in infile:
+                match = SLURM_PATTERN.search(line)
+                if match is not None:
+                    minutes, seconds, label = match.groups()
+                    timings.append((label, 60*int(minutes) + int(seconds)))
+    return timings
+
+
+def normalise(value):
+    """ Make a keyword value comparable between campaigns, e.g 100.0 -> 100 """
+    if isinstance(value, (list, tuple)):
+        value = value[0]
+    try:
+        return "{:g}".format(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def reader_context(reader):
+    """ The keywords deciding the runtime which are the same for every job
+
+    Parameters: reader: the input options
+    Returns:    dict of the projectile, astro and the number of energies
+    """
+    return {"projectile": normalise(reader["projectile"]),
+            "astro": normalise(reader["astro"]),
+            "energies": normalise(reader["N"])}
+
+
+def campaign_context(path):
+    """ The context of the timings in a file, see reader_context
+
+    Parameters: path: a file in the root directory of a campaign, or at
+                      most two directories below it, as slurm/logs
+    Returns:    The context read from information.txt of the campaign,
+                or None if it was not found
+    """
+    names = {"projectile:": "projectile", "astro:": "astro",
+             "number of energies:": "energies"}
+    directory = os.path.dirname(os.path.abspath(path))
+    parent = os.path.dirname(directory)
+    for root in (directory, parent, os.path.dirname(parent)):
+        information = os.path.join(root, "information.txt")
+        if not os.path.exists(information):
+            continue
+        context = {}
+        with open(information, "r") as infile:
+            for line in infile:
+                for name, key in names.items():
+                    if line.startswith(name):
+                        context[key] = normalise(line[len(name):].strip())
+        return context
+    return None
+
+
+def timing_files(path):
+    """ The files with timings of a campaign, or the file itself
+
+    An earlier campaign is given by its root directory. The timings of the
+    harvester are used if it has been run, then the run log, which has
+    every run of every mode, and otherwise the logs of talys.py and of the
+    array tasks of --slurm. A directory of logs can be given as well
+    """
+    if not os.path.isdir(path):
+        return [path]
+    for name in (os.path.join("dataset", "timings.csv"), "runs.jsonl"):
+        if os.path.exists(os.path.join(path, name)):
+            return [os.path.join(path, name)]
+    files = []
+    for directory in (path, os.path.join(path, "slurm", "logs")):
+        if os.path.isdir(directory):
+            files.extend(os.path.join(directory, name)
+                         for name in sorted(os.listdir(directory))
+                         if name.endswith(".log"))
+    return files
+
+
+class RuntimeModel(object):
+    """ Predicts the runtime of a job from its label
+
+    A job seen before is predicted by its mean runtime. Otherwise the
+    logarithm of the runtime is taken as a sum of effects: a linear term
+    in the mass, and one effect for each feature of the job. The features
+    are the element, the isotope, each of the values the job is named after,
+    by position, and the projectile, astro and number of energies of the
+    campaign. A feature not seen before has no effect.
+    """
+    # The runtime in seconds predicted without any timings
+    default = 1.0
+    # The number of rounds of backfitting
+    iterations = 10
+
+    def __init__(self, timings=()):
+        """ Parameters: timings: iterable of (label, seconds) or
+                                 (label, seconds, context)
+        """
+        self.count = 0
+        self.mean = None
+        # The change of the logarithm of the runtime per nucleon
+        self.slope = 0.0
+        self.mean_mass = 0.0
+        # The effect of each feature on the logarithm of the runtime
+        self.effects = {}
+        # The mean runtime of each job seen
+        self.known = {}
+        self.fit(timings)
+
+    @classmethod
+    def from_files(cls, paths):
+        """ Fit a model to the timings in files or campaign directories
+
+        Parameters: paths: list of files, see read_timings, or root
+                           directories of earlier campaigns
+        Returns:    The RuntimeModel
+        """
+        timings = []
+        for path in paths:
+            for filename in timing_files(path):
+                context = campaign_context(filename)
+                timings.extend((label, seconds, context) for label, seconds
+                               in read_timings(filename))
+        return cls(timings)
+
+    def __len__(self):
+        """ The number of timings the model is fitted to """
+        return self.count
+
+    def mass(self, label):
+        """ The mass of the isotope of a job, or None if unknown """
+        match = ISOTOPE.match(label.split("-")[0])
+        return int(match.group(1)) if match is not None else None
+
+    def features(self, label, context=None):
+        """ The features of a job
+
+        Parameters: label: the label of the job, e.g 162Dy-2-3-localomp-n
+                    context: the context of the campaign, see
+                             reader_context
+        Returns:    A list of (kind, value)
+        """
+        parts = label.split("-")
+        features = []
+        match = ISOTOPE.match(parts[0])
+        if match is not None:
+            features.append(("element", match.group(2)))
+        features.append(("isotope", parts[0]))
+        features.extend(enumerate(parts[1:]))
+        if context:
+            features.extend(sorted(context.items()))
+        return features
+
+    def fit(self, timings):
+        """ Fit the model
+
+        Parameters: timings: iterable of (label, seconds) or
+                             (label, seconds, context)
+        Returns:    None
+        Algorithm:  Backfitting. In each round, the slope in the mass and
+                    then the effects of each kind of feature are refitted
+                    to what the rest of the model leaves unexplained.
+                    Runtimes below a second are counted as a second
+        """
+        timings = [(item[0], max(1.0, float(item[1])),
+                    item[2] if len(item) > 2 else None) for item in timings]
+        self.count = len(timings)
+        if not timings:
+            return
+        logs = [math.log(seconds) for label, seconds, context in timings]
+        self.mean = sum(logs)/len(logs)
+        features = [self.features(label, context)
+                    for label, seconds, context in timings]
+        kinds = sorted(set(kind for job in features for kind, value in job),
+                       key=str)
+        masses = [self.mass(label) for label, seconds, context in timings]
+        with_mass = [n for n, mass in enumerate(masses) if mass is not None]
+        if with_mass:
+            self.mean_mass = (sum(masses[n] for n in with_mass)
+                              / float(len(with_mass)))
+        spread = sum((masses[n] - self.mean_mass)**2 for n in with_mass)
+
+        effects = {}
+        # The slope term and the sum of the effects of each job
+        fitted = [0.0]*len(timings)
+        for iteration in range(self.iterations):
+            if spread > 0:
+                slope = sum((masses[n] - self.mean_mass)
+                            * (logs[n] - self.mean - fitted[n]
+                               + self.slope*(masses[n] - self.mean_mass))
+                            for n in with_mass)/spread
+                for n in with_mass:
+                    fitted[n] += (slope - self.slope)*(masses[n]
+                                                       - self.mean_mass)
+                self.slope = slope
+            for kind in kinds:
+                sums = {}
+                for n, job in enumerate(features):
+                    for feature in job:
+                        if feature[0] != kind:
+                            continue
+                        partial = (logs[n] - self.mean - fitted[n]
+                                   + effects.get(feature, 0.0))
+                        total, count = sums.get(feature, (0.0, 0))
+                        sums[feature] = (total + partial, count + 1)
+                new = dict((feature, total/count)
+                           for feature, (total, count) in sums.items())
+                for n, job in enumerate(features):
+                    for feature in job:
+                        if feature in new:
+                            fitted[n] += new[feature] - effects.get(feature,
+                                                                    0.0)
+                effects.update(new)
+        self.effects = effects
+
+        known = {}
+        for label, seconds, context in timings:
+            total, count = known.get(label, (0.0, 0))
+            known[label] = (total + seconds, count + 1)
+        self.known = dict((label, total/count)
+                          for label, (total, count) in known.items())
+
+    def predict(self, label, context=None):
+        """ The expected runtime of a job
+
+        Parameters: label: the label of the job
+                    context: the context of the campaign, see
+                             reader_context
+        Returns:    The runtime in seconds
+        """
+        if label in self.known:
+            return self.known[label]
+        if self.mean is None:
+            return self.default
+        log = self.mean + sum(self.effects.get(feature, 0.0)
+                              for feature in self.features(label, context))
+        mass = self.mass(label)
+        if mass is not None:
+            log += self.slope*(mass - self.mean_mass)
+        return math.exp(log)
+
+
+def format_duration(seconds):
+    """ Format a number of seconds as [D-]HH:MM:SS, as SLURM does """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    duration = "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+    if days:
+        duration = "{}-{}".format(days, duration)
+    return duration
+
+
+class Progress(object):
+    """ Throughput and expected time left of a running campaign
+
+    The work of a job is its predicted runtime, or 1 without timings, and
+    the time left is estimated from the fraction of the work done so far.
+    Jobs found in the ledger or the result cache are not run, so their
+    work is taken off the total. The counts are shared with the processes
+    of the pool.
+    """
+
+    def __init__(self, work, interval=60):
+        """ Parameters: work: the total work of the campaign
+                        interval: the minimum number of seconds between
+                                  reports
+        """
+        self.interval = interval
+        self.start = time.time()
+        self.work = multiprocessing.Value('d', work)
+        self.done = multiprocessing.Value('d', 0.0)
+        self.jobs = multiprocessing.Value('i', 0)
+        self.last_report = multiprocessing.Value('d', self.start)
+
+    def skip(self, work):
+        """ Take the work of a job which is not run off the total """
+        with self.work.get_lock():
+            self.work.value -= work
+
+    def finish(self, work):
+        """ Count a job which has been run """
+        with self.done.get_lock():
+            self.done.value += work
+        with self.jobs.get_lock():
+            self.jobs.value += 1
+
+    def throughput(self):
+        """ The number of jobs run per hour """
+        elapsed = time.time() - self.start
+        return 3600.0*self.jobs.value/elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """ The expected number of seconds left, or None if unknown """
+        if self.done.value <= 0 or self.work.value <= 0:
+            return None
+        fraction = min(1.0, self.done.value/self.work.value)
+        return (time.time() - self.start)*(1 - fraction)/fraction
+
+    def report(self, force=False):
+        """ Describe the progress, at most once per interval
+
+        Parameters: force: describe it even if the interval has not passed
+        Returns:    The description, or None
+        """
+        with self.last_report.get_lock():
+            now = time.time()
+            if not force and now - self.last_report.value < self.interval:
+                return None
+            self.last_report.value = now
+        eta = self.eta()
+        return "Progress: {} jobs run, {:.1f} jobs/hour, {} left".format(
+            self.jobs.value, self.throughput(),
+            "unknown time" if eta is None else format_duration(eta))
@@ -0,0 +1,387 @@
+"""
+This module contains the schedulers that hand the TALYS runs out to
+the workers, either processes on this machine or MPI ranks. The Manager
+only decides _what_ to run, the classes here decide _where_ and _when_
+it is run.
+"""
+
+from __future__ import print_function
+from collections import deque
+import heapq
+import multiprocessing
+import logging
+import time
+
+
+class WorkerPool(object):
+    """ A fixed pool of long-lived worker processes fed through a bounded queue
+
+    Every worker is forked once and then runs jobs until it receives the
+    stop sentinel. As soon as a worker finishes a job it takes the next one
+    from the queue, so no time is lost waiting for processes to be created
+    or reaped. The queue is bounded to keep the parent from running far
+    ahead of the workers.
+    """
+    # Put on the queue once for every worker to shut it down
+    STOP = None
+    # A worker waiting longer than this many seconds for a job is stalled
+    stall_time = 1.0
+
+    def __init__(self, target, processes, queue_size=None, logger=None,
+                 events=None, setup=None, teardown=None):
+        """ Create the pool. The workers are started on the first submit
+
+        Parameters: target: the function each worker calls with the
+                            arguments given to submit()
+                    processes: the number of workers
+                    queue_size: the maximum number of pending jobs.
+                                Defaults to twice the number of workers
+                    logger: where to log errors raised by the target
+                    events: the events.EventLog to report stalled
+                            workers to
+                    setup: function each worker calls before its first job
+                    teardown: function each worker calls after its last job
+        Returns:    None
+        Algorithm:  Store the parameters and create the bounded queue
+        """
+        self.target = target
+        self.processes = processes
+        self.queue_size = queue_size or 2*processes
+        self.logger = logger or logging.getLogger()
+        self.events = events
+        self.setup = setup
+        self.teardown = teardown
+        self.queue = multiprocessing.Queue(maxsize=self.queue_size)
+        self.workers = []
+        # The number of the worker, set in each worker process
+        self.index = None
+
+    def __enter__(self):
+        """ In order to be used with the with-statement """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Wait for the workers to finish when exiting """
+        self.close()
+
+    def start(self):
+        """ Fork the workers
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Start self.processes daemonic workers running self.work
+        """
+        for n in range(self.processes):
+            worker = multiprocessing.Process(target=self.work, args=(n,),
+                                             name="Worker-{}".format(n+1))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.logger.debug("Started %s workers", self.processes)
+
+    def submit(self, *args):
+        """ Put a job on the queue
+
+        Parameters: args: the arguments to pass to the target
+        Returns:    None
+        Algorithm:  Start the workers if this is the first job. Block until
+                    there is room in the queue
+        """
+        if not self.workers:
+            self.start()
+        self.queue.put(args)
+
+    def work(self, index=0):
+        """ The main loop of each worker
+
+        Parameters: index: the number of the worker, from 0
+        Returns:    None
+        Algorithm:  Get jobs from the queue and run them until the stop
+                    sentinel is received. An exception in one job is logged
+                    and does not bring the worker down. A long wait for a
+                    job means the parent does not keep up with the workers,
+                    and is reported as a scheduler_stall event
+        """
+        self.index = index
+        if self.setup is not None:
+            self.setup()
+        while True:
+            start = time.time()
+            args = self.queue.get()
+            if args is self.STOP:
+                break
+            waited = time.time() - start
+            if self.events is not None and waited > self.stall_time:
+                self.events.emit("scheduler_stall", seconds=waited)
+            try:
+                self.target(*args)
+            except Exception:
+                self.logger.exception("An error occured in %s",
+                                      multiprocessing.current_process().name)
+        if self.teardown is not None:
+            self.teardown()
+
+    def close(self):
+        """ Stop the workers after all submitted jobs have been run
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Put one stop sentinel per worker on the queue and join
+                    the workers
+        """
+        for worker in self.workers:
+            self.queue.put(self.STOP)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+class Dispatcher(object):
+    """ Hands out batches of jobs to MPI ranks on request
+
+    The ranks ask for work when they are about to run out, so the next batch
+    arrives while they are still running the last job of the previous one.
+    The size of a batch is chosen from the observed runtime of the jobs, such
+    that a batch takes about target_time seconds, but it is kept small
+    enough to spread the remaining jobs over every rank.
+
+    Messages from the ranks are (kind, rank, results, message) where kind is
+      "ready":  the rank wants more work. message is the seconds it waited
+                for its last batch, or None
+      "done":   the rank received "stop" and has finished
+      "failed": the rank can not continue. message tells why
+    and results is a list of (number, usage, errors) of the finished jobs,
+    where usage is the resource usage of the job, see accounting.usage_of.
+    The ranks are sent ("work", batch) or ("stop", None), where batch is a
+    list of (number, job). Every job handed out is given a new number, so
+    jobs with the same key are told apart.
+    """
+    # A rank waiting longer than this many seconds for a batch is stalled
+    stall_time = WorkerPool.stall_time
+
+    def __init__(self, comm, size, finish, target_time=30, max_batch=256,
+                 logger=None, events=None, start=None):
+        """ Parameters: comm: the MPI communicator
+                        size: the number of ranks, including this one
+                        finish: function called with the rank, job, key,
+                                usage and errors of every finished job
+                        target_time: the desired duration of a batch in
+                                     seconds
+                        max_batch: the maximum number of jobs in a batch
+                        logger: where to log
+                        events: the events.EventLog to report stalled
+                                ranks to
+                        start: function called with the rank, job and key
+                               of every job sent to a rank
+        """
+        self.comm = comm
+        self.finish = finish
+        self.start = start
+        self.events = events
+        self.target_time = target_time
+        self.max_batch = max_batch
+        self.logger = logger or logging.getLogger()
+        # The total number of jobs, if known
+        self.total = None
+        self.dispatched = 0
+        # The number of the last job handed out
+        self.number = 0
+        # Jobs waiting to be handed out
+        self.buffer = deque()
+        # The jobs handed out to each rank that are not finished yet, by
+        # their number
+        self.assigned = dict((rank, {}) for rank in range(1, size))
+        # The ranks that have not stopped
+        self.active = set(range(1, size))
+        # The jobs submitted after every rank had failed
+        self.unrun = 0
+        # Moving average of the runtime of a job
+        self.mean_runtime = None
+
+    def __enter__(self):
+        """ In order to be used with the with-statement """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Stop the ranks when exiting """
+        self.close()
+
+    def batch_size(self):
+        """ The number of jobs to send in the next batch
+
+        Parameters: None
+        Returns:    The batch size
+        Algorithm:  Start with single jobs until a runtime is known. Then
+                    aim for target_time per batch, but never more than half
+                    of a fair share of the remaining jobs
+        """
+        if self.mean_runtime is None:
+            return 1
+        size = int(self.target_time/max(self.mean_runtime, 1e-3))
+        if self.total is not None and self.active:
+            fair_share = (self.total - self.dispatched)//(2*len(self.active))
+            size = min(size, fair_share)
+        return max(1, min(size, self.max_batch))
+
+    def submit(self, *item):
+        """ Queue a job
+
+        Parameters: item: the job and its arguments, sent as a tuple
+        Returns:    None
+        Algorithm:  Buffer the job. When a full batch is buffered, wait for
+                    a rank to ask for it. Once every rank has failed, no rank
+                    will ask, so the job is only counted as not run
+        """
+        if not self.active:
+            self.unrun += 1
+            return
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size():
+            self.serve()
+
+    def serve(self):
+        """ Handle one message from a rank
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Process the reported results. Give a ready rank the next
+                    batch, or tell it to stop if there is no more work.
+                    The unfinished jobs of a failed rank are put back. A
+                    rank which waited long for its last batch was not fed
+                    fast enough, and is reported as a scheduler_stall event
+        """
+        kind, rank, results, message = self.comm.recv()
+        if (kind == "ready" and message is not None
+                and self.events is not None and message > self.stall_time):
+            self.events.emit("scheduler_stall", seconds=message, rank=rank)
+        for number, usage, errors in results:
+            item = self.assigned[rank].pop(number)
+            job, key = item[0], item[1]
+            if usage is not None:
+                elapsed = usage["wall"]
+                if self.mean_runtime is None:
+                    self.mean_runtime = elapsed
+                else:
+                    self.mean_runtime = 0.9*self.mean_runtime + 0.1*elapsed
+            self.finish(rank, job, key, usage, errors)
+
+        if kind == "failed":
+            self.logger.error("Rank %s failed: %s", rank, message)
+            self.active.discard(rank)
+            lost = list(self.assigned[rank].values())
+            self.assigned[rank].clear()
+            self.dispatched -= len(lost)
+            self.buffer.extendleft(reversed(lost))
+        elif kind == "done":
+            self.active.discard(rank)
+        elif self.buffer:
+            batch = []
+            for n in range(min(self.batch_size(), len(self.buffer))):
+                self.number += 1
+                item = self.buffer.popleft()
+                self.assigned[rank][self.number] = item
+                batch.append((self.number, item))
+                if self.start is not None:
+                    self.start(rank, *item[:2])
+            self.dispatched += len(batch)
+            self.logger.debug("Sending %s jobs to %s", len(batch), rank)
+            self.comm.send(("work", batch), dest=rank)
+        else:
+            self.comm.send(("stop", None), dest=rank)
+
+    def close(self):
+        """ Hand out the remaining jobs and stop the ranks
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Serve the ranks until every rank has stopped
+        """
+        while self.active:
+            self.serve()
+        if self.buffer or self.unrun:
+            self.logger.error("%s jobs were not run as every rank failed",
+                              len(self.buffer) + self.unrun)
+            self.buffer.clear()
+            self.unrun = 0
+
+
+def serve_dispatcher(comm, rank, run):
+    """ The main loop of an MPI rank fed by a Dispatcher
+
+    Parameters: comm: the MPI communicator
+                rank: the rank of this process
+                run: function running a job. It is called with the items of
+                     each job and returns the resource usage, a dict with
+                     at least the wall time, or None if the job was not
+                     run, and a list of errors
+    Returns:    None
+    Algorithm:  Ask for work, and ask for the next batch when starting the
+                last job of the current one. The results, and the seconds
+                spent waiting for the last batch, are reported with each
+                request. An exception in a job is reported as
+                an error of the job, while an exception in the loop itself
+                is reported as a failure of the rank
+    """
+    results = []
+    queue = deque()
+    requested = False
+    waited = None
+    try:
+        while True:
+            if not queue:
+                if not requested:
+                    comm.send(("ready", rank, results, waited), dest=0)
+                    results = []
+                start = time.time()
+                kind, batch = comm.recv(source=0)
+                waited = time.time() - start
+                requested = False
+                if kind == "stop":
+                    break
+                queue.extend(batch)
+            number, item = queue.popleft()
+            if not queue:
+                # Prefetch the next batch while running this job
+                comm.send(("ready", rank, results, waited), dest=0)
+                results = []
+                waited = None
+                requested = True
+            try:
+                usage, errors = run(*item)
+            except Exception as exc:
+                usage, errors = None, ["{}: {}".format(
+                    exc.__class__.__name__, exc)]
+            results.append((number, usage, errors))
+    except Exception as exc:
+        comm.send(("failed", rank, results, str(exc)), dest=0)
+        return
+    comm.send(("done", rank, results, None), dest=0)
+
+
+def longest_first(jobs, predict):
+    """ Order jobs by their expected runtime, the longest first
+
+    Starting the longest jobs first keeps a long job from being started
+    last, when every other worker is idle waiting for it to finish.
+    Parameters: jobs: iterable of jobs
+                predict: function giving the expected runtime of a job
+    Returns:    A list of the jobs. Jobs with the same expected runtime
+                keep their order
+    """
+    return sorted(jobs, key=predict, reverse=True)
+
+
+def makespan(runtimes, workers):
+    """ Replay a run of jobs on a number of workers
+
+    Parameters: runtimes: the runtime of each job, in the order the jobs
+                          are handed out
+                workers: the number of workers
+    Returns:    The time until the last job has finished
+    Algorithm:  Every job is given to the worker which is free first
+    """
+    free = [0.0]*workers
+    heapq.heapify(free)
+    for runtime in runtimes:
+        heapq.heappush(free, heapq.heappop(free) + runtime)
+    return max(free) if free else 0.0
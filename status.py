@@ -0,0 +1,230 @@
+"""
+This module contains the live metrics of a running campaign. The Manager
+counts the jobs as they are submitted, started and finished, and with
+--status the metrics are written to status.json in the campaign root every
+few seconds, and with --status-port also served over HTTP on localhost:
+    curl localhost:8080
+The status has the number of jobs queued, running, done and failed, the
+jobs skipped as completed or served from the result cache, the throughput, the mean and 95th percentile runtime, and how busy each worker
+or MPI rank has been, so starved ranks and a stalled dispatcher show up
+without logging into the node.
+"""
+
+from __future__ import print_function
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+try:  # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+def increment(value, amount=1):
+    """ Add to a shared multiprocessing.Value """
+    with value.get_lock():
+        value.value += amount
+
+
+class Metrics(object):
+    """ Counts of the jobs of a campaign, shared with the worker processes
+
+    The runtimes are kept in a histogram with four buckets per doubling,
+    from one second to a week, so the percentiles are accurate to about 20%.
+    """
+    # Bucket n holds the runtimes up to 2**(n/4) seconds
+    buckets = 80
+
+    def __init__(self, workers):
+        """ Parameters: workers: the number of workers or MPI ranks
+                                 running TALYS
+        """
+        self.start = time.time()
+        self.workers = workers
+        self.submitted = multiprocessing.Value('i', 0)
+        self.started = multiprocessing.Value('i', 0)
+        self.done = multiprocessing.Value('i', 0)
+        self.failed = multiprocessing.Value('i', 0)
+        # The jobs in the ledger and the jobs served from the result cache.
+        # They are never run, but count towards the total
+        self.skipped = multiprocessing.Value('i', 0)
+        self.cached = multiprocessing.Value('i', 0)
+        self.runtime = multiprocessing.Value('d', 0.0)
+        self.histogram = multiprocessing.Array('i', self.buckets)
+        # The seconds spent running TALYS, the number of jobs run and the
+        # time of the last finished job of each worker
+        self.busy = multiprocessing.Array('d', workers)
+        self.worker_jobs = multiprocessing.Array('i', workers)
+        self.last_seen = multiprocessing.Array('d', workers)
+
+    def submit(self):
+        """ Count a job handed to the workers """
+        increment(self.submitted)
+
+    def start_job(self):
+        """ Count a job started by a worker of this machine """
+        increment(self.started)
+
+    def skip_job(self, cached=False):
+        """ Count a job that is not run, as it is completed or cached """
+        increment(self.cached if cached else self.skipped)
+
+    def finish_job(self, wall, failed=False, worker=None):
+        """ Count a finished job
+
+        Parameters: wall: the runtime of the job in seconds
+                    failed: True if the job failed
+                    worker: the index of the worker, or None if unknown
+        Returns:    None
+        """
+        increment(self.failed if failed else self.done)
+        increment(self.runtime, wall)
+        bucket = 0
+        if wall > 1:
+            bucket = min(self.buckets - 1, int(math.ceil(4*math.log(wall, 2))))
+        with self.histogram.get_lock():
+            self.histogram[bucket] += 1
+        if worker is not None:
+            with self.busy.get_lock():
+                self.busy[worker] += wall
+                self.worker_jobs[worker] += 1
+                self.last_seen[worker] = time.time()
+
+    def percentile(self, fraction):
+        """ The runtime below which the given fraction of jobs finished,
+        as the upper bound of its bucket, or None before any job """
+        counts = self.histogram[:]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= fraction*total:
+                return 2**(bucket/4.0)
+
+    def snapshot(self, queued=None, running=None):
+        """ The metrics as a dict
+
+        Parameters: queued, running: the number of jobs waiting and
+                    running, if known better than from the counts of
+                    this machine, as for MPI
+        Returns:    The dict, see the module docstring
+        """
+        now = time.time()
+        elapsed = max(now - self.start, 1e-9)
+        finished = self.done.value + self.failed.value
+        if queued is None:
+            queued = self.submitted.value - self.started.value
+        if running is None:
+            running = self.started.value - finished
+        workers = []
+        for n in range(self.workers):
+            last_seen = self.last_seen[n]
+            workers.append({
+                "worker": n,
+                "jobs": self.worker_jobs[n],
+                "utilization": self.busy[n]/elapsed,
+                "since_last_job": now - (last_seen or self.start)})
+        return {"time": now,
+                "elapsed": elapsed,
+                "queued": queued,
+                "running": running,
+                "done": self.done.value,
+                "failed": self.failed.value,
+                "skipped": self.skipped.value,
+                "cached": self.cached.value,
+                "jobs_per_minute": 60*finished/elapsed,
+                "mean_runtime": (self.runtime.value/finished
+                                 if finished else None),
+                "p95_runtime": self.percentile(0.95),
+                "utilization": self.runtime.value/(self.workers*elapsed),
+                "workers": workers}
+
+
+class StatusWriter(object):
+    """ Rewrites the status file periodically and serves it over HTTP
+
+    Runs in threads of the main process. The status is taken from a
+    function returning a dict, see Metrics.snapshot
+    """
+
+    def __init__(self, status, path, interval=30, port=None):
+        """ Parameters: status: function returning the status as a dict
+                        path: the status file, replaced atomically
+                        interval: the seconds between rewrites
+                        port: the port on localhost to serve the status
+                              on, or None
+        """
+        self.status = status
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.stopped = threading.Event()
+        self.thread = None
+        self.server = None
+        # The done count and time of the last rewrite, for the recent rate
+        self.last = None
+
+    def current(self):
+        """ The status, with the throughput since the last rewrite """
+        status = self.status()
+        finished = status["done"] + status["failed"]
+        if self.last is not None and status["time"] > self.last[1]:
+            status["recent_jobs_per_minute"] = (
+                60*(finished - self.last[0])/(status["time"] - self.last[1]))
+        return status, finished
+
+    def write(self):
+        """ Replace the status file """
+        status, finished = self.current()
+        self.last = (finished, status["time"])
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as outfile:
+            json.dump(status, outfile, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def start(self):
+        """ Start rewriting the status file and serving it """
+        self.thread = threading.Thread(target=self.run, name="StatusWriter")
+        self.thread.daemon = True
+        self.thread.start()
+        if self.port is not None:
+            writer = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = json.dumps(writer.current()[0], indent=1,
+                                      sort_keys=True).encode("utf8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = HTTPServer(("127.0.0.1", self.port), Handler)
+            server = threading.Thread(target=self.server.serve_forever,
+                                      name="StatusServer")
+            server.daemon = True
+            server.start()
+
+    def run(self):
+        """ Rewrite the status file until stopped """
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        """ Write the final status and stop the threads """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.write()
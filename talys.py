@@ -16,12 +16,38 @@ The script is split into logical parts:
   Extending these should be fairly simple, see readers.py for more details.
 - tools.py contain miscellaneous functions moved from this file to reduce
   clutter
+- scheduler.py contains the pool of workers used for multiprocessing. The
+  workers are forked once and fed the TALYS runs through a bounded queue.
+  It also contains the dispatcher handing batches of jobs to the MPI ranks
+- engine.py contains an alternative to the pool of workers, running every
+  TALYS from a single asyncio event loop (--async, Python 3 only)
+- archive.py contains the packed result archive used by --archive, holding
+  the result files of every job of an isotope in one indexed file
+- runtime.py contains the model predicting the runtime of a job from the
+  timings of earlier campaigns, used to start the longest jobs first, to
+  estimate the time left of a campaign and to size it with --plan-only
+- events.py contains the event log written by --events, one line of JSON
+  for every start, end and failure of a job
+- status.py contains the live metrics of a campaign, written to status.json
+  and served over HTTP with --status
+- profiling.py contains the profiler of --profile, timing the stages of the
+  jobs and profiling the processes with cProfile and tracemalloc
+- accounting.py measures the CPU time, memory and I/O of every TALYS run
+  and keeps them in the run log of the campaign, runs.jsonl
+- arrayjobs.py contains the index of the jobs written by --dummy and
+  --slurm, which the tasks of an array job read with "talys.py worker", and
+  the batch script of the array job submitted by --slurm
+- harvest.py contains the harvester run by "talys.py harvest", which
+  incrementally parses the results of a campaign into a dataset
+- jobs.py contains the job plan. It enumerates the parameter space given in
+  the input file as a stream of small job descriptors, without creating
+  anything on disk
 - This file mainly contains the class Manager which does the largest portion of
   the work. Each of the Manager's methods should ideally only do _one_ task,
   although this is not always feasible. The actual running is done by
-  Manager.run(), which in begins a chain of functions. The first functions
-  simply iterate through the directory structure and creates the directories,
-  while the final functions set up in TALYS input files and multiprocessing.
+  Manager.run(), which consumes the job plan. For each job, the directories
+  and the TALYS input file are created before the job is handed to MPI,
+  multiprocessing or run directly.
 
 Use of MPI
 MPI is supported, but some cautious remarks must be made. Since fork() is
@@ -36,11 +62,13 @@ mpirun -nooversubscribe -np 50 python talys.py
 However, fork() can not be used on a cluster using InfiBand. If you get
 segfaults while running talys, this is probably the reason. A solution to this
 is to use the option --dummy which only creates the directory structure and
-inputfiles. In addition, it creates an "indices" directory containing
-enumerated files pointing to the work directory and result directory of each
-input file. By using array jobs on a cluster, one can iterate through the
-enumerated files and run talys. The files "arrayscript" and "workerscript" show
-an example of this.
+inputfiles. In addition, it writes the index "indices.idx" of the work
+directory and result directory of each input file. By using array jobs on a
+cluster, each task looks up its jobs with "python talys.py worker --task-id N"
+and runs talys. The files "arrayscript" and "workerscript" show an example of
+this, and arrayjobs.py describes the index. Simpler still, --slurm creates
+the jobs and submits them as an array job itself, packing the tasks with the
+jobs predicted to fit in --task-time.
 
 TODO: Add failsafe for multiprocessing. Very technically challenging
 TODO: Maybe look into os.sched_* for controlling cpu affinity
@@ -54,19 +82,32 @@ Imports
 from __future__ import print_function    # Turns print into print()
 import numpy as np                       # Linspace
 import time                              # Time and date
-from itertools import product            # Nested for-loops
 import sys                               # Functions to access system functions
 import os                                # Functions to access IO of the OS
 import shutil                            # High-level file manegement
 import platform                          # Information about the platform
 import multiprocessing                   # Multiprocessing
 import logging                           # Logging progress from the processes
-import copy                              # For deepcopy
 import traceback                         # To log tracebacks
 import json                              # Write json to the information file
-import subprocess                        # More flexible os.system
+import pickle                            # Save the setup for the array jobs
+import subprocess                        # Submit the array jobs
 from tools import *                      # Functions are put there to remove clutter
 from readers import *                    # The input readers
+from scheduler import (WorkerPool, Dispatcher, serve_dispatcher,
+                       longest_first, makespan)
+from jobs import JobPlan, InputRenderer  # Enumerates and renders the jobs
+from ledger import Ledger, job_key       # The completed jobs
+from cache import ResultCache            # Results shared between campaigns
+from archive import ResultArchive        # Packed result files
+from arrayjobs import (IndexWriter, write_batch_script,
+                       main as worker_main)  # The jobs of array jobs
+from accounting import RunLog, run_process, run_error  # Resources used by each run
+from measure import format_elapsed           # The execution time in the log
+from status import Metrics, StatusWriter     # Live metrics of the campaign
+from profiling import Profiler               # --profile
+from runtime import (RuntimeModel, Progress, reader_context,
+                     format_duration)         # Expected runtime of the jobs
 import re                                # Match file patterns
 
 """
@@ -99,94 +140,6 @@ Z_nr = {'H':  '001', 'He': '002', 'Li': '003', 'Be': '004', 'B':  '005',
         'Rg': '111', 'Cn': '112', 'Uut': '113', 'Fl': '114', 'Uup': '115',
         'Lv': '116', 'Uus': '117', 'Uuo': '118'}
 
-"""
-###############################################################################
-Functions
-###############################################################################
-"""
-
-
-def support_multiprocessing(check_list=False):
-    """ A decorator running functions with multiprocessing
-
-    Parameters: check_list: Boolean variable indicating if the given function
-                contains a keyword "name". If it does, the keyword "name"
-                will be compared with entires in args.multi_list. If
-                there is a match, multiprocessing will be used, if not
-                the function will be called as normal;
-    Returns:    Next level decorator.
-    Algorithm:  Create a standard decorator and return it
-    Note:       The target function must put the terminating child's PID
-                on self.queue.
-    """
-    def decorator(func):
-        def inner(*args, **kwargs):
-            """ Lowest level of the decorator
-            Parameters: args: The args to the function to be called
-                        kwargs: The kwargs to the function to be called
-            Algorithm:  If check_list is True, check if the keyword "name
-                        is in args.multi_list. If it is, use multiprocessing.
-                        If check_list is False, use multiprocessing.
-                        Check if the number of active children is under
-                        the limit set by --processes. If it is, increment
-                        the running_children counter. This is done first to
-                        make it less likely that the number of processes
-                        exeeds the limit. Run the function and store the
-                        PID in a multiprocessing.Manager
-                        If the limit is reached, wait at the
-                        multiprocessing.Queue for a PID. This PID is then
-                        removed from the list over running children and the
-                        counter is decremented":"""
-            if check_list:
-                if kwargs["name"] in args[0].multi_list:
-                    do_run = True
-                else:
-                    do_run = False
-            else:
-                do_run = True
-            if args[0].use_multiprocessing and do_run:
-                # Only pause if the limit set by --processes is reached
-                if args[0].running_children.value >= args[0].args.processes:
-                    try:
-                        args[0].logger.debug("Waiting for available process")
-                    except:
-                        pass
-                    pid = args[0].queue.get()
-                    # Wait a second to let the process be terminated
-                    time.sleep(1)
-                    for process in args[0].mps_list:
-                        if process == pid:
-                            # If it did not terminate, wait till it does
-                            #process.join()
-                            try:
-                                args[0].logger.debug("Removing %s from list", pid)
-                            except:
-                                pass
-                            # Finally, remove it
-                            args[0].mps_list.remove(process)
-                            args[0].running_children.value -= 1
-                            break
-                    if args[0].running_children.value >= args[0].args.processes:
-                        try:
-                            args[0].logger.exception("PID not in list")
-                        except:
-                            pass
-                        finally:
-                            raise RuntimeError("PID not in list")
-                args[0].running_children.value += 1
-                job = multiprocessing.Process(
-                    target=func,
-                    args=args, kwargs=kwargs)
-                # Keep a reference to shut them down
-                # Start it
-                job.start()
-                args[0].mps_list.append(job.pid)
-            else:
-                func(*args, **kwargs)
-
-        return inner
-    return decorator
-
 """
 ###############################################################################
 Classes
@@ -196,6 +149,12 @@ Classes
 
 class Manager:
     """ Creates the directories, manages logging and runs talys """
+    # The stages of a job timed by --profile, see install_profiler
+    profile_stages = ("run_job", "keywords", "render_input_file",
+                      "make_input_file", "submit", "run_talys",
+                      "talys_command", "talys", "finish_talys", "collect_run",
+                      "find_result_files", "ledger")
+
     def __init__(self, options, args):
         """ Runs when an instance of Manager is created
 
@@ -212,6 +171,10 @@ class Manager:
         # Check the size given by MPI.COMM to determine if the
         # script is being run by MPI
         self.use_MPI = size > 1
+        # The async engine runs several TALYS at once, and by default
+        # as many as there are cores
+        if args.use_async and args.processes is None:
+            args.processes = 0
         # Set a multiprocessing flag if running several processes
         if args.processes == 0:
             try:
@@ -228,108 +191,190 @@ class Manager:
         if self.use_MPI and self.use_multiprocessing:
             print("Multiprocessing can not be used with MPI")
             comm.Abort()
+        # The jobs are run by SLURM array jobs with --slurm
+        self.use_slurm = args.slurm is not None
+        if self.use_slurm and (self.use_MPI or self.use_multiprocessing
+                               or args.dummy):
+            sys.exit("--slurm can not be used with MPI, --processes or "
+                     "--dummy")
         # The number of MPI nodes
         self.mpisize = size
         # Counter to store the total number of TALYS-executions
         self.counter_max = 0
-        # Keeps the queues for multiprocessing
-        self.queue = multiprocessing.Queue()
-        # Counter showing how many child processing are running around
-        self.running_children = multiprocessing.Value('i', 0)
-        # List containing references to all running children
-        self.mps_list = multiprocessing.Manager().list()
-        # Names for where multiprocessing will be run
-        self.multi_list = args.multi
         # Shared memory resource for keeping track of how many
         # TALYS-executions has been done
         self.counter = multiprocessing.Value('i', 0)
-        # Keeps track of the number of running MPI ranks
-        self.used_ranks = 1
-        # The current MPI rank to send to
-        self.send_to_rank = 1
 
+        # The index of the jobs for array jobs, see arrayjobs.py
+        self.task_index = None
         if self.args.dummy:
-            self.indices_directory = "indices"
-            self.index_counter = 1
-            mkdir(self.indices_directory)
+            self.task_index = IndexWriter("indices.idx", self.args.chunk or 1)
 
-        # Create the root directory named by the current date and time
-        self.root_directory = 'TALYS-calculations-{}-{}'.format(
-            time.strftime('%y%m%d'), time.strftime('%H%M%S'))
-        mkdir(self.root_directory)
+        # Continue in the directory of the previous run when resuming.
+        # Otherwise, create the root directory named by the current
+        # date and time
+        self.root_directory = self.get_checkpoint() if args.resume else None
+        if self.root_directory is None:
+            self.root_directory = 'TALYS-calculations-{}-{}'.format(
+                time.strftime('%y%m%d'), time.strftime('%H%M%S'))
+            mkdir(self.root_directory)
 
         # Initialize and start the logging
         self.init_logger()
 
+        # The expected runtime of the jobs, learned from earlier campaigns
+        self.runtime_model = None
+        if self.args.timings:
+            self.runtime_model = RuntimeModel.from_files(self.args.timings)
+            self.logger.info("Fitted the runtime model to %s timings",
+                             len(self.runtime_model))
+
+        # The index and batch script of the array job, see submit_array.
+        # Without timings every job would be predicted to take
+        # RuntimeModel.default, so the tasks are only packed by --task-time
+        # with a fitted model
+        if self.use_slurm:
+            directory = os.path.join(self.root_directory, "slurm")
+            mkdir(os.path.join(directory, "logs"))
+            task_time = None
+            if not self.args.chunk and self.has_timings():
+                task_time = self.args.task_time
+            elif not self.args.chunk:
+                self.logger.warning("Without timings from --timings, --slurm "
+                                    "runs one job per array task, each "
+                                    "given --task-time. Give --timings or "
+                                    "--chunk")
+            self.task_index = IndexWriter(
+                os.path.join(directory, "indices.idx"),
+                self.args.chunk or 1, task_time)
+
+        # The jobs that are already completed
+        self.ledger = Ledger(self.root_directory)
+        # The resources used by every TALYS run
+        self.run_log = RunLog(self.root_directory)
+        # The machine-readable record of the jobs, see events.py
+        self.events = None
+        if self.args.events is not None:
+            from events import EventLog
+            self.events = EventLog(os.path.join(self.root_directory,
+                                                self.args.events))
+        if self.args.resume:
+            if len(self.ledger):
+                self.logger.info("Resuming %s with %s completed jobs",
+                                 self.root_directory, len(self.ledger))
+            else:
+                self.logger.warning("Could not resume. Running as normal")
+
+        # Time the stages of the jobs. Done before the pool is created, as
+        # the pool holds on to the methods it calls
+        self.profiler = None
+        if self.args.profile is not None:
+            self.install_profiler()
+
+        # The workers running TALYS when using multiprocessing. They are
+        # forked when the first job is submitted. The async engine runs
+        # every TALYS from one event loop instead
+        if self.use_multiprocessing and self.args.use_async:
+            from engine import AsyncEngine
+            self.pool = AsyncEngine(self.talys_command, self.finish_talys,
+                                    self.args.processes, logger=self.logger)
+        elif self.use_multiprocessing:
+            setup = teardown = None
+            if self.profiler is not None:
+                setup = self.profiler.start_worker
+                teardown = self.profiler.stop_worker
+            self.pool = WorkerPool(self.run_talys, self.args.processes,
+                                   logger=self.logger, events=self.events,
+                                   setup=setup, teardown=teardown)
+        # The MPI ranks ask for batches of jobs when they need more work
+        if self.use_MPI:
+            self.pool = Dispatcher(comm, self.mpisize, self.finish_remote,
+                                   target_time=self.args.batch_time,
+                                   logger=self.logger, events=self.events,
+                                   start=self.start_remote)
+        if self.args.multi:
+            self.logger.warning("--multi is ignored. Every TALYS run is "
+                                "handed to the worker pool")
+
+        # The results of previous runs, possibly from other campaigns
+        if self.args.cache is not None:
+            self.cache = ResultCache(self.args.cache,
+                                     self.args.cache_size*1024**2)
+        else:
+            self.cache = None
+
+        # Append the result files to one archive per isotope
+        self.use_archive = self.args.archive
+
+        # How the jobs get the energy file, see share_energy_file
+        self.energy_sharing = self.args.energy_file
+
+        # TALYS is run in this node-local directory if set
+        self.scratch = None
+        if self.args.scratch is not None:
+            self.scratch = node_directory(self.args.scratch)
+
         # sys.excepthook is what deals with an unhandled exception
         if not self.args.default_excepthook:
             sys.excepthook = self.excepthook
 
-        # send the input options to the mpichildren
-        for n in range(1, self.mpisize):
-            self.logger.debug("Sending reader to %s", n)
-            comm.send(self.reader, dest=n, tag=1)
-
-        self.get_checkpoint()
-
     def __enter__(self):
         """ In order to be used with the with-statement """
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        """ Shut down the children when exiting """
-        for rank in range(1, self.mpisize):
-            self.logger.debug("Sending stop to %s", rank)
-            comm.send(("stop",)*5, dest=rank)
-
-    def count(self, values):
-        """ Find the total number of TALYS runs
+        """ Shut down the children when exiting
 
-        Parameters: values: a list over the keywords
-        Returns:    None
-        Algorithm:  Iterates through the elements, masses and product, each
-                    time increasing the self.counter_max
+        The dispatcher stops the ranks when the run is completed. If it
+        was interrupted, the ranks can not be told apart from the ones
+        waiting for work, so every rank is aborted
         """
-        elements = self.reader["element"]
-        masses = self.reader["mass"]
-        for e in elements:
-            for m in masses[e]:
-                for p in product(*values):
-                    self.counter_max += 1
+        if self.use_MPI and exc_type is not None:
+            comm.Abort()
 
-    def make_checkpoint(self, msg):
-        """ Overwrite the checkpoint file with a new checkpoint
+    def install_profiler(self):
+        """ Time the stages of the jobs for --profile, see profiling.py
 
         Parameters: None
         Returns:    None
-        Algorithm:  Open checkpointfile and write {Element} {Mass}
+        Algorithm:  Replace the methods of the stages on this instance by
+                    timed wrappers. TALYS itself is timed by the usage
+                    given to finish_talys. The plan and the pool do not
+                    exist yet, and are wrapped in _run
         """
-        with open(os.path.join(self.root_directory, "checkpoint"), "w") as chkfile:
-            chkfile.write(msg)
+        self.profiler = Profiler(
+            os.path.join(self.root_directory, "profile"), self.profile_stages,
+            workers=self.args.profile == "workers")
+        timers = self.profiler.timers
+        for name in ("run_job", "render_input_file", "make_input_file",
+                     "run_talys", "talys_command", "finish_talys",
+                     "collect_run", "find_result_files"):
+            setattr(self, name, timers.wrap(name, getattr(self, name)))
+        self.ledger.record = timers.wrap("ledger", self.ledger.record)
+
+        finish_talys = self.finish_talys
+
+        def count_talys(job, key, stderr, usage):
+            timers.add("talys", usage["wall"])
+            return finish_talys(job, key, stderr, usage)
+        self.finish_talys = count_talys
 
     def get_checkpoint(self):
-        """ Get the checkpoint of a previous run
+        """ Find the root directory of the run to resume
 
         Parameters: None
-        Returns:    None
-        Algorithm:  Check if --resume is set. If it is, find previous
-                    TALYS-folders and use the checkpoint in the penultimate
-                    (the ultimate is created by this process)
+        Returns:    The name of the directory, or None if there is none
+        Algorithm:  The directories are named by date and time, so the
+                    latest is the last in sorted order. Pick the latest
+                    directory with a ledger
         """
-        if self.args.resume:
-            folders = [os.path.abspath(name) for name in os.listdir(".") if
-                       os.path.isdir(name) and "TALYS" in name]
-            if len(folders) > 1:
-                names = [name for name in os.listdir(folders[-2])]
-                if "checkpoint" in names:
-                    with open(os.path.join(folders[-2], "checkpoint"), "r") as checkpointfile:
-                        self.checkpoint_list = checkpointfile.readline().split(" ")
-                        self.logger.debug("Checkpoint is %s-%s", *self.checkpoint_list)
-                    return
-
-            self.logger.warning("Could not resume. Running as normal")
-            self.args.resume = False
-
+        folders = sorted(name for name in os.listdir(".") if
+                         os.path.isdir(name) and
+                         name.startswith("TALYS-calculations-"))
+        for folder in reversed(folders):
+            if os.path.exists(os.path.join(folder, Ledger.filename)):
+                return folder
+        return None
 
     def init_logger(self):
         """ Set up logging
@@ -452,9 +497,10 @@ class Manager:
             "Platform:", padding_size, platform.platform()))
         outfile.write('\n{:<{}s} {}'.format(
             "Python version:", padding_size, platform.python_version()))
+        self.talys_path = find_talys(self.args.talys_path, local=self.use_MPI)
+        self.talys_version = talys_version(self.talys_path)
         outfile.write('\n{:<{}s} {}'.format(
-            "Talys version:", padding_size, talys_version(True if self.use_MPI
-                                                          else False)))
+            "Talys version:", padding_size, self.talys_version))
 
         # Write energy information
         outfile.write('\n\n{:<{}s} {}'.format(
@@ -490,7 +536,7 @@ class Manager:
             outfile.write('\n\nEnergies: \n')
             energies = np.linspace(float(self.reader['energy_start']),
                                    float(self.reader['energy_stop']),
-                                   float(self.reader['N']))
+                                   int(self.reader['N']))
             # Outfile named energy_file
             outfile_energy = open(os.path.join(self.root_directory, self.reader['energy'][0]), 'w')
             # Write energies to energy_file and file in one column
@@ -505,56 +551,72 @@ class Manager:
 
         outfile.close()
 
-    def make_input_file(self, keywords):
-        """ Creates the inputfile for TALYS
+    def render_input_file(self, keywords):
+        """ Renders the inputfile for TALYS
 
         Parameters: keywords: the input options
-        Returns:    None
+        Returns:    The content of the input file as a string
         Alogrithm:  Write a few lines of comment to explain the reaction and
-                    write all of the TALYS keywords given in the input
+                    write all of the TALYS keywords given in the input.
+                    See jobs.InputRenderer
         """
-        keywords = copy.deepcopy(keywords)
-
-        # Pop out the keywords that shouldn't be written twice
-        projectile = keywords.pop('projectile')
-        mass = keywords.pop('mass')
-        element = keywords.pop("element")
-        energy = keywords.pop('energy')
-
-        # Open the file and begin writing
-        outfile_input = open(os.path.join(
-            self.rest_directory,
-            self.reader["input_file"]), 'w')
-        # This shows the reaction taking place, e.g 159Eu(n,g)160Eu
-        reaction_line = '{}{}({},g){}{}'.format(mass, element, projectile,
-                                                int(mass)+1, element)
-        outfile_input.write('########################## \n')
-        outfile_input.write('##   TALYS input file   ## \n')
-        outfile_input.write('##{:^{}}## \n'.format(reaction_line, 22))
-        outfile_input.write('########################## \n \n')
-        outfile_input.write('# All keywords are explained in README. \n \n')
-
-        outfile_input.write('element {} \n'.format(element))
-        outfile_input.write('projectile {} \n'.format(projectile))
-        outfile_input.write('mass {} \n'.format(mass))
-        if not self.astro_yes:
-            outfile_input.write('energy {} \n \n'.format(energy))
-        else:
-            outfile_input.write('energy 1\n')
-
-        # Write the keyword and corresponding value
-        for key, value in keywords.items():
-            outfile_input.write('{} {} \n'.format(key, str(value)))
+        return self.renderer.render(keywords)
 
-        # Bad things happen if the file isn't closed
-        outfile_input.close()
+    def make_input_file(self, keywords, directory, text=None):
+        """ Creates the inputfile for TALYS
 
+        Parameters: keywords: the input options
+                    directory: the directory to write the input file to
+                    text: the input file from render_input_file, if already
+                          rendered
+        Returns:    None
+        Alogrithm:  Write the rendered input file and give the job the
+                    energy file, see share_energy_file
+        """
+        if text is None:
+            text = self.render_input_file(keywords)
+        energy_file = None
         if not self.astro_yes:
-            # Copy energy file  to isotope directory
-            src_energy_new = os.path.join(
-                self.root_directory, energy)
-            dst_energy_input = self.rest_directory
-            shutil.copy(src_energy_new, dst_energy_input)
+            energy_file = os.path.join(self.root_directory,
+                                       keywords['energy'])
+            if self.energy_sharing == "path":
+                # Only the written file has the path. The key of the job
+                # is from the rendered file, so it does not depend on where
+                # the campaign is
+                text = text.replace(
+                    "energy {} \n".format(keywords['energy']),
+                    "energy {} \n".format(os.path.abspath(energy_file)), 1)
+        with open(os.path.join(directory, self.reader["input_file"]),
+                  'w') as outfile_input:
+            outfile_input.write(text)
+
+        if energy_file is not None and self.energy_sharing != "path":
+            self.share_energy_file(energy_file, directory)
+
+    def share_energy_file(self, energy_file, directory):
+        """ Put the energy file of the campaign into a work directory
+
+        Parameters: energy_file: the energy file in the root directory
+                    directory: the work directory of a job
+        Returns:    None
+        Algorithm:  Link or copy the file as set by --energy-file. With
+                    auto, try the strategies from the cheapest on the
+                    first job and keep the first one that works. A
+                    strategy that fails is replaced by copying
+        """
+        strategies = (SHARE_STRATEGIES if self.energy_sharing == "auto"
+                      else (self.energy_sharing,))
+        for strategy in strategies:
+            used = share_file(energy_file, directory, strategy)
+            if used == strategy:
+                break
+        if used != self.energy_sharing:
+            if self.energy_sharing != "auto":
+                self.logger.warning("Could not %s the energy file. Copying "
+                                    "it instead", self.energy_sharing)
+            else:
+                self.logger.info("Sharing the energy file by %s", used)
+            self.energy_sharing = used
 
     def load_custom_keywords(self, talys_keywords, keywords):
         """ Load the custom blocks from input file
@@ -615,349 +677,629 @@ class Manager:
         Parameters: None
         Returns:    None
         Algorithm:  Create the root directory, make the info file and the
-                    original and result directories, then run self.run_deeper
-                    which creates the nested directories and runs TALYS
-                    appropriatley
+                    original and result directories, then make the job plan
+                    and run every job in it
         """
         start = time.time()
-        # Do a deepcopy to prevent multiprocessing mixing
-        keywords = copy.deepcopy(self.reader.keywords)
+        if self.profiler is not None:
+            self.profiler.start()
 
         # Make the info file.
         self.make_info_file()
+        self.renderer = InputRenderer(self.astro_yes)
+
+        if self.cache is not None:
+            self.configure_cache()
+
+        # send the input options to the mpichildren
+        for n in range(1, self.mpisize):
+            self.logger.debug("Sending reader to %s", n)
+            comm.send((self.reader, self.cache, self.talys_path,
+                       self.args.stage, self.args.scratch, self.use_archive),
+                      dest=n, tag=1)
+        if self.use_MPI:
+            self.report_staging()
+
+        # The directories created by the jobs, see tools.DirectoryTree
+        self.directories = DirectoryTree()
 
         # In the root directory, create a new directory to store the computations
         self.top_original_directory = os.path.join(
             self.root_directory, "original_data")
-        mkdir(self.top_original_directory)
+        self.directories.make(self.top_original_directory)
 
         # In the root directory, create a new direcotry to store the results
         self.top_result_directory = os.path.join(
             self.root_directory, "results_data")
-        mkdir(self.top_result_directory)
-
-        # Change the "current" directories. The working directory doesnt
-        # actually change
-        self.work_directory = self.top_original_directory
-        self.result_directory = self.top_result_directory
-
-        keywords["Z_nr"] = Z_nr
-        structure = [
-        {"element": "{Z_nr[element]}{element}"},
-            {"mass": "{mass}{element}"},
-            {"rest": ""},
-        ]
-        # Run the rest
-        self.run_deeper(keywords, structure)
-
+        self.directories.make(self.top_result_directory)
+
+        # The plan only describes the jobs. Their directories and files
+        # are created when the jobs are consumed in self.run_plan
+        self.plan = JobPlan(self.reader, self.top_original_directory,
+                            self.top_result_directory, Z_nr)
+        self.counter_max = len(self.plan)
+        if self.profiler is not None:
+            timers = self.profiler.timers
+            self.plan.keywords = timers.wrap("keywords", self.plan.keywords)
+            if self.use_MPI or self.use_multiprocessing:
+                self.pool.submit = timers.wrap("submit", self.pool.submit)
+        if self.use_MPI:
+            self.pool.total = self.counter_max
+        # The keywords deciding the runtime which are the same for every job
+        self.context = reader_context(self.reader)
+        # Without a runtime model every job is one unit of work, so the
+        # plan is counted without walking it
+        if self.runtime_model is None:
+            self.progress = Progress(self.counter_max)
+        else:
+            self.progress = Progress(sum(self.job_work(job)
+                                         for job in self.plan))
+        self.metrics = Metrics(self.worker_count())
+        self.status_writer = None
+        if self.args.status is not None:
+            # Fork the workers before the threads of the status writer
+            # start, so the workers do not inherit them or their locks
+            if self.use_multiprocessing and not self.args.use_async:
+                self.pool.start()
+            self.status_writer = StatusWriter(
+                self.status, os.path.join(self.root_directory, "status.json"),
+                self.args.status, self.args.status_port)
+            self.status_writer.start()
+        self.run_plan()
+
+        # Wait for the workers or MPI ranks to finish the remaining jobs
+        if self.use_MPI or self.use_multiprocessing:
+            self.pool.close()
+        if self.status_writer is not None:
+            self.status_writer.stop()
+        if self.task_index is not None:
+            self.task_index.close()
+            self.logger.info("Wrote %s jobs in %s array tasks to %s",
+                             len(self.task_index), self.task_index.tasks(),
+                             self.task_index.path)
+            if self.use_slurm:
+                self.submit_array()
+        if self.events is not None:
+            self.events.close()
+
+        if self.cache is not None:
+            self.logger.info("Result cache: %s", self.cache.report())
+            self.cache.evict()
+
+        self.logger.info("Ran %s jobs, %.1f jobs/hour",
+                         self.progress.jobs.value, self.progress.throughput())
+        if self.profiler is not None:
+            self.profiler.stop("main")
+            self.profiler.write_stages(time.time() - start)
+            self.logger.info("Wrote the profiles to %s",
+                             self.profiler.directory)
         # When the script has completed, log the total time
-        elapsed = time.strftime("%H:%M:%S", time.localtime(time.time() - start))
-        self.logger.info("Total elapsed time: %s", elapsed)
+        self.logger.info("Total elapsed time: %s",
+                         format_duration(time.time() - start))
 
-    def run_deeper(self, keywords, structure):
-        """ A recursive function that creates the directory structure
+    def submit_array(self):
+        """ Submit the jobs in the index as a SLURM array job, see --slurm
 
-        Parameters: keywords: the input keywords
-                    structure: a list of {name:style} describing the directory
-                    names. Index 0 is the top of the directory, with each
-                    subsequent directory having some knowledge of the previous,
-                    ex. [{"element":"{element}"}, {"rest":""}]
+        Parameters: None
         Returns:    None
-        Algorithm:  Iterate through structure, running talys if name=
-                    "rest" else create directories and call itself
+        Algorithm:  Save what the tasks need to run the jobs, see
+                    ArrayRunner, and write the batch script of the array
+                    job, giving each task the time of the longest one, or
+                    --task-time without timings. Submit it with sbatch
+                    unless told only to write it
         """
-        # Deepcopy the mutable variables to prevent processing mixup
-        structure = copy.deepcopy(structure)
-        keywords = copy.deepcopy(keywords)
-
-        # Iterate through the list consiting of [{name:style}, {name:style} ...]
-        for name, style in structure[0].items():
-            # The for loop is needed to keep the iteration going, but in
-            # reality it is only iterating through 1 element. Instead
-            # the list is shrunk by deleting the newly used element
-            del structure[0]
-
-            # If the name is "rest", talys will be run
-            if name == "rest":
-                self.run_rest(keywords)
-            else:
-                # If not, create the directories and go to the next level
-                # tmp_keywords is used if the keyword is a dict in order to
-                # store the resulting list
-                tmp_keywords = copy.deepcopy(keywords)
-                if isinstance(keywords[name], (dict)):
-                    # ex. keywords["prev_keyword"] = "Pr"
-                    #     keywords["mass"] = {"Pr":[128, 129], "Sm":[158, 159, 160]}
-                    #     tmp_keywords["mass"] = [128, 129]
-                    tmp_keywords[name] = keywords[name][keywords["prev_keyword"]]
-
-                # new_keywords is to overwrite the keywords[name] without
-                # interfeering with the next iteration of the loop
-                new_keywords = copy.deepcopy(tmp_keywords)
-                current_orig = self.work_directory
-                current_res = self.result_directory
-                for keyword in tmp_keywords[name]:
-                    # ex. tmp_keywords["element"] = ["Pm", "Sm", "Tb"]
-                    #     keyword = "Pm"
-                    #     new_keywords["element"] = "Pm"
-                    new_keywords[name] = keyword
-                    self.run_deeper_useless_function(keywords=new_keywords,
-                                                     keyword=keyword,
-                                                     current_orig=current_orig,
-                                                     current_res=current_res,
-                                                     name=name,
-                                                     style=style,
-                                                     structure=structure)
-
-    @support_multiprocessing(check_list=True)
-    def run_deeper_useless_function(self, keywords, keyword,
-                                    current_orig, current_res, name,
-                                    style, structure):
-        """ Split from run_deeper to support multiprocessing """
-        fmt = StyleFormatter()
-        # Create the directories with names according to the style
-        self.work_directory = os.path.join(
-            current_orig, fmt.format(style, **keywords))
-        self.result_directory = os.path.join(
-            current_res, fmt.format(style, **keywords))
-        mkdir(self.work_directory)
-        mkdir(self.result_directory)
-        # This is an ugly piece of code. Since the "mass" keyword
-        # is dependent on the current element, the current element
-        # must be stored for this function to work
-        keywords["prev_keyword"] = keyword
-        self.run_deeper(keywords, structure)
-        if self.use_multiprocessing and False:
-            self.logger.debug("%s is terminating",
-                              multiprocessing.current_process().pid)
-            self.queue.put(multiprocessing.current_process().pid)
-
-    def run_rest(self, keywords):
-        """ Creates the name of the final directory and calls self.run_talys()
-
-        The format is keyword1value-keyword2value-...-conditional1name -
-        conditional1value-conditional2name-conditional2value-...
-        in alphabetical order
-        Parameters: keywords: the input options
-        Algorithm:  Sort the keywords, combine and iterate over the keywords
-                    and dependents, set up and handle the multiprocessing,
-                    create the final directory and run self.run_talys()
+        tasks = self.task_index.tasks()
+        if not tasks:
+            self.logger.info("There are no jobs left to submit")
+            return
+        directory = os.path.dirname(self.task_index.path)
+        with open(os.path.join(directory, ArrayRunner.config_filename),
+                  "wb") as outfile:
+            pickle.dump((self.reader, self.cache, self.talys_path,
+                         self.args.stage, self.args.scratch, self.use_archive,
+                         self.root_directory), outfile)
+        if self.has_timings():
+            self.logger.info("The longest array task is predicted to take %s",
+                             format_duration(self.task_index.longest))
+            # Leave room for the variation of the runtimes and the overhead
+            seconds = 1.25*self.task_index.longest + 300
+        else:
+            # Nothing is known about the runtime of the jobs
+            seconds = self.args.task_time
+        script = os.path.join(directory, "array.sh")
+        write_batch_script(script, self.task_index.path, tasks, seconds,
+                           self.args.sbatch_options,
+                           name=os.path.basename(self.root_directory))
+        if self.args.slurm == "emit":
+            self.logger.info("Wrote %s. Submit it with sbatch %s", script,
+                             script)
+            return
+        try:
+            output = subprocess.check_output(
+                [self.args.sbatch, "--parsable", script],
+                universal_newlines=True)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            self.logger.critical("Could not submit %s: %s", script, exc)
+            return
+        # --parsable prints the job id, followed by the cluster if any
+        self.logger.info("Submitted the array job %s",
+                         output.strip().split(";")[0])
+
+    def report_staging(self):
+        """ Log where the MPI ranks run TALYS from
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Every rank reports the path to TALYS and how much it
+                    copied when it has found or staged TALYS
         """
-        if self.args.resume:
-            if self.checkpoint_list == [keywords["element"], str(keywords["mass"])]:
-                self.args.resume = False
-            else:
-                self.logger.debug("Skipping %s-%s", keywords["element"], keywords["mass"])
-                return
+        staged = 0
+        nodes = set()
+        for n in range(1, self.mpisize):
+            rank, node, path, copied = comm.recv(source=n, tag=2)
+            self.logger.debug("Rank %s on %s runs %s", rank, node, path)
+            staged += copied
+            if copied:
+                nodes.add(node)
+        if self.args.stage is not None:
+            self.logger.info("Staged TALYS on %s nodes, copying %.1f MB",
+                             len(nodes), staged/1024.0**2)
+
+    def configure_cache(self):
+        """ Prepare the result cache for this campaign
 
-        # deepcopy the mutable variables to prevent processing mixup
-        keywords = copy.deepcopy(keywords)
-
-        # Z_nr and prev_keyword were added in the previous loop. Remove them
-        del keywords["Z_nr"]
-        del keywords["prev_keyword"]
-
-        keys = []
-        values = []
-        talys_keywords = {}
-
-        # Put the keys in alphabetical order
-        sorted_keys = list(keywords.keys())
-        sorted_keys.sort()
-        for key in sorted_keys:
-            # Only use keywords that vary, and astro
-            if (len(self.reader[key]) > 1
-                and key != "element"
-                and key != "mass"):
-                # the next two lists are in alphabetical order, and
-                # corresponding key-value pair have the same index
-                keys.append(key)
-                values.append(keywords[key])
-            else:
-                talys_keywords[key] = keywords[key]
-        # 1) append the conditional names to the keywords, since they
-        # are the one to be chosen from. This is undone in 2)
-        for condition in self.reader.dependents:
-            values.append(condition.keys())
-
-        # Load the keywords from the custom blocks
-        self.load_custom_keywords(talys_keywords, keywords)
-
-        # Set the counter to inform the user on the progress
-        # It is at this stage that the script knows how many iterations it
-        # must do, so the counter_max is set only once - during the first run
-        if self.counter_max == 0:
-            self.count(values)
-
-        # Make a checkpoint at the current mass and element
-        self.make_checkpoint("{} {}".format(keywords["element"],
-                                            keywords["mass"]))
-        for value in product(*values):
-            talys_keywords_current = copy.deepcopy(talys_keywords)
-
-            # If --enable_pausing is set, check if execution shall pause
-            if self.args.enable_pausing:
-                if self.do_pause.value == 1:
-                    self.logger.debug("Waiting to be restarted...")
-                    self.pausing_queue.get()
-                    self.logger.debug("Restarting")
-
-            # 2) splits the result back into keywords and conditions
-            keywordvals = value[:len(keys)]
-            conditionkeys = value[len(keys):]
-            # Name the directory according to the alphabetical order
-            # of the keywords
-            name = ''
-            for i in range(len(keywordvals)):
-                # Add to the name
-                name = "{}-{}".format(name, keywordvals[i])
-                # add the now one-option keyword to talys_keywords
-                talys_keywords_current[keys[i]] = keywordvals[i]
-
-            # Remove the unecessary -
-            name = name[1:]
-
-            # Furthermore, name the directory accoring to the chosen condition
-            for key in conditionkeys:
-                value = self.reader.get_condition_val(key)
-                name = "{}-{}-{}".format(name, key, value)
-                talys_keywords_current[key] = value
-
-            keywords["name"] = name
-
-            # Make all values to non-lists
-            for key, val in talys_keywords_current.items():
-                if isinstance(val, (list, tuple)):
-                    talys_keywords_current[key] = val[0]
-
-            # Make the directories
-            if name:
-                self.rest_directory = os.path.join(
-                    self.work_directory, name)
-                mkdir(self.rest_directory)
-            else:
-                # If nothing varies, name the directories by a counter
-                self.rest_directory = self.work_directory
+        Parameters: None
+        Returns:    None
+        Algorithm:  Key the cache on the TALYS version and, if used, the
+                    energy file. Evict entries left above the size limit
+        """
+        if self.talys_version == "unknown":
+            self.logger.warning("Unknown TALYS version. Cached results "
+                                "from other versions may be used")
+        energy_file = None
+        if not self.astro_yes:
+            energy_file = os.path.join(self.root_directory,
+                                       self.reader['energy'][0])
+        self.cache.configure(self.talys_version, energy_file)
+        evicted = self.cache.evict()
+        self.logger.debug("Evicted %s entries from the result cache", evicted)
 
-            # Make input file
-            try:
-                self.make_input_file(talys_keywords_current)
-            except Exception as exc:
-                # No biggie. Just print an error and move on
-                self.logger.error("An error occured with %s: %s", name, exc)
-                continue
+    def run_plan(self):
+        """ Consume the job plan
 
-            # Run TALYS
-            if self.use_MPI:
-                if self.used_ranks >= self.mpisize:
-                    self.logger.debug("Waiting for available rank")
-                    try:
-                        self.send_to_rank, execution_time, errors = comm.recv(source=MPI.ANY_SOURCE)
-                        if execution_time != "null":
-                            self.logger.info('(%s/%s) %s', self.counter.value,
-                                             self.counter_max,
-                                             execution_time)
-                        for error in errors:
-                            self.logger.error(error)
-                        self.counter.value += 1
-                    finally:
-                        self.logger.debug("Sending to %s", self.send_to_rank)
-                    self.used_ranks -= 1
-                comm.send((self.rest_directory,
-                           self.result_directory,
-                           keywords["mass"],
-                           keywords["element"],
-                           keywords["name"]),
-                          dest=self.send_to_rank)
-                self.used_ranks += 1
-                self.send_to_rank = self.used_ranks
+        Parameters: None
+        Returns:    None
+        Algorithm:  Iterate through the jobs, in the order of the plan or
+                    by expected runtime, setting up each isotope when it
+                    is first reached
+        """
+        # The keywords of each isotope set up so far
+        self.isotopes = {}
+        jobs = self.plan
+        if self.args.order == "longest-first":
+            if self.runtime_model is None:
+                self.logger.warning("--order longest-first needs --timings. "
+                                    "Running in the order of the plan")
             else:
-                # No kind of multiprocessing
-                if not self.args.dummy:
-                    self.run_talys(keywords=keywords)
-                else:
-                    with open(
-                    os.path.join(self.indices_directory,
-                                 str(self.index_counter)), "w") as index_file:
-                        # The directory to work in
-                        index_file.write(self.rest_directory)
-                        index_file.write("\n")
-                        # The directory to store the results to
-                        name = keywords["name"] if keywords["name"] else ""
-                        index_file.write(
-                            os.path.join(self.result_directory,
-                                         name))
-                    self.index_counter += 1
-
-    @support_multiprocessing()
-    def run_talys(self, keywords):
-        """ Runs TALYS
+                jobs = longest_first(jobs, self.job_work)
+        for job in jobs:
+            if (job.element, job.mass) not in self.isotopes:
+                self.start_isotope(job)
+            self.run_job(job)
+
+    def job_work(self, job):
+        """ The work of a job, its predicted runtime, or 1 without --timings """
+        if self.runtime_model is None:
+            return 1.0
+        return self.runtime_model.predict(job.label, self.context)
+
+    def has_timings(self):
+        """ Whether the runtime model was fitted to any timings """
+        return self.runtime_model is not None and len(self.runtime_model) > 0
+
+    def worker_count(self):
+        """ The number of workers or MPI ranks running TALYS """
+        if self.use_MPI:
+            return self.mpisize - 1
+        if self.use_multiprocessing:
+            return self.args.processes
+        return 1
 
-        Parameters: keywords: the input options
-        Algorithm:  call system.fork() to run TALYS, and redirect the system
-                    signals and standard outputs to this python script. Log
-                    any errors and execution time
+    def worker_index(self):
+        """ The index of the worker running this process in the metrics,
+        or None for the async engine, which runs every TALYS itself """
+        if self.use_multiprocessing:
+            return getattr(self.pool, "index", None)
+        return 0
+
+    def status(self):
+        """ The live metrics of the campaign, see status.py
+
+        Parameters: None
+        Returns:    dict of the metrics, the total number of jobs and the
+                    expected seconds left
+        Algorithm:  With MPI, the jobs waiting and running are those the
+                    Dispatcher holds and has handed to the ranks
         """
+        queued = running = None
+        if self.use_MPI:
+            queued = len(self.pool.buffer)
+            running = sum(len(jobs) for jobs
+                          in list(self.pool.assigned.values()))
+        status = self.metrics.snapshot(queued, running)
+        if self.use_MPI:
+            for worker in status["workers"]:
+                worker["rank"] = worker["worker"] + 1
+        status["total"] = self.counter_max
+        status["eta"] = self.progress.eta()
+        return status
+
+    def log_progress(self):
+        """ Log the throughput and the expected time left, see Progress """
+        report = self.progress.report()
+        if report is not None:
+            self.logger.info(report)
+
+    def emit(self, event, job, key, **fields):
+        """ Log an event of a job if --events is given, see events.py """
+        if self.events is not None:
+            self.events.emit(event, key=key, label=job.label, **fields)
+
+    def start_isotope(self, job):
+        """ Set up the first job of an isotope
+
+        Parameters: job: the first Job of the isotope
+        Returns:    None
+        Algorithm:  Load the custom keywords of the isotope and create the
+                    result directory
+        """
+        custom_keywords = {}
+        self.load_custom_keywords(custom_keywords,
+                                  {"element": job.element, "mass": job.mass})
+        # Shared by every job of the isotope
+        self.isotopes[(job.element, job.mass)] = self.plan.isotope_keywords(
+            job, custom_keywords)
+        self.directories.make(job.result_directory)
+
+    def run_job(self, job):
+        """ Creates the work directory and input file of a job and runs TALYS
+
+        Parameters: job: the Job to run
+        Returns:    None
+        Algorithm:  Render the input file and skip the job if the ledger
+                    has it. Create the directory and input file. Unless
+                    the result cache has the results, hand the job to MPI,
+                    the pool of workers or run it directly. In --dummy
+                    mode, write an index file instead
+        """
+        # If --enable_pausing is set, check if execution shall pause
+        if self.args.enable_pausing:
+            if self.do_pause.value == 1:
+                self.logger.debug("Waiting to be restarted...")
+                self.pausing_queue.get()
+                self.logger.debug("Restarting")
 
-        # Actually run TALYS and time its execution
-        start = time.time()
-        with Cd(self.rest_directory):
-            process = subprocess.Popen("talys",
-                                       # Do not send signals to the subprocess
-                                       preexec_fn=os.setpgrp,
-                                       # Send the input file as stdin
-                                       stdin=open(self.reader["input_file"], "r"),
-                                       # Send stdout to the output file
-                                       stdout=open(self.reader["output_file"], "w"),
-                                       # Errors are sent to stderr
-                                       stderr=subprocess.PIPE,
-                                       # Close all file descriptors except 0, 1, 2, 3
-                                       close_fds=True)
-        # Check STDERR and see if they are non-empty
-        _, stderr = process.communicate()
-        if stderr:
-            self.logger.critical("talys could not be run: %s", stderr)
-        elapsed = time.strftime("%M:%S", time.localtime(time.time() - start))
-        info = "{mass}{element}-{name}".format(**keywords) if keywords["name"] else "{mass}{element}".format(**keywords)
+        # Make input file
+        try:
+            keywords = self.plan.keywords(
+                job, self.isotopes[(job.element, job.mass)])
+            text = self.render_input_file(keywords)
+            key = job_key(text)
+            if key in self.ledger:
+                self.logger.debug("Skipping completed %s", job.work_directory)
+                with self.counter.get_lock():
+                    self.counter.value += 1
+                self.progress.skip(self.job_work(job))
+                self.metrics.skip_job()
+                return
+            self.directories.make(job.work_directory)
+            self.make_input_file(keywords, job.work_directory, text)
+        except Exception as exc:
+            # No biggie. Just print an error and move on
+            self.logger.error("An error occured with %s: %s", job.name, exc)
+            return
+
+        # Use the results of an identical run, if there is one
+        if (self.cache is not None
+            and self.cache.fetch(self.cache.key(key), job.work_directory)):
+            self.use_cached(job, key)
+            return
+
+        # Run TALYS
+        if self.use_MPI or self.use_multiprocessing:
+            # A worker in the pool or an MPI rank picks it up as soon as
+            # it is free
+            self.metrics.submit()
+            self.pool.submit(job, key)
+        elif self.task_index is None:
+            # No kind of multiprocessing
+            self.metrics.submit()
+            self.run_talys(job, key)
+        else:
+            # Run by an array job, see arrayjobs.py
+            self.task_index.add(job, key, self.job_work(job))
+
+    def use_cached(self, job, key):
+        """ Finish a job whose files were fetched from the result cache
+
+        Parameters: job: the Job
+                    key: the key of the job in the ledger
+        Returns:    None
+        Algorithm:  Collect the results as if TALYS had been run
+        """
+        errors = self.collect_results(job, key=key)
+        for error in errors:
+            self.logger.error(error)
+        if not errors:
+            self.ledger.record(key)
+        with self.counter.get_lock():
+            self.counter.value += 1
+        self.logger.info("(%s/%s) Cached result by %s", self.counter.value,
+                         self.counter_max, job.label)
+        self.progress.skip(self.job_work(job))
+        self.metrics.skip_job(cached=True)
+
+    def start_remote(self, rank, job, key):
+        """ Log the job_start event of a job sent to an MPI rank """
+        self.emit("job_start", job, key, rank=rank)
+
+    def finish_remote(self, rank, job, key, usage, errors):
+        """ Handle a job run by an MPI rank
+
+        Parameters: rank: the rank that ran the job
+                    job: the Job
+                    key: the key of the job in the ledger
+                    usage: the resource usage of TALYS, see
+                           accounting.usage_of, or None if TALYS could
+                           not be started
+                    errors: a list of error messages from the rank
+        Returns:    None
+        Algorithm:  Log the execution time and any errors, record the
+                    job in the ledger if there were no errors and add
+                    the usage to the run log
+        """
         self.counter.value += 1
+        if usage is not None:
+            self.logger.info("(%s/%s) Execution time: %s by %s on rank %s",
+                             self.counter.value, self.counter_max,
+                             format_elapsed(usage["wall"]), job.label, rank)
+            self.record_run(job, key, usage, failed=bool(errors), rank=rank)
+        self.emit("job_failed" if errors else "job_end", job, key, rank=rank,
+                  errors=errors, **(usage or {}))
+        if usage is not None:
+            self.metrics.finish_job(usage["wall"], failed=bool(errors),
+                                    worker=rank - 1)
+        else:
+            self.metrics.finish_job(0.0, failed=True)
+        for error in errors:
+            self.logger.error(error)
+        if not errors:
+            self.ledger.record(key)
+        self.progress.finish(self.job_work(job))
+        self.log_progress()
+
+    def run_directory(self, job, key):
+        """ The directory TALYS is run in
+
+        Parameters: job: the Job to run
+                    key: the key of the job in the ledger
+        Returns:    The work directory of the job, or a directory in
+                    scratch named by the process and the key
+        """
+        if self.scratch is None:
+            return job.work_directory
+        return os.path.join(self.scratch,
+                            "talys-{}-{}".format(os.getpid(), key))
+
+    def talys_command(self, job, key):
+        """ How to run TALYS for a job
+
+        Parameters: job: the Job to run
+                    key: the key of the job in the ledger
+        Returns:    The TALYS command, the directory to run it in and the
+                    paths of the input and output files
+        Algorithm:  When running in scratch, create the directory and copy
+                    the input file and energy file there first. TALYS is
+                    started right after, so the job_start event is logged
+        """
+        directory = self.run_directory(job, key)
+        if directory != job.work_directory:
+            mkdir(directory)
+            for name in (self.reader["input_file"], self.reader["energy"][0]):
+                path = os.path.join(job.work_directory, name)
+                if os.path.exists(path):
+                    shutil.copy(path, directory)
+        self.emit("job_start", job, key)
+        if self.metrics is not None:
+            self.metrics.start_job()
+        return (self.talys_path, directory,
+                os.path.join(directory, self.reader["input_file"]),
+                os.path.join(directory, self.reader["output_file"]))
+
+    def run_talys(self, job, key):
+        """ Runs TALYS
+
+        Parameters: job: the Job to run
+                    key: the key of the job in the ledger
+        Algorithm:  call system.fork() to run TALYS in the work directory,
+                    and redirect the system signals and standard outputs to
+                    this python script. When using multiprocessing, this is
+                    run by the workers in self.pool. See
+                    accounting.run_process
+        """
+        command, cwd, input_path, output_path = self.talys_command(job, key)
+
+        # Actually run TALYS and measure its resource usage
+        with open(input_path, "r") as stdin, open(output_path, "w") as stdout:
+            stderr, usage = run_process(command, cwd, stdin, stdout)
+        self.finish_talys(job, key, stderr, usage)
+
+    def finish_talys(self, job, key, stderr, usage):
+        """ Handle the outcome of a TALYS run
+
+        Parameters: job: the Job that was run
+                    key: the key of the job in the ledger
+                    stderr: what TALYS wrote to stderr
+                    usage: the resource usage of TALYS, see
+                           accounting.usage_of. The async engine only
+                           measures the wall time and exit code
+        Algorithm:  Log any errors and the execution time, collect the
+                    result files and record the job in the ledger and
+                    the result cache if it was successful. A run writing
+                    to stderr or exiting with a non-zero code failed, see
+                    accounting.run_error. The usage is added to the run log
+        """
+        failure = run_error(stderr, usage)
+        if failure:
+            self.logger.critical(failure)
+        with self.counter.get_lock():
+            self.counter.value += 1
         self.logger.info("(%s/%s) Execution time: %s by %s",
-                         self.counter.value,
-                         self.counter_max, elapsed, info)
+                         self.counter.value, self.counter_max,
+                         format_elapsed(usage["wall"]), job.label)
 
         # Move result file to
         # TALYS-calculations-date-time/result_files/element/isotope
+        errors = self.collect_run(job, key, self.run_directory(job, key),
+                                  failed=bool(failure))
+        for error in errors:
+            self.logger.error(error)
+        if not failure and not errors:
+            self.ledger.record(key)
+        self.record_run(job, key, usage, failed=bool(failure or errors))
+        if failure:
+            errors.insert(0, failure)
+        self.emit("job_failed" if errors else "job_end", job, key,
+                  errors=errors, **usage)
+        self.metrics.finish_job(usage["wall"], failed=bool(errors),
+                                worker=self.worker_index())
+        self.progress.finish(self.job_work(job))
+        self.log_progress()
+
+    def record_run(self, job, key, usage, **extra):
+        """ Add a TALYS run to the run log
+
+        Parameters: job: the Job that was run
+                    key: the key of the job in the ledger
+                    usage: the resource usage of the run
+                    extra: anything else to store with the run
+        Returns:    None
+        Algorithm:  Store the work and result directories of the job
+                    relative to the root directory, so the harvester finds
+                    the files of the job without walking the campaign
+        """
+        self.run_log.record(
+            key, job.label, usage,
+            work_directory=os.path.relpath(job.work_directory,
+                                           self.root_directory),
+            result_directory=os.path.relpath(job.result_directory,
+                                             self.root_directory),
+            **extra)
+
+    def collect_run(self, job, key, directory, failed=False):
+        """ Collect the files of a TALYS run
+
+        Parameters: job: the Job that was run
+                    key: the key of the job in the ledger
+                    directory: where TALYS was run
+                    failed: True if TALYS reported an error
+        Returns:    A list of error messages, see collect_results
+        Algorithm:  Copy the result files to the result directory and store
+                    a successful run in the result cache. A run in scratch
+                    has its output file copied to the work directory, and
+                    its directory removed
+        """
+        start = time.time()
+        errors = self.collect_results(job, directory, key)
+        if not failed and not errors and self.cache is not None:
+            self.cache.store(self.cache.key(key), directory,
+                             self.cached_files(directory))
+        if directory != job.work_directory:
+            try:
+                shutil.copy(os.path.join(directory,
+                                         self.reader["output_file"]),
+                            job.work_directory)
+            except (IOError, OSError) as exc:
+                errors.append("Could not copy the output file: {}".format(
+                    exc))
+            shutil.rmtree(directory, ignore_errors=True)
+        self.emit("copy_done", job, key, seconds=time.time() - start)
+        return errors
+
+    def cached_files(self, directory):
+        """ The files of a run to put in the result cache
+
+        Parameters: directory: the work directory of the run
+        Returns:    A list of file names
+        Algorithm:  The result files and the output file
+        """
+        files, missing = self.find_result_files(directory)
+        return files + [self.reader["output_file"]]
+
+    def find_result_files(self, directory):
+        """ Find the files matching the patterns in result_files
+
+        Parameters: directory: the directory to search
+        Returns:    A list of matching file names, and a list of the
+                    patterns without a match
+        """
+        names = os.listdir(directory)
+        files = []
+        missing = []
+        for filename in self.reader["result_files"]:
+            pattern = re.compile(filename)
+            matches = [file for file in names if re.match(pattern, file)]
+            if not matches:
+                missing.append(filename)
+            files.extend(matches)
+        return files, missing
+
+    def collect_results(self, job, directory=None, key=None):
+        """ Copy the result files of a job to its result directory
+
+        Parameters: job: the Job that has been run
+                    directory: where TALYS was run. Defaults to the work
+                               directory of the job
+                    key: the key of the job in the ledger
+        Returns:    A list of error messages. Empty if the result files
+                    were found and copied
+        Algorithm:  Copy the files in the directory that match the
+                    patterns in result_files, prefixed by the name of the job,
+                    or append them to the archive of the isotope.
+                    If this fails, check the output file for the reason
+        """
+        if directory is None:
+            directory = job.work_directory
+        errors = []
         try:
-            for filename in self.reader["result_files"]:
-                pattern = re.compile(filename)
-                files = [file for file in os.listdir(self.rest_directory) if re.match(pattern, file)]
-                if not files:
-                    self.logger.error("Found no files matching %s", filename)
+            files, missing = self.find_result_files(directory)
+            for filename in missing:
+                errors.append("Found no files matching {}".format(filename))
+            if self.use_archive:
+                ResultArchive(job.result_directory).append(
+                    key, directory, files,
+                    {"name": job.name, "label": job.label,
+                     "element": job.element, "mass": job.mass})
+            else:
                 for file in files:
-                    fname = "{}-{}".format(keywords['name'], file) if keywords['name'] else file
-                    self.logger.debug("Copying %s to %s", file, fname)
-                    shutil.copy(os.path.join(self.rest_directory, file),
-                                os.path.join(self.result_directory,
+                    fname = "{}-{}".format(job.name, file) if job.name else file
+                    shutil.copy(os.path.join(directory, file),
+                                os.path.join(job.result_directory,
                                             fname))
         except Exception as exc:
             # Give TALYS some time to write the output.txt
             time.sleep(1)
 
-            self.logger.error(exc)
+            errors.append(str(exc))
             # The filesize of output_file is an indicator of whether the
             # execution was successful or not
-            path = os.path.join(self.rest_directory,
-                                self.reader["output_file"])
+            path = os.path.join(directory, self.reader["output_file"])
             if os.path.getsize(path) < 600:
                 # Execution failed. Open the file and log the output
                 with open(path, "r") as output_file:
                     msg = ''.join(output_file.readlines()).rstrip()
-                self.logger.error(msg[1:])
-
-        # Tell the parent process that the child has finnished
-        # The purpose of this is to let the next process begin
-        self.logger.debug("%s is terminating",
-                          multiprocessing.current_process().pid)
-        self.queue.put(multiprocessing.current_process().pid)
+                errors.append(msg[1:])
+        return errors
 
 
 # For MPI
@@ -966,94 +1308,181 @@ class ChildRunner(Manager):
     def __init__(self, rank):
         self.rank = rank
         self.use_MPI = True
-        self.reader = comm.recv(source=0, tag=1)
+        (self.reader, self.cache, talys_path, stage,
+         scratch, self.use_archive) = comm.recv(source=0, tag=1)
         self.directory = ''
+        # Only rank 0 logs events and keeps the metrics
+        self.events = None
+        self.metrics = None
+        self.scratch = None
+        if scratch is not None:
+            self.scratch = node_directory(scratch)
+        self.prepare_talys(talys_path, stage)
         self.wait_for_root()
 
+    def prepare_talys(self, talys_path, stage):
+        """ Find the TALYS to run, once for the lifetime of the rank
+
+        Parameters: talys_path: the path to TALYS found by rank 0
+                    stage: the directory to stage TALYS to, "" for the
+                           temporary directory of the node, or None to
+                           run TALYS from talys_path
+        Returns:    None
+        Algorithm:  Copy TALYS to the node-local directory unless another
+                    rank on the node already has, and report the result
+                    to rank 0
+        """
+        if stage is not None:
+            stage = node_directory(stage)
+        self.talys_path, copied = stage_talys(talys_path, stage)
+        comm.send((self.rank, platform.node(), self.talys_path, copied),
+                  dest=0, tag=2)
+
     def wait_for_root(self):
-        """ Waits for commands from the script running as rank 0
+        """ Waits for batches of jobs from the script running as rank 0
         Parameters: None
         Returns:    None
-        Algorithm:  For eternity, get commands from rank 0, break execution if
-                    commanded to do so, and run talys if commanded to do so
+        Algorithm:  Run the jobs handed out by the Dispatcher on rank 0 until
+                    told to stop. See scheduler.serve_dispatcher
         """
-        while True:
-            try:
-                work_directory, result_directory, mass, element, name = comm.recv(source=0)
-                if "stop" in name:
-                    break
-                self.errors = []
-                self.execution_time = "null"
-                self.run_talys(work_directory, result_directory,
-                               mass, element, name)
-                comm.send((self.rank, self.execution_time, self.errors), dest=0)
-            except Exception as e:
-                print("An error occured: ", e)
-
-    def run_talys(self, work_directory, result_directory, mass, element, name):
+        serve_dispatcher(comm, self.rank, self.run_talys)
+
+    def run_talys(self, job, key):
         """ Runs TALYS
 
-        Parameters: keywords: the input options
+        Parameters: job: the Job to run
+                    key: the key of the job in the ledger
+        Returns:    The resource usage of TALYS, see accounting.usage_of,
+                    and a list of error messages
         Algorithm:  call system.fork() to run TALYS, and redirect the system
-                    signals and standard outputs to this python script. Log
-                    any errors and execution time
+                    signals and standard outputs to this python script
         """
+        command, cwd, input_path, output_path = self.talys_command(job, key)
 
-        shutil.copy("talys", work_directory)
-        start = time.time()
-        with Cd(work_directory):
-            process = subprocess.Popen("./talys",
-                                       # Do not send signals to the subprocess
-                                       preexec_fn=os.setpgrp,
-                                       # Send the input file as stdin
-                                       stdin=open(self.reader["input_file"], "r"),
-                                       # Send stdout to the output file
-                                       stdout=open(self.reader["output_file"], "w"),
-                                       # Errors are sent to stderr
-                                       stderr=subprocess.PIPE,
-                                       # Close all file descriptors except 0, 1, 2, 3
-                                       close_fds=True)
-
-        # Check STDERR and see if they are non-empty
-        _, stderr = process.communicate()
-
-        if stderr:
-            self.errors.append("TALYS could not be run: {}".format(stderr.rstrip()))
-            return
-
-        os.remove(os.path.join(work_directory, "talys"))
-        elapsed = time.strftime("%M:%S", time.localtime(time.time() - start))
-        info = "{}{}-{}".format(mass, element, name) if name else "{}{}".format(mass, element)
-        self.execution_time = "Execution time: {} by {}".format(elapsed, info)
+        # TALYS is run in place, from the path found when the rank started
+        with open(input_path, "r") as stdin, open(output_path, "w") as stdout:
+            stderr, usage = run_process(command, cwd, stdin, stdout)
 
         # Move result file to
         # TALYS-calculations-date-time/result_files/element/isotope
-        try:
-            for filename in self.reader["result_files"]:
-                pattern = re.compile(filename)
-                files = [file for file in os.listdir(work_directory) if re.match(pattern, file)]
-                if not files:
-                    self.logger.error("Found no files matching %s", filename)
-                for file in files:
-                    fname = "{}-{}".format(name, file) if name else file
-                    self.logger.debug("Copying %s to %s", file, fname)
-                    shutil.copy(os.path.join(work_directory, file),
-                                os.path.join(result_directory,
-                                            fname))
-        except Exception as exc:
-            # Give TALYS some time to write the output.txt
-            time.sleep(1)
+        failure = run_error(stderr, usage)
+        errors = self.collect_run(job, key, cwd, failed=bool(failure))
+        if failure:
+            errors.insert(0, failure)
+        return usage, errors
+
+
+# For SLURM array jobs
+class ArrayRunner(ChildRunner):
+    """ Runs the jobs of a task of the array job submitted by --slurm """
+    # What the tasks need to run the jobs, saved by Manager.submit_array
+    config_filename = "config.pickle"
+
+    # Replace ChildRunner's init
+    def __init__(self, directory):
+        """ Parameters: directory: the directory of the index """
+        with open(os.path.join(directory, self.config_filename),
+                  "rb") as infile:
+            (self.reader, self.cache, talys_path, stage, scratch,
+             self.use_archive, root) = pickle.load(infile)
+        self.use_MPI = False
+        self.events = None
+        self.metrics = None
+        self.logger = logging.getLogger()
+        self.scratch = None
+        if scratch is not None:
+            self.scratch = node_directory(scratch)
+        if stage is not None:
+            stage = node_directory(stage)
+        self.talys_path, copied = stage_talys(talys_path, stage)
+        self.root_directory = root
+        self.ledger = Ledger(root)
+        self.run_log = RunLog(root)
+
+    def run_task(self, jobs):
+        """ Run the jobs of a task
+
+        Parameters: jobs: list of (Job, key), see arrayjobs.record_job
+        Returns:    The number of jobs that failed
+        Algorithm:  Skip the jobs in the ledger, as when a task is run
+                    again. Run TALYS and collect the results as an MPI rank
+                    does, then log the execution time as the Manager does,
+                    so measure.py reads the log of the task, and record
+                    the job in the ledger and run log
+        """
+        failed = 0
+        for n, (job, key) in enumerate(jobs):
+            if key in self.ledger:
+                self.logger.info("Skipping completed %s", job.label)
+                continue
+            try:
+                usage, errors = self.run_talys(job, key)
+            except (IOError, OSError) as exc:
+                self.logger.error("TALYS could not be run for %s: %s",
+                                  job.label, exc)
+                failed += 1
+                continue
+            self.logger.info("(%s/%s) Execution time: %s by %s", n + 1,
+                             len(jobs), format_elapsed(usage["wall"]),
+                             job.label)
+            self.record_run(job, key, usage, failed=bool(errors),
+                            task=os.environ.get("SLURM_ARRAY_TASK_ID"))
+            for error in errors:
+                self.logger.error(error)
+            if errors:
+                failed += 1
+            else:
+                self.ledger.record(key)
+        return failed
 
-            self.errors.append(exc)
-            # The filesize of output_file is an indicator of whether the
-            # execution was successful or not
-            path = os.path.join(work_directory,
-                                self.reader["output_file"])
-            if os.path.getsize(path) < 600:
-                # execution failed. Open the file and log the output
-                with open(path, "r") as output_file:
-                    msg = ''.join(output_file.readlines()).rstrip()
-                    self.errors.append(msg[1:])
+
+def run_array_task(index, jobs):
+    """ Run the jobs of a task of an array job, see arrayjobs.main
+
+    Parameters: index: the path of the index written by --slurm
+                jobs: list of (Job, key)
+    Returns:    The number of jobs that failed
+    """
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+                        format="%(asctime)s - %(levelname)-8s - %(message)s")
+    return ArrayRunner(os.path.dirname(index)).run_task(jobs)
+
+
+def plan_only(options, args):
+    """ Estimate the resources of a campaign without running it
+
+    Parameters: options: the input options read from file
+                args: the parsed arguments from the terminal
+    Returns:    None
+    Algorithm:  Predict the runtime of every job in the plan with the
+                runtime model and replay the run on the cores given by
+                --processes, starting the longest jobs first. Nothing
+                is created on disk
+    """
+    model = RuntimeModel.from_files(args.timings)
+    if not len(model) and args.timings:
+        print("Warning: found no timings in {}. Every job is predicted to "
+              "take {} s".format(" ".join(args.timings), RuntimeModel.default),
+              file=sys.stderr)
+    elif not len(model):
+        print("Without --timings every job is predicted to take {} s"
+              .format(RuntimeModel.default))
+    context = reader_context(options)
+    plan = JobPlan(options, "original_data", "results_data", Z_nr)
+    runtimes = sorted((model.predict(job.label, context) for job in plan),
+                      reverse=True)
+    cores = args.processes
+    if cores == 0:
+        cores = multiprocessing.cpu_count()
+    cores = cores or 1
+    wall_time = makespan(runtimes, cores)
+    print("Jobs:            {}".format(len(runtimes)))
+    print("Timings used:    {}".format(len(model)))
+    print("Core-hours:      {:.1f}".format(sum(runtimes)/3600.0))
+    print("Wall time:       {} on {} cores".format(format_duration(wall_time),
+                                                   cores))
+    # Leave room for the variation of the runtimes and the overhead
+    print("#SBATCH --time={}".format(format_duration(1.25*wall_time + 300)))
 
 """
 ###############################################################################
@@ -1062,6 +1491,15 @@ MAIN
 """
 # Keep the script from running if imported as a module
 if __name__ == "__main__":
+    # The subcommands are run by their own modules
+    if sys.argv[1:2] == ["harvest"]:
+        from harvest import main
+        main(sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ["worker"]:
+        worker_main(sys.argv[2:], run_array_task)
+        sys.exit()
+
     try:
         # Set up MPI. This must always be first
         from mpi4py import MPI
@@ -1102,6 +1540,10 @@ if __name__ == "__main__":
         options = Json_reader(args.input_filename)
         print("Loaded ", args.input_filename)
 
+        if args.plan_only:
+            plan_only(options, args)
+            sys.exit()
+
         # Create an instance of Manager to run the simulations
         with Manager(options=options, args=args) as simulations:
             simulations.run()
@@ -10,7 +10,9 @@ import sys
 import os
 import logging
 import copy
+import shutil
 import subprocess
+import tempfile
 from operator import attrgetter
 from string import Formatter
 
@@ -88,6 +90,38 @@ def mkdir(directory):
         os.makedirs(directory)
 
 
+class DirectoryTree(object):
+    """ Creates directories, remembering the ones that exist
+
+    On a network filesystem every stat and mkdir is a round trip to the
+    server. A directory is created with a single mkdir, and its parents only
+    when they are not known to exist yet, so a directory costs one call.
+    """
+
+    def __init__(self):
+        # The directories known to exist
+        self.created = set()
+
+    def make(self, directory):
+        """ Create a directory and its parents, if they do not exist
+
+        Parameters: directory: the name of the directory
+        Returns:    None
+        """
+        if directory in self.created:
+            return
+        parent = os.path.dirname(directory)
+        if parent and parent != directory:
+            self.make(parent)
+        try:
+            os.mkdir(directory)
+        except OSError:
+            # It exists, or cannot be created
+            if not os.path.isdir(directory):
+                raise
+        self.created.add(directory)
+
+
 def make_iterable(dictionary):
     """ Makes every entry in the dictionary iterable and returns the result
     Parameters: dictionary: the dict to be made iterable
@@ -153,20 +187,138 @@ def which(program):
     return None
 
 
-def talys_version(local=False):
-    """ Get the version of TALYS being used
+def node_directory(directory):
+    """ Resolve a directory on the file system local to this node
+
+    Parameters: directory: the directory, or "" for the temporary
+                           directory of the node ($TMPDIR or /tmp)
+    Returns:    The path of the directory
+    """
+    if directory == "":
+        return tempfile.gettempdir()
+    return directory
+
+
+# The ways share_file can share a file, the cheapest first
+SHARE_STRATEGIES = ("hardlink", "symlink", "reflink", "copy")
+# The ioctl cloning a file on Linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
 
-    Parameters: local: Wether to use a binary talys file in the current
+def reflink(source, destination):
+    """ Copy a file by sharing its blocks, as cp --reflink does
+
+    Parameters: source: the file to copy
+                destination: the path of the copy
+    Returns:    None
+    Algorithm:  Clone the file with the FICLONE ioctl, which only
+                filesystems such as Btrfs and XFS support. Raises
+                IOError or OSError otherwise, leaving no copy behind
+    """
+    import fcntl
+    with open(source, "rb") as infile:
+        try:
+            with open(destination, "wb") as outfile:
+                fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+        except (IOError, OSError):
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
+
+
+def share_file(source, directory, strategy="copy"):
+    """ Put a file shared by many directories into one of them
+
+    Parameters: source: the file to share
+                directory: the directory to put it in
+                strategy: one of SHARE_STRATEGIES. A symlink is relative, so
+                          the directories can be moved together
+    Returns:    The strategy used, which is "copy" if the one asked for
+                failed on this filesystem
+    """
+    destination = os.path.join(directory, os.path.basename(source))
+    if strategy != "copy":
+        try:
+            # Left by an earlier run when resuming
+            if os.path.lexists(destination):
+                os.remove(destination)
+            if strategy == "hardlink":
+                os.link(source, destination)
+            elif strategy == "symlink":
+                os.symlink(os.path.relpath(source, directory), destination)
+            else:
+                reflink(source, destination)
+            return strategy
+        except (IOError, OSError, AttributeError):
+            # Not supported on this filesystem or platform
+            pass
+    shutil.copy(source, destination)
+    return "copy"
+
+
+def find_talys(path=None, local=False):
+    """ Find the TALYS binary
+
+    Parameters: path: the path given by the user, if any
+                local: Wether to use a binary talys file in the current
                        directory or the system-wide talys
+    Returns:    The absolute path to TALYS, or None if it was not found
+    """
+    if path is not None:
+        return os.path.abspath(path)
+    if local:
+        return os.path.join(os.getcwd(), "talys")
+    path = which("talys")
+    return os.path.abspath(path) if path is not None else None
+
+
+def stage_talys(source, directory=None):
+    """ Put a copy of TALYS on a node-local file system
+
+    Parameters: source: the path to TALYS
+                directory: where to put the copy. If None, TALYS is run
+                           from source
+    Returns:    The path to run TALYS from and the number of bytes copied
+    Algorithm:  Every rank on a node shares the same copy. It is copied
+                under a temporary name in the same directory and renamed,
+                so no rank runs a partial copy, and the temporary file is
+                removed if the copy fails or is interrupted. A copy with
+                the size and modification time of source is reused
+    """
+    if directory is None:
+        return source, 0
+    mkdir(directory)
+    target = os.path.join(directory, os.path.basename(source))
+    stat = os.stat(source)
+    if os.path.exists(target):
+        existing = os.stat(target)
+        if (existing.st_size == stat.st_size and
+                int(existing.st_mtime) == int(stat.st_mtime)):
+            return target, 0
+    tmp = "{}.tmp-{}".format(target, os.getpid())
+    try:
+        # copy2 keeps the mode and the modification time
+        shutil.copy2(source, tmp)
+        os.rename(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return target, stat.st_size
+
+
+def talys_version(talys_path=None):
+    """ Get the version of TALYS being used
+
+    Parameters: talys_path: the path to TALYS. Defaults to the
+                            system-wide talys
     Returns:    String of the format #.#
     Algorithm:  Call shell command "strings" and greps the result
     """
     # Find the path of TALYS
-    if local:
-        talys_path = os.path.join(os.getcwd(), "talys")
-    else:
-        talys_path = which("talys")
-    if talys_path is None or "talys" not in talys_path:
+    if talys_path is None:
+        talys_path = find_talys()
+    if talys_path is None or not os.path.isfile(talys_path):
         raise RuntimeError("Could not find talys.")
 
     # Use the UNIX command 'strings' to extract all strings from
@@ -251,8 +403,8 @@ def get_args():
                         action="store_true",
                         dest="enable_pausing")
     parser.add_argument("--multi",
-                        help=("the name of the level at which multiprocessing will be run."
-                              "\nThis should only be used if _only_ mass and elements vary"),
+                        help=("deprecated and ignored. Every TALYS run is handed"
+                              "\nto the pool of workers set up by --processes"),
                         nargs='+', type=str, default=[])
     parser.add_argument("--default-excepthook",
                         help="use the default excepthook",
@@ -263,10 +415,132 @@ def get_args():
                         action="store_true",
                         dest="disable_filters")
     parser.add_argument("-r", "--resume",
-                        help=("resume from previous checkpoint. If there are"
-                              "\nmore than one TALYS-directory, it will choose"
-                              "\nthe last directory"),
+                        help=("resume the latest TALYS-directory, skipping"
+                              "\nthe jobs recorded as completed in its ledger"),
+                        action="store_true")
+    parser.add_argument("--async",
+                        help=("run TALYS from a single asyncio event loop instead"
+                              "\nof a pool of worker processes. The number of"
+                              "\nconcurrent runs is set by --processes. Python 3 only"),
+                        action="store_true",
+                        dest="use_async")
+    parser.add_argument("--cache",
+                        help=("directory of a result cache shared between runs."
+                              "\nA job with the same input file, TALYS version and"
+                              "\nenergy file as a cached run is not run again"),
+                        type=str, default=None,
+                        metavar='CACHE_DIRECTORY')
+    parser.add_argument("--cache-size",
+                        help="the maximum size of the result cache in MB",
+                        type=int, default=10240,
+                        metavar='MB',
+                        dest="cache_size")
+    parser.add_argument("--batch-time",
+                        help=("the number of seconds of work to hand an MPI rank"
+                              "\nat a time. The size of the batches is adapted"
+                              "\nto the runtime of the jobs"),
+                        type=float, default=30,
+                        metavar='SECONDS',
+                        dest="batch_time")
+    parser.add_argument("--talys",
+                        help=("path to the TALYS binary. Defaults to talys in the"
+                              "\ncurrent directory when using MPI, and otherwise"
+                              "\nto talys in PATH"),
+                        type=str, default=None,
+                        metavar='TALYS_PATH',
+                        dest="talys_path")
+    parser.add_argument("--stage",
+                        help=("copy TALYS once to a node-local DIRECTORY and run it"
+                              "\nfrom there on every MPI rank of the node."
+                              "\nIf no DIRECTORY is given, $TMPDIR or /tmp is used"),
+                        type=str, nargs="?", default=None, const="",
+                        metavar='DIRECTORY')
+    parser.add_argument("--timings",
+                        help=("the timings of earlier campaigns: the log of talys.py,"
+                              "\na CSV from the harvester or measure.py, or the"
+                              "\nTALYS-calculations directory of the campaign"),
+                        nargs='+', type=str, default=[],
+                        metavar='FILE')
+    parser.add_argument("--order",
+                        help=("the order the jobs are run in. longest-first starts"
+                              "\nthe jobs expected to take the longest first, as"
+                              "\npredicted from --timings"),
+                        choices=["plan", "longest-first"], default="plan")
+    parser.add_argument("--events",
+                        help=("write the start, end and failure of every job as"
+                              "\nlines of JSON to FILE in the TALYS-calculations"
+                              "\ndirectory. Defaults to events.jsonl. Python 3 only"),
+                        type=str, nargs="?", default=None, const="events.jsonl",
+                        metavar='FILE')
+    parser.add_argument("--status",
+                        help=("write the live metrics of the campaign to status.json"
+                              "\nin the TALYS-calculations directory every SECONDS."
+                              "\nDefaults to every 30 seconds"),
+                        type=float, nargs="?", default=None, const=30,
+                        metavar='SECONDS')
+    parser.add_argument("--status-port",
+                        help="also serve the live metrics on localhost:PORT",
+                        type=int, default=None,
+                        metavar='PORT',
+                        dest="status_port")
+    parser.add_argument("--profile",
+                        help=("time the stages of the jobs and profile the main"
+                              "\nprocess, or also the workers of -p, with cProfile"
+                              "\nand tracemalloc. Written to profile in the"
+                              "\nTALYS-calculations directory"),
+                        type=str, nargs="?", default=None, const="main",
+                        choices=["main", "workers"])
+    parser.add_argument("--plan-only",
+                        help=("print the number of jobs and the core-hours and wall"
+                              "\ntime predicted from --timings on the cores given by"
+                              "\n--processes, then exit without running anything"),
+                        action="store_true",
+                        dest="plan_only")
+    parser.add_argument("--archive",
+                        help=("append the result files of each isotope to one"
+                              "\nindexed archive instead of copying them one by one."
+                              "\nSee archive.py"),
                         action="store_true")
+    parser.add_argument("--scratch",
+                        help=("run each TALYS in a node-local DIRECTORY, copying"
+                              "\nonly the result files and the output file back."
+                              "\nIf no DIRECTORY is given, $TMPDIR or /tmp is used"),
+                        type=str, nargs="?", default=None, const="",
+                        metavar='DIRECTORY')
+    parser.add_argument("--chunk",
+                        help=("with --dummy or --slurm, the number of consecutive"
+                              "\njobs each array task runs. See arrayjobs.py"),
+                        type=int, default=None, metavar="K")
+    parser.add_argument("--energy-file",
+                        help=("how to give the energy file to each job: auto picks"
+                              "\nthe cheapest the filesystem supports of hardlink,"
+                              "\nsymlink, reflink and copy. path writes its absolute"
+                              "\npath into the input file instead"),
+                        type=str, default="auto",
+                        choices=["auto", "hardlink", "symlink", "reflink",
+                                 "copy", "path"],
+                        dest="energy_file")
+    parser.add_argument("--slurm",
+                        help=("create the jobs and submit them as a SLURM array"
+                              "\njob instead of running them, or with emit only"
+                              "\nwrite its batch script. See arrayjobs.py"),
+                        type=str, nargs="?", default=None, const="submit",
+                        choices=["submit", "emit"])
+    parser.add_argument("--task-time",
+                        help=("with --slurm, pack each array task with the jobs"
+                              "\npredicted by --timings to take SECONDS. Without"
+                              "\ntimings, the time limit of each task"),
+                        type=float, default=3600, metavar="SECONDS",
+                        dest="task_time")
+    parser.add_argument("--sbatch-options",
+                        help=("more options for the array job of --slurm, as"
+                              "\ngiven to sbatch, e.g."
+                              "\n--sbatch-options=\"--account=uio --mem-per-cpu=1G\""),
+                        type=str, default="", metavar="OPTIONS",
+                        dest="sbatch_options")
+    parser.add_argument("--sbatch",
+                        help="the sbatch command used by --slurm",
+                        type=str, default="sbatch", metavar="COMMAND")
     parser.add_argument("--dummy",
                         help="for not run TALYS, only create the directories",
                         action="store_true")
@@ -2,20 +2,31 @@
 #SBATCH --account=uio
 #SBATCH --job-name=$TASK_ID
 #SBATCH --time=1:0:0
+# Set from the largest run of an earlier campaign, see accounting.py
 #SBATCH --mem-per-cpu=1G
 source /cluster/bin/jobsetup
 module purge   # clear any inherited modules
 set -o errexit # exit on errors
 
-WORKDIR="$SUBMITDIR/$(head -n1 indices/$TASK_ID)"
-RESULTDIR="$SUBMITDIR/$(tail -n1 indices/$TASK_ID)"
-cleanup "cp * $WORKDIR"
-cleanup "cp astrorate.g $RESULTDIR/astrorate.g"
-cleanup "cp astrorate.tot $RESULTDIR/astrorate.tot"
-cleanup "cp output.txt $RESULTDIR/output.txt"
-
-cp $WORKDIR/input.txt $SCRATCH
+# The jobs of this task, one per line. More than one with --chunk.
+# Only the first three fields are needed here, see arrayjobs.py
+python talys.py worker --task-id $TASK_ID > $SCRATCH/jobs.txt
 cp talys $SCRATCH
-cd $SCRATCH
-./talys < input.txt > output.txt
-rm talys
+
+while IFS=$'\t' read -r WORKDIR RESULTDIR KEY _; do
+    WORKDIR="$SUBMITDIR/$WORKDIR"
+    RESULTDIR="$SUBMITDIR/$RESULTDIR"
+    LEDGER="${WORKDIR%%/original_data/*}/ledger"
+    RUNDIR="$SCRATCH/$KEY"
+
+    mkdir -p "$RUNDIR" "$RESULTDIR"
+    cp "$WORKDIR/input.txt" "$RUNDIR"
+    cd "$RUNDIR"
+    "$SCRATCH/talys" < input.txt > output.txt
+    cp astrorate.g astrorate.tot output.txt "$RESULTDIR"
+    cp * "$WORKDIR"
+    cd "$SCRATCH"
+    rm -r "$RUNDIR"
+    # Mark the job as completed so that talys.py --resume skips it
+    echo "$KEY" >> "$LEDGER"
+done < $SCRATCH/jobs.txt